@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Cache of the parsed text arrays, so that a text file read several times is
+parsed only once.
+
+Each parsed array is stored as a '.npy' file in a cache directory, keyed on
+the text file real path, size and mtime and on the parsed data type. A hit
+is memory mapped without parsing. The least recently used arrays are
+removed when the cache exceeds its size limit.
+"""
+
+# System import
+import os
+import hashlib
+import tempfile
+
+# Third party import
+import numpy
+
+
+# The default size limit of a cache directory in bytes
+CACHE_SIZE = 1024 * 1024 * 1024
+
+# The extension of the cached arrays
+CACHE_EXTENSION = ".npy"
+
+
+def cache_key(filepath, dtype="float64"):
+    """ Compute the cache key of a text array.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    dtype: str (optional, default 'float64')
+        the data type of the parsed array.
+
+    Returns
+    -------
+    key: str
+        a key that changes when the file is modified.
+    """
+    stat = os.stat(filepath)
+    mtime = getattr(stat, "st_mtime_ns", int(stat.st_mtime * 1e9))
+    signature = "{0}:{1}:{2}:{3}".format(
+        os.path.realpath(filepath), stat.st_size, mtime,
+        numpy.dtype(dtype).str)
+    return hashlib.md5(signature.encode("utf-8")).hexdigest()
+
+
+def load_cached_array(filepath, cache_dir, dtype="float64"):
+    """ Get the cached array of a text file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    cache_dir: str (mandatory)
+        the cache directory.
+    dtype: str (optional, default 'float64')
+        the data type of the parsed array.
+
+    Returns
+    -------
+    array: memmap
+        the read-only memory mapped array, None if not cached.
+    """
+    cached = os.path.join(cache_dir, cache_key(filepath, dtype) +
+                          CACHE_EXTENSION)
+    try:
+        array = numpy.load(cached, mmap_mode="r")
+    except (IOError, OSError, ValueError):
+        return None
+
+    # Mark the array as recently used
+    try:
+        os.utime(cached, None)
+    except OSError:
+        pass
+    return array
+
+
+def store_cached_array(filepath, array, cache_dir, max_size=CACHE_SIZE):
+    """ Cache the parsed array of a text file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    array: array (mandatory)
+        the parsed array.
+    cache_dir: str (mandatory)
+        the cache directory, created if necessary.
+    max_size: int (optional, default 1 GiB)
+        the size limit of the cache directory in bytes.
+
+    Returns
+    -------
+    cached: str
+        the cached array file, None if the array exceeds the size limit.
+    """
+    if array.nbytes > max_size:
+        return None
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+    cached = os.path.join(cache_dir, cache_key(filepath, array.dtype) +
+                          CACHE_EXTENSION)
+    fd, tmpfile = tempfile.mkstemp(prefix=".", dir=cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as openfile:
+            numpy.save(openfile, array)
+        getattr(os, "replace", os.rename)(tmpfile, cached)
+    except:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+    evict_cached_arrays(cache_dir, max_size, keep=cached)
+    return cached
+
+
+def evict_cached_arrays(cache_dir, max_size=CACHE_SIZE, keep=None):
+    """ Remove the least recently used arrays of a cache directory.
+
+    Parameters
+    ----------
+    cache_dir: str (mandatory)
+        the cache directory.
+    max_size: int (optional, default 1 GiB)
+        the size limit of the cache directory in bytes.
+    keep: str (optional, default None)
+        a cached array never removed.
+
+    Returns
+    -------
+    removed: list of str
+        the removed cached arrays.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_EXTENSION):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, path, stat.st_size))
+        total += stat.st_size
+    removed = []
+    for _, path, size in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    return removed
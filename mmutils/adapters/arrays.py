@@ -0,0 +1,1033 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Out-of-core tools to normalize the columns of 2D arrays stored in files.
+
+The arrays are read by blocks of rows so that the memory usage depends on
+the block size, not on the file size. Three file formats are supported:
+whitespace delimited 'text', numpy 'npy' and 'raw' binary data, the binary
+formats being memory mapped. Large text files can be parsed and written
+by a pool of processes, each one handling a range of lines.
+
+The columns are z-scored ('zscore'), centered on the median and scaled by
+the interquartile range ('robust'), or scaled to [0, 1] ('minmax'), the
+robust statistics being estimated with a streaming quantile sketch.
+"""
+
+# System import
+from __future__ import absolute_import
+import io
+import os
+import shutil
+import tempfile
+import warnings
+import functools
+import itertools
+import multiprocessing
+
+# Third party import
+import numpy
+
+# mmutils import
+from .sketch import QuantileSketch
+from .arraycache import load_cached_array
+from .arraycache import store_cached_array
+
+
+# The file formats associated to the file extensions, 'text' by default
+FORMATS = {
+    ".npy": "npy",
+    ".raw": "raw",
+    ".mmap": "raw"}
+
+# The extension of the files generated in each format
+EXTENSIONS = {
+    "text": ".txt",
+    "npy": ".npy",
+    "raw": ".raw"}
+
+# The size in bytes of the blocks of rows read from memory mapped arrays
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# The number of ranges of lines parsed or formatted by each process
+RANGES_PER_WORKER = 4
+
+# The normalization methods
+METHODS = ("zscore", "robust", "minmax")
+
+
+class RunningMoments(object):
+    """ Column means and variances accumulated over blocks of rows.
+
+    The blocks are merged with the parallel algorithm of Chan et al., so
+    that moments computed on separate blocks or files can be combined.
+    """
+    def __init__(self):
+        """ Initialize the RunningMoments class.
+        """
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, block):
+        """ Add a block of rows.
+
+        Parameters
+        ----------
+        block: array (mandatory)
+            a 2D array of shape (rows, columns), the reductions being
+            accumulated in float64 whatever the array data type.
+        """
+        if block.shape[0] == 0:
+            return
+        other = RunningMoments()
+        other.count = block.shape[0]
+        other.mean = block.mean(axis=0, dtype=numpy.float64)
+        dtype = block.dtype
+        if not numpy.issubdtype(dtype, numpy.floating):
+            dtype = numpy.float64
+        diff = numpy.subtract(block, other.mean, dtype=dtype)
+        numpy.multiply(diff, diff, out=diff)
+        other.m2 = diff.sum(axis=0, dtype=numpy.float64)
+        self.merge(other)
+
+    def merge(self, other):
+        """ Merge the moments of another set of rows.
+
+        Parameters
+        ----------
+        other: RunningMoments (mandatory)
+            the moments to merge.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            self.m2 = other.m2.copy()
+            return
+        if len(other.mean) != len(self.mean):
+            raise ValueError("Can not merge statistics of {0} and {1} "
+                             "columns.".format(len(self.mean),
+                                               len(other.mean)))
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (float(other.count) / count)
+        self.m2 = (self.m2 + other.m2 +
+                   delta ** 2 * (float(self.count) * other.count / count))
+        self.count = count
+
+    @property
+    def std(self):
+        """ The column standard deviations (normalized by the number of
+        rows, as numpy.std).
+        """
+        return numpy.sqrt(self.m2 / self.count)
+
+
+def iter_text_blocks(filepath, chunk_size, dtype="float64"):
+    """ Read a whitespace delimited text array by blocks of rows.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    chunk_size: int (mandatory)
+        the number of rows of each block.
+    dtype: str (optional, default 'float64')
+        the data type of the blocks.
+
+    Returns
+    -------
+    blocks: iterator of array
+        the successive 2D blocks of rows.
+    """
+    with open(filepath, "r") as openfile:
+        while True:
+            lines = list(itertools.islice(openfile, chunk_size))
+            if not lines:
+                break
+            block = numpy.loadtxt(lines, dtype=dtype, ndmin=2)
+            if block.size > 0:
+                yield block
+
+
+def text_moments(filepath, chunk_size):
+    """ Compute the column moments of a text array by blocks of rows.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    chunk_size: int (mandatory)
+        the number of rows read at once.
+
+    Returns
+    -------
+    moments: RunningMoments
+        the column moments.
+    """
+    moments = RunningMoments()
+    for block in iter_text_blocks(filepath, chunk_size):
+        moments.update(block)
+    return moments
+
+
+def text_byte_ranges(filepath, nb_ranges):
+    """ Split a text file in byte ranges aligned on line boundaries.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    nb_ranges: int (mandatory)
+        the requested number of ranges, less ranges are returned for small
+        files.
+
+    Returns
+    -------
+    ranges: list of 2-uplet
+        the (start, end) offsets of each range.
+    """
+    size = os.path.getsize(filepath)
+    offsets = [0]
+    with open(filepath, "rb") as openfile:
+        for index in range(1, nb_ranges):
+            position = max(size * index // nb_ranges, offsets[-1])
+            if position >= size:
+                break
+            if position == 0:
+                # Less bytes than ranges: no boundary before the first byte
+                continue
+            openfile.seek(position - 1)
+            openfile.readline()
+            position = openfile.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def parse_text_range(filepath, start, end, dtype="float64"):
+    """ Parse the lines of a whitespace delimited text array in a byte
+    range.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    start, end: int (mandatory)
+        the byte range aligned on line boundaries.
+    dtype: str (optional, default 'float64')
+        the data type of the block.
+
+    Returns
+    -------
+    block: array
+        the 2D block of rows, of shape (0, 0) if the range has no rows.
+    """
+    with open(filepath, "rb") as openfile:
+        openfile.seek(start)
+        data = openfile.read(end - start)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        block = numpy.loadtxt(io.BytesIO(data), dtype=dtype, ndmin=2)
+    if block.size == 0:
+        return numpy.empty((0, 0), dtype=dtype)
+    return block
+
+
+def load_text(filepath, max_workers=1, dtype="float64"):
+    """ Load a whitespace delimited text array.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the text file.
+    max_workers: int (optional, default 1)
+        the number of processes parsing ranges of lines, the file is
+        parsed with 'numpy.loadtxt' in the current process if lower than 2.
+    dtype: str (optional, default 'float64')
+        the data type of the array.
+
+    Returns
+    -------
+    array: array
+        the 2D array.
+    """
+    if max_workers <= 1:
+        return numpy.loadtxt(filepath, dtype=dtype, ndmin=2)
+
+    # Parse byte ranges in parallel and stitch the blocks in a preallocated
+    # array
+    ranges = text_byte_ranges(filepath, RANGES_PER_WORKER * max_workers)
+    pool = multiprocessing.Pool(max_workers)
+    try:
+        blocks = pool.map(_parse_text_range,
+                          [(filepath, start, end, dtype)
+                           for start, end in ranges])
+    finally:
+        pool.terminate()
+        pool.join()
+    blocks = [block for block in blocks if block.size > 0]
+    if not blocks:
+        return numpy.loadtxt(filepath, dtype=dtype, ndmin=2)
+    nb_columns = blocks[0].shape[1]
+    for block in blocks:
+        if block.shape[1] != nb_columns:
+            raise ValueError("Wrong number of columns in '{0}'.".format(
+                filepath))
+    array = numpy.empty((sum([block.shape[0] for block in blocks]),
+                         nb_columns), dtype=dtype)
+    offset = 0
+    for block in blocks:
+        array[offset:offset + block.shape[0]] = block
+        offset += block.shape[0]
+    return array
+
+
+def format_text(block, fmt="%5.8f"):
+    """ Format a block of rows as 'numpy.savetxt' does.
+
+    Parameters
+    ----------
+    block: array (mandatory)
+        a 2D array.
+    fmt: str (optional, default '%5.8f')
+        the format of each value.
+
+    Returns
+    -------
+    data: bytes
+        the formatted rows.
+    """
+    openfile = io.BytesIO()
+    numpy.savetxt(openfile, block, fmt=fmt)
+    return openfile.getvalue()
+
+
+def save_text(filepath, array, max_workers=1, fmt="%5.8f"):
+    """ Save a 2D array as whitespace delimited text.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the destination file.
+    array: array (mandatory)
+        a 2D array.
+    max_workers: int (optional, default 1)
+        the number of processes formatting blocks of rows, the array is
+        formatted in the current process if lower than 2.
+    fmt: str (optional, default '%5.8f')
+        the format of each value.
+    """
+    pool = None
+    if max_workers > 1:
+        pool = multiprocessing.Pool(max_workers)
+    try:
+        with open(filepath, "wb") as openfile:
+            _write_text(openfile, array, pool, max_workers, fmt)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def array_format(filepath, fmt=None):
+    """ Get the format of an array file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the array file.
+    fmt: str (optional, default None)
+        the file format, deduced from the extension if not set.
+
+    Returns
+    -------
+    fmt: str
+        the file format: 'text', 'npy' or 'raw'.
+    """
+    if fmt is None:
+        fmt = FORMATS.get(os.path.splitext(filepath)[1].lower(), "text")
+    if fmt not in EXTENSIONS:
+        raise ValueError("'{0}' is not a valid array format, expect one of "
+                         "{1}.".format(fmt, sorted(EXTENSIONS)))
+    return fmt
+
+
+def output_array_path(filepath, input_format=None, output_format=None,
+                      output_directory=None, prefix=""):
+    """ Get the path of a normalized array file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the input array file.
+    input_format: str (optional, default None)
+        the input format, deduced from the extension if not set.
+    output_format: str (optional, default None)
+        the output format, the input format if not set.
+    output_directory: str (optional, default None)
+        the output directory, the input file directory if not set.
+    prefix: str (optional, default '')
+        the prefix of the output file name.
+
+    Returns
+    -------
+    outfile: str
+        the output file, the input file if the format, directory and name
+        are not changed.
+    """
+    input_format = array_format(filepath, input_format)
+    output_format = array_format(filepath, output_format or input_format)
+    dirname, basename = os.path.split(filepath)
+    if output_format != input_format:
+        basename = os.path.splitext(basename)[0] + EXTENSIONS[output_format]
+    return os.path.join(output_directory or dirname, prefix + basename)
+
+
+def open_memmap_array(filepath, fmt, mode="r", raw_dtype="float64",
+                      raw_columns=None):
+    """ Memory map a binary array file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the array file.
+    fmt: str (mandatory)
+        the file format: 'npy' or 'raw'.
+    mode: str (optional, default 'r')
+        the memory map mode.
+    raw_dtype: str (optional, default 'float64')
+        the data type of a 'raw' file.
+    raw_columns: int (optional, default None)
+        the number of columns of a 'raw' file, mandatory for this format.
+
+    Returns
+    -------
+    array: memmap
+        the memory mapped 2D array.
+    """
+    if fmt == "npy":
+        array = numpy.load(filepath, mmap_mode=mode)
+    elif fmt == "raw":
+        if raw_columns is None:
+            raise ValueError("The number of columns of the raw array "
+                             "'{0}' must be specified.".format(filepath))
+        itemsize = numpy.dtype(raw_dtype).itemsize
+        rows = os.path.getsize(filepath) // (itemsize * raw_columns)
+        array = numpy.memmap(filepath, dtype=raw_dtype, mode=mode,
+                             shape=(rows, raw_columns))
+    else:
+        raise ValueError("A '{0}' array can not be memory mapped.".format(
+            fmt))
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    return array
+
+
+def iter_array_blocks(array, chunk_size=None):
+    """ Iterate over the blocks of rows of a memory mapped array.
+
+    Parameters
+    ----------
+    array: array (mandatory)
+        a 2D array.
+    chunk_size: int (optional, default None)
+        the number of rows of each block, blocks of about 64 MiB if not set.
+
+    Returns
+    -------
+    blocks: iterator of array
+        the successive views on the blocks of rows.
+    """
+    if chunk_size is None:
+        row_bytes = max(array.shape[1] * array.itemsize, 1)
+        chunk_size = max(BLOCK_BYTES // row_bytes, 1)
+    for start in range(0, array.shape[0], chunk_size):
+        yield array[start:start + chunk_size]
+
+
+class ArrayWriter(object):
+    """ Write an array block by block in a temporary file that replaces the
+    destination file when closed.
+    """
+    def __init__(self, outfile, fmt, shape, dtype="float64", max_workers=1):
+        """ Initialize the ArrayWriter class.
+
+        Parameters
+        ----------
+        outfile: str (mandatory)
+            the destination file.
+        fmt: str (mandatory)
+            the destination format: 'text', 'npy' or 'raw'.
+        shape: 2-uplet (mandatory)
+            the array shape.
+        dtype: str (optional, default 'float64')
+            the data type of a binary array.
+        max_workers: int (optional, default 1)
+            the number of processes formatting the text rows.
+        """
+        self.outfile = outfile
+        self.fmt = fmt
+        self.max_workers = max_workers
+        self.pool = None
+        fd, self.tmpfile = tempfile.mkstemp(
+            prefix=os.path.basename(outfile),
+            dir=os.path.dirname(os.path.abspath(outfile)))
+        os.close(fd)
+        self.offset = 0
+        if fmt == "text":
+            self.openfile = open(self.tmpfile, "wb")
+            if max_workers > 1:
+                self.pool = multiprocessing.Pool(max_workers)
+        elif fmt == "npy":
+            self.array = numpy.lib.format.open_memmap(
+                self.tmpfile, mode="w+", dtype=dtype, shape=tuple(shape))
+        else:
+            self.array = numpy.memmap(self.tmpfile, dtype=dtype, mode="w+",
+                                      shape=tuple(shape))
+
+    def write(self, block):
+        """ Write the next block of rows.
+        """
+        if self.fmt == "text":
+            _write_text(self.openfile, block, self.pool, self.max_workers)
+        else:
+            self.array[self.offset:self.offset + block.shape[0]] = block
+        self.offset += block.shape[0]
+
+    def close(self):
+        """ Finalize the destination file.
+        """
+        try:
+            if self.fmt == "text":
+                self.openfile.close()
+                self._close_pool()
+            else:
+                self.array.flush()
+                del self.array
+            if os.path.isfile(self.outfile):
+                shutil.copymode(self.outfile, self.tmpfile)
+            getattr(os, "replace", os.rename)(self.tmpfile, self.outfile)
+        except:
+            self.abort()
+            raise
+
+    def abort(self):
+        """ Remove the temporary file.
+        """
+        if self.fmt == "text":
+            self.openfile.close()
+            self._close_pool()
+        if os.path.isfile(self.tmpfile):
+            os.remove(self.tmpfile)
+
+    def _close_pool(self):
+        """ Stop the formatting processes.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def open_array_blocks(filepath, input_format=None, chunk_size=None,
+                      raw_dtype="float64", raw_columns=None, max_workers=1,
+                      mode="r", dtype=None, cache_dir=None):
+    """ Open an array file as a source of blocks of rows.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the array file.
+    input_format: str (optional, default None)
+        the file format, deduced from the extension if not set.
+    chunk_size: int (optional, default None)
+        the number of rows of each block.
+    raw_dtype: str (optional, default 'float64')
+        the data type of a 'raw' file.
+    raw_columns: int (optional, default None)
+        the number of columns of a 'raw' file.
+    max_workers: int (optional, default 1)
+        the number of processes parsing a text file loaded at once.
+    mode: str (optional, default 'r')
+        the memory map mode of the binary files.
+    dtype: str (optional, default None)
+        the data type of the parsed text, float64 if not set.
+    cache_dir: str (optional, default None)
+        a cache directory of the parsed text arrays: a cached array is
+        memory mapped instead of being parsed, a text file loaded at once
+        is cached.
+
+    Returns
+    -------
+    array: array
+        the memory mapped or loaded array, None for a text file read by
+        blocks.
+    blocks: callable
+        a function returning a new iterator over the blocks of rows.
+    """
+    input_format = array_format(filepath, input_format)
+    dtype = dtype or "float64"
+    cached = None
+    if input_format == "text" and cache_dir is not None:
+        cached = load_cached_array(filepath, cache_dir, dtype)
+    if cached is not None:
+        array = cached
+
+        def blocks():
+            return iter_array_blocks(array, chunk_size)
+    elif input_format != "text":
+        array = open_memmap_array(filepath, input_format, mode=mode,
+                                  raw_dtype=raw_dtype,
+                                  raw_columns=raw_columns)
+
+        def blocks():
+            return iter_array_blocks(array, chunk_size)
+    elif chunk_size is not None:
+        array = None
+
+        def blocks():
+            return iter_text_blocks(filepath, chunk_size, dtype)
+    else:
+        array = load_text(filepath, max_workers, dtype)
+        if cache_dir is not None:
+            store_cached_array(filepath, array, cache_dir)
+
+        def blocks():
+            return iter([array])
+    return array, blocks
+
+
+def column_statistics(method="zscore"):
+    """ Create the mergeable column statistics of a normalization method.
+
+    Parameters
+    ----------
+    method: str (optional, default 'zscore')
+        the normalization method: 'zscore', 'robust' or 'minmax'.
+
+    Returns
+    -------
+    statistics: RunningMoments or QuantileSketch
+        empty statistics with 'update' and 'merge' methods.
+    """
+    if method not in METHODS:
+        raise ValueError("'{0}' is not a valid normalization method, expect "
+                         "one of {1}.".format(method, METHODS))
+    if method == "zscore":
+        return RunningMoments()
+    return QuantileSketch()
+
+
+def file_statistics(filepath, method="zscore", input_format=None,
+                    chunk_size=None, raw_dtype="float64", raw_columns=None,
+                    dtype=None):
+    """ Compute the column statistics of an array file.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the array file.
+    method: str (optional, default 'zscore')
+        the normalization method: 'zscore', 'robust' or 'minmax'.
+    input_format, chunk_size, raw_dtype, raw_columns, dtype: (optional)
+        see 'open_array_blocks'.
+
+    Returns
+    -------
+    statistics: RunningMoments or QuantileSketch
+        the column statistics.
+    """
+    _, blocks = open_array_blocks(filepath, input_format, chunk_size,
+                                  raw_dtype, raw_columns, dtype=dtype)
+    statistics = column_statistics(method)
+    for block in blocks():
+        statistics.update(block)
+    return statistics
+
+
+def normalize_file(filepath, outfile, input_format=None, output_format=None,
+                   chunk_size=None, raw_dtype="float64", raw_columns=None,
+                   max_workers=1, normalizer=None, dtype=None,
+                   method="zscore", cache_dir=None):
+    """ Normalize the columns of an array file.
+
+    Binary inputs are memory mapped and processed by blocks of rows. If the
+    input and output files are the same floating point binary file, the
+    normalization is done in place in the memory map. Text inputs are
+    loaded at once, ranges of lines being parsed by 'max_workers'
+    processes, or streamed twice by blocks of 'chunk_size' rows, the parsed
+    blocks being normalized in place.
+
+    The computations are done in 'dtype', float32 halving the memory used
+    by the blocks, whereas the column statistics are always accumulated in
+    float64.
+
+    Parameters
+    ----------
+    filepath: str (mandatory)
+        the input array file.
+    outfile: str (mandatory)
+        the output array file, may be the input file.
+    input_format: str (optional, default None)
+        the input format, deduced from the extension if not set.
+    output_format: str (optional, default None)
+        the output format, deduced from the extension if not set.
+    chunk_size: int (optional, default None)
+        the number of rows processed at once.
+    raw_dtype: str (optional, default 'float64')
+        the data type of the 'raw' arrays.
+    raw_columns: int (optional, default None)
+        the number of columns of a 'raw' input array.
+    max_workers: int (optional, default 1)
+        the number of processes parsing and formatting the text arrays.
+    normalizer: ColumnNormalizer (optional, default None)
+        fitted column statistics, computed from the input file if not set.
+    dtype: str (optional, default None)
+        the computation and binary output data type, the input data type
+        for floating point binary arrays and float64 otherwise if not set.
+    method: str (optional, default 'zscore')
+        the normalization method: 'zscore', 'robust' or 'minmax', unused
+        if a fitted normalizer is given.
+    cache_dir: str (optional, default None)
+        a cache directory of the parsed text arrays, see
+        'open_array_blocks', where a normalized text output loaded at once
+        is also cached.
+    """
+    input_format = array_format(filepath, input_format)
+    output_format = array_format(outfile, output_format)
+
+    # Define the input blocks of rows
+    inplace = (input_format != "text" and output_format == input_format and
+               os.path.abspath(outfile) == os.path.abspath(filepath))
+    array, blocks = open_array_blocks(
+        filepath, input_format, chunk_size, raw_dtype, raw_columns,
+        max_workers, mode="r+" if inplace else "r", dtype=dtype,
+        cache_dir=cache_dir)
+    inplace = (inplace and
+               numpy.issubdtype(array.dtype, numpy.floating) and
+               (dtype is None or numpy.dtype(dtype) == array.dtype))
+
+    # First pass: compute the column statistics and count the rows
+    nb_rows = None
+    if normalizer is None:
+        statistics = column_statistics(method)
+        nb_rows = 0
+        for block in blocks():
+            statistics.update(block)
+            nb_rows += block.shape[0]
+        normalizer = ColumnNormalizer.from_statistics(statistics, method)
+
+    # Second pass: normalize in place or write the normalized rows
+    if inplace:
+        for block in blocks():
+            normalizer.transform(block, inplace=True)
+        array.flush()
+        return
+    if array is not None:
+        nb_rows = array.shape[0]
+    elif nb_rows is None and output_format != "text":
+        # Fitted statistics and streamed text input: the binary outputs
+        # are preallocated from the number of rows
+        nb_rows = sum([block.shape[0] for block in blocks()])
+    if dtype is None:
+        dtype = "float64"
+        if output_format == "raw":
+            dtype = raw_dtype
+        elif (array is not None and
+                numpy.issubdtype(array.dtype, numpy.floating)):
+            dtype = array.dtype
+    owned = input_format == "text" and (
+        array is None or array.flags.writeable)
+    writer = ArrayWriter(outfile, output_format,
+                         (nb_rows or 0, len(normalizer.center)), dtype,
+                         max_workers)
+    try:
+        for block in blocks():
+            block = normalizer.transform(block, inplace=owned, dtype=dtype)
+            writer.write(block)
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+    # Cache the normalized text array, rounded as written, for the next
+    # readers
+    if (cache_dir is not None and output_format == "text" and
+            array is not None and 0 < array.shape[0] == block.shape[0]):
+        store_cached_array(outfile, numpy.round(block, 8), cache_dir)
+
+
+class ColumnNormalizer(object):
+    """ Column statistics fitted once and applied to many arrays.
+
+    The statistics are saved in a compact '.npz' sidecar file, so that a
+    test set can be normalized with the statistics of a training set. The
+    normalized columns are '(x - center) / spread', the zero spread columns
+    being scaled by 1, so that they are centered instead of being filled
+    with NaN.
+    """
+    def __init__(self, center=None, spread=None, count=0, method="zscore"):
+        """ Initialize the ColumnNormalizer class.
+
+        Parameters
+        ----------
+        center: array (optional, default None)
+            the column means, medians or minimums.
+        spread: array (optional, default None)
+            the column standard deviations, interquartile ranges or ranges.
+        count: int (optional, default 0)
+            the number of rows used to fit the statistics.
+        method: str (optional, default 'zscore')
+            the normalization method: 'zscore', 'robust' or 'minmax'.
+        """
+        self.center = center
+        self.spread = spread
+        self.count = count
+        self.method = method
+
+    def __repr__(self):
+        return "<ColumnNormalizer {0} {1} columns, {2} rows>".format(
+            self.method, 0 if self.center is None else len(self.center),
+            self.count)
+
+    @classmethod
+    def from_statistics(cls, statistics, method="zscore"):
+        """ Create a normalizer from column statistics.
+
+        Parameters
+        ----------
+        statistics: RunningMoments or QuantileSketch (mandatory)
+            the statistics of the method, see 'column_statistics'.
+        method: str (optional, default 'zscore')
+            the normalization method: 'zscore', 'robust' or 'minmax'.
+
+        Returns
+        -------
+        normalizer: ColumnNormalizer
+            the fitted normalizer.
+        """
+        if statistics.count == 0:
+            raise ValueError("No rows to fit the normalizer.")
+        if method == "zscore":
+            center, spread = statistics.mean, statistics.std
+        elif method == "robust":
+            lower, center, upper = statistics.quantiles([0.25, 0.5, 0.75])
+            spread = upper - lower
+        else:
+            center, spread = statistics.min, statistics.max - statistics.min
+        return cls(center, spread, statistics.count, method)
+
+    def fit(self, filepaths, input_format=None, chunk_size=None,
+            raw_dtype="float64", raw_columns=None, max_workers=1,
+            dtype=None):
+        """ Fit the column statistics on the rows of several array files.
+
+        The statistics of the files are computed in parallel and merged.
+
+        Parameters
+        ----------
+        filepaths: list of str (mandatory)
+            the array files with the same number of columns.
+        input_format, chunk_size, raw_dtype, raw_columns, dtype:
+            (optional) see 'open_array_blocks'.
+        max_workers: int (optional, default 1)
+            the number of processes computing the statistics of the files.
+
+        Returns
+        -------
+        self: ColumnNormalizer
+            the fitted normalizer.
+        """
+        args = [(fname, self.method, input_format, chunk_size, raw_dtype,
+                 raw_columns, dtype) for fname in filepaths]
+        if max_workers > 1 and len(args) > 1:
+            pool = multiprocessing.Pool(max_workers)
+            try:
+                results = pool.map(_file_statistics, args)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = [_file_statistics(arg) for arg in args]
+        statistics = column_statistics(self.method)
+        for other in results:
+            statistics.merge(other)
+        fitted = ColumnNormalizer.from_statistics(statistics, self.method)
+        self.center = fitted.center
+        self.spread = fitted.spread
+        self.count = fitted.count
+        return self
+
+    @property
+    def scale(self):
+        """ The column scales: the spreads, 1 for the zero spread columns
+        (up to the rounding errors on the centers).
+        """
+        tolerance = (8 * numpy.finfo(numpy.float64).eps *
+                     numpy.abs(self.center))
+        return numpy.where(self.spread > tolerance, self.spread, 1.)
+
+    def transform(self, block, inplace=False, dtype=None):
+        """ Normalize a block of rows.
+
+        Parameters
+        ----------
+        block: array (mandatory)
+            a 2D array of shape (rows, columns).
+        inplace: bool (optional, default False)
+            if set, overwrite the floating point block.
+        dtype: str (optional, default None)
+            the data type of the normalized rows when not computed in
+            place, the block floating point data type or float64 if not
+            set.
+
+        Returns
+        -------
+        block: array
+            the normalized rows.
+        """
+        if self.center is None:
+            raise ValueError("The normalizer is not fitted.")
+        if block.shape[-1] != len(self.center):
+            raise ValueError("The array has {0} columns, expect {1}.".format(
+                block.shape[-1], len(self.center)))
+        if inplace:
+            out = block
+        else:
+            if dtype is None:
+                dtype = block.dtype
+                if not numpy.issubdtype(dtype, numpy.floating):
+                    dtype = numpy.float64
+            out = numpy.empty(block.shape, dtype=dtype)
+        numpy.subtract(block, self.center.astype(out.dtype), out=out)
+        numpy.divide(out, self.scale.astype(out.dtype), out=out)
+        return out
+
+    def transform_files(self, filepaths, outfiles, input_format=None,
+                        output_format=None, chunk_size=None,
+                        raw_dtype="float64", raw_columns=None, dtype=None):
+        """ Normalize many array files with the fitted statistics.
+
+        The small text arrays are stacked and normalized at once by
+        batches of about 64 MiB, the other files being normalized one by
+        one with 'normalize_file'.
+
+        Parameters
+        ----------
+        filepaths: list of str (mandatory)
+            the input array files.
+        outfiles: list of str (mandatory)
+            the output array files, may be the input files.
+        input_format, output_format, chunk_size, raw_dtype, raw_columns,
+        dtype: (optional) see 'normalize_file'.
+        """
+        if len(filepaths) != len(outfiles):
+            raise ValueError("Expect as many output files as input files.")
+        batch = []
+        batch_size = 0
+        for fname, outfile in zip(filepaths, outfiles):
+            if (chunk_size is not None or
+                    array_format(fname, input_format) != "text"):
+                normalize_file(fname, outfile, input_format, output_format,
+                               chunk_size, raw_dtype, raw_columns,
+                               normalizer=self, dtype=dtype)
+                continue
+            array = numpy.loadtxt(fname, dtype=dtype or "float64", ndmin=2)
+            batch.append((array, outfile))
+            batch_size += array.nbytes
+            if batch_size >= BLOCK_BYTES:
+                self._transform_batch(batch, output_format, raw_dtype,
+                                      dtype)
+                batch = []
+                batch_size = 0
+        if batch:
+            self._transform_batch(batch, output_format, raw_dtype, dtype)
+
+    def _transform_batch(self, batch, output_format, raw_dtype, dtype):
+        """ Normalize stacked arrays and write them in their output files.
+        """
+        arrays = [array for array, _ in batch if array.size > 0]
+        if arrays:
+            stacked = self.transform(numpy.concatenate(arrays), inplace=True)
+        offset = 0
+        for array, outfile in batch:
+            fmt = array_format(outfile, output_format)
+            out_dtype = dtype or (raw_dtype if fmt == "raw" else "float64")
+            writer = ArrayWriter(outfile, fmt, array.shape, out_dtype)
+            try:
+                if array.size > 0:
+                    writer.write(stacked[offset:offset + array.shape[0]])
+                    offset += array.shape[0]
+            except:
+                writer.abort()
+                raise
+            writer.close()
+
+    def save(self, filepath):
+        """ Save the statistics in a '.npz' sidecar file.
+
+        Parameters
+        ----------
+        filepath: str (mandatory)
+            the destination file.
+        """
+        if self.center is None:
+            raise ValueError("The normalizer is not fitted.")
+        with open(filepath, "wb") as openfile:
+            numpy.savez(openfile, center=self.center, spread=self.spread,
+                        count=self.count, method=self.method)
+
+    @classmethod
+    def load(cls, filepath):
+        """ Load the statistics saved in a '.npz' sidecar file.
+
+        Parameters
+        ----------
+        filepath: str (mandatory)
+            the sidecar file.
+
+        Returns
+        -------
+        normalizer: ColumnNormalizer
+            the fitted normalizer.
+        """
+        with numpy.load(filepath) as data:
+            return cls(data["center"], data["spread"], int(data["count"]),
+                       str(data["method"]))
+
+
+def _file_statistics(args):
+    """ Unpack the arguments of 'file_statistics' in a pool of processes.
+    """
+    return file_statistics(*args)
+
+
+def _parse_text_range(args):
+    """ Unpack the arguments of 'parse_text_range' in a pool of processes.
+    """
+    return parse_text_range(*args)
+
+
+def _write_text(openfile, array, pool=None, max_workers=1, fmt="%5.8f"):
+    """ Write the rows of an array formatted in a pool of processes.
+    """
+    if pool is None or array.shape[0] < 2:
+        openfile.write(format_text(array, fmt))
+        return
+    nb_blocks = min(RANGES_PER_WORKER * max_workers, array.shape[0])
+    for data in pool.imap(functools.partial(format_text, fmt=fmt),
+                          numpy.array_split(array, nb_blocks)):
+        openfile.write(data)
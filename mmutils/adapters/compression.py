@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Registry of the compression codecs used by the io adapters.
+
+A codec is detected from the first bytes of a file, not from its
+extension. Each codec defines 'fast', 'default' and 'best' compression
+presets, the 'default' preset being the default level of the underlying
+python module.
+"""
+
+# System import
+import bz2
+import gzip
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# The errors raised while reading a truncated or corrupted compressed file
+DECOMPRESSION_ERRORS = (EOFError, IOError, OSError, ValueError, zlib.error)
+if lzma is not None:
+    DECOMPRESSION_ERRORS += (lzma.LZMAError, )
+
+
+class Codec(object):
+    """ A compression codec description.
+    """
+    def __init__(self, name, extension, magic, opener, presets):
+        """ Initialize the Codec class.
+
+        Parameters
+        ----------
+        name: str (mandatory)
+            the codec name.
+        extension: str (mandatory)
+            the extension of the files compressed with this codec.
+        magic: bytes (mandatory)
+            the first bytes of the files compressed with this codec, None
+            for uncompressed files.
+        opener: callable (mandatory)
+            a function 'opener(fname, mode, level)' returning a file object
+            that compresses or decompresses the data on the fly.
+        presets: dict (mandatory)
+            the compression level associated to each preset name.
+        """
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.opener = opener
+        self.presets = presets
+
+    def __repr__(self):
+        return "<Codec {0}>".format(self.name)
+
+    def level(self, preset=None):
+        """ Get the compression level of a preset.
+
+        Parameters
+        ----------
+        preset: str (optional, default None)
+            the preset name, None for the 'default' preset.
+
+        Returns
+        -------
+        level: int
+            the associated compression level.
+        """
+        preset = preset or "default"
+        if preset not in self.presets:
+            raise ValueError("'{0}' is not a valid '{1}' preset, expect one "
+                             "of {2}.".format(preset, self.name,
+                                              sorted(self.presets)))
+        return self.presets[preset]
+
+    def open(self, fname, mode="rb", level=None):
+        """ Open a file with the codec.
+
+        Parameters
+        ----------
+        fname: str (mandatory)
+            the file to open.
+        mode: str (optional, default 'rb')
+            the opening mode, 'rb' or 'wb'.
+        level: int (optional, default None)
+            the compression level, None for the 'default' preset.
+
+        Returns
+        -------
+        fobj: file
+            the opened file object.
+        """
+        if level is None:
+            level = self.level()
+        return self.opener(fname, mode, level)
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """ Register a compression codec.
+
+    Parameters
+    ----------
+    codec: Codec (mandatory)
+        the codec to register, replacing a codec with the same name.
+    """
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    """ Get a registered codec from its name.
+
+    Parameters
+    ----------
+    name: str (mandatory)
+        the codec name.
+
+    Returns
+    -------
+    codec: Codec
+        the requested codec.
+    """
+    if name not in CODECS:
+        raise ValueError("'{0}' is not a registered codec, expect one of "
+                         "{1}.".format(name, sorted(CODECS)))
+    return CODECS[name]
+
+
+def detect_codec(fname):
+    """ Detect the codec of a file from its magic bytes.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the file to inspect.
+
+    Returns
+    -------
+    codec: Codec
+        the detected codec, the 'raw' codec if the file is not compressed
+        with a registered codec.
+    """
+    magic_length = max([len(codec.magic) for codec in CODECS.values()
+                        if codec.magic is not None])
+    with open(fname, "rb") as openfile:
+        header = openfile.read(magic_length)
+    for codec in CODECS.values():
+        if codec.magic is not None and header.startswith(codec.magic):
+            return codec
+    return CODECS["raw"]
+
+
+register_codec(Codec(
+    "raw", "", None,
+    lambda fname, mode, level: open(fname, mode),
+    {"fast": 0, "default": 0, "best": 0}))
+register_codec(Codec(
+    "gzip", ".gz", b"\x1f\x8b",
+    lambda fname, mode, level: gzip.open(fname, mode, level),
+    {"fast": 1, "default": 9, "best": 9}))
+register_codec(Codec(
+    "bz2", ".bz2", b"BZh",
+    lambda fname, mode, level: bz2.BZ2File(
+        fname, mode, compresslevel=level),
+    {"fast": 1, "default": 9, "best": 9}))
+if lzma is not None:
+    register_codec(Codec(
+        "xz", ".xz", b"\xfd7zXZ\x00",
+        lambda fname, mode, level: lzma.open(
+            fname, mode, preset=(level if "w" in mode else None)),
+        {"fast": 0, "default": 6, "best": 9 | lzma.PRESET_EXTREME}))
@@ -9,26 +9,177 @@
 
 # System import
 import os
-import gzip
+import logging
 import shutil
+import tempfile
+
+# mmutils import: the array adapters import numpy when called, so that the
+# other adapters do not require it
+from .compression import detect_codec
+from .compression import get_codec
+from .uptodate import is_up_to_date
+from .uptodate import record
+from .handoff import create_handoff_directory
+from .handoff import release_handle
+from .nifti import HEADER_SIZE
+from .nifti import data_type
+from .nifti import float32_header
+from .nifti import timeseries_shape
+from .nifti import read_nifti_header
+from .nifti import volume_byte_range
+from .nifti import volume_header
+from .io import BUFFER_SIZE
+from .io import _map_largest_first
+from .io import _move_file
+from .io import _parallel_gzip
+from .io import _range_reader
+from .io import _uncompress
+from .io import _uncompress_to_shared_memory
+
+
+def normalize_array(filepath, chunk_size=None, input_format=None,
+                    output_format=None, raw_dtype="float64", raw_columns=None,
+                    max_workers=1, dtype=None, method="zscore",
+                    cache_dir=None):
+    """ Get a numpy array from a file and normalize column by column
 
+    The columns are z-scored ('zscore'), centered on the median and scaled
+    by the interquartile range ('robust') or scaled to [0, 1] ('minmax').
+    The robust quantiles are estimated out-of-core with a mergeable
+    streaming sketch of bounded memory.
 
-def normalize_array(filepath):
-    """ Get a numpy array from a file and normalize column by column
+    The array can be stored as whitespace delimited 'text', as a numpy
+    'npy' file or as 'raw' binary data, the format being deduced from the
+    file extension ('.npy', '.raw' or '.mmap', 'text' otherwise)
+    if not specified. Binary arrays are memory mapped and, when the output
+    format is the input one, normalized in place by blocks of rows.
+
+    If 'chunk_size' is set, the file is processed out-of-core by blocks of
+    'chunk_size' rows: a first pass accumulates the column means and
+    variances, a second pass streams the normalized rows to the output.
+
+    Large text arrays are parsed and formatted by 'max_workers' processes,
+    each one handling a range of lines.
+
+    The computations are done in place in 'dtype' ('float32' to halve the
+    memory), the column statistics being accumulated in float64. The zero
+    variance columns are centered only.
+
+    If 'cache_dir' is set, the parsed text arrays are cached in this
+    directory as '.npy' files keyed on the path, size and mtime of the text
+    files, so that a rerun memory maps the cached array instead of parsing
+    the text. The normalized text output is cached too.
 
     <process capsul_xml="2.0">
         <input name="filepath" type="file" doc="the input file containing the numpy array"/>
+        <input name="chunk_size" type="int" doc="the number of rows processed at once, the whole array if not set" optional="true"/>
+        <input name="input_format" type="string" doc="the input format: 'text', 'npy' or 'raw', deduced from the extension if not set" optional="true"/>
+        <input name="output_format" type="string" doc="the output format: 'text', 'npy' or 'raw', the input format if not set" optional="true"/>
+        <input name="raw_dtype" type="string" doc="the data type of the raw arrays" optional="true"/>
+        <input name="raw_columns" type="int" doc="the number of columns of a raw input array" optional="true"/>
+        <input name="max_workers" type="int" doc="the number of processes parsing and formatting the text arrays" optional="true"/>
+        <input name="dtype" type="string" doc="the computation and binary output data type, 'float32' or 'float64'" optional="true"/>
+        <input name="method" type="string" doc="the normalization method: 'zscore', 'robust' or 'minmax'" optional="true"/>
+        <input name="cache_dir" type="directory" doc="the cache directory of the parsed text arrays" optional="true"/>
         <return name="outfile" type="file" doc="the output file with normalized array"/>
     </process>
     """
-    # load input file
-    array = numpy.loadtxt(filepath)
-    array = (array - array.mean(axis=0)) / array.std(axis=0)
-    outfile = filepath
-    numpy.savetxt(outfile, array, fmt="%5.8f")
+    from .arrays import normalize_file
+    from .arrays import output_array_path
+
+    outfile = output_array_path(filepath, input_format, output_format)
+
+    normalize_file(filepath, outfile, input_format, output_format,
+                   chunk_size=chunk_size, raw_dtype=raw_dtype,
+                   raw_columns=raw_columns, max_workers=max_workers,
+                   dtype=dtype, method=method, cache_dir=cache_dir)
 
     return outfile
 
+
+def fit_normalizer(filepaths, normalizer_file, chunk_size=None,
+                   input_format=None, raw_dtype="float64", raw_columns=None,
+                   max_workers=1, dtype=None, method="zscore"):
+    """ Fit column statistics once on a set of arrays
+
+    The column statistics of the rows of all the input arrays are saved in
+    a compact '.npz' sidecar file, to be applied to other arrays with
+    'apply_normalizer', for instance the statistics of a training set
+    applied to a test set: the means and standard deviations ('zscore'),
+    the medians and interquartile ranges ('robust') or the minimums and
+    ranges ('minmax'). The statistics of the files are computed by
+    'max_workers' processes and merged.
+
+    <process capsul_xml="2.0">
+        <input name="filepaths" type="list_file" doc="the input files containing the numpy arrays"/>
+        <input name="normalizer_file" type="file" doc="the '.npz' file where the statistics are saved"/>
+        <input name="chunk_size" type="int" doc="the number of rows processed at once, the whole arrays if not set" optional="true"/>
+        <input name="input_format" type="string" doc="the input format: 'text', 'npy' or 'raw', deduced from the extensions if not set" optional="true"/>
+        <input name="raw_dtype" type="string" doc="the data type of the raw arrays" optional="true"/>
+        <input name="raw_columns" type="int" doc="the number of columns of the raw input arrays" optional="true"/>
+        <input name="max_workers" type="int" doc="the number of processes computing the statistics of the files" optional="true"/>
+        <input name="dtype" type="string" doc="the data type of the parsed text arrays, 'float32' or 'float64'" optional="true"/>
+        <input name="method" type="string" doc="the normalization method: 'zscore', 'robust' or 'minmax'" optional="true"/>
+        <return name="fitted_file" type="file" doc="the '.npz' file with the column statistics"/>
+    </process>
+    """
+    from .arrays import ColumnNormalizer
+
+    normalizer = ColumnNormalizer(method=method).fit(
+        filepaths, input_format=input_format, chunk_size=chunk_size,
+        raw_dtype=raw_dtype, raw_columns=raw_columns,
+        max_workers=max_workers, dtype=dtype)
+    normalizer.save(normalizer_file)
+    fitted_file = normalizer_file
+
+    return fitted_file
+
+
+def apply_normalizer(normalizer_file, filepaths, output_directory=None,
+                     prefix="", chunk_size=None, input_format=None,
+                     output_format=None, raw_dtype="float64",
+                     raw_columns=None, dtype=None):
+    """ Normalize column by column a set of arrays with fitted statistics
+
+    The statistics saved by 'fit_normalizer' are applied without being
+    recomputed, the small text arrays being stacked and normalized at once.
+    The arrays are normalized in place unless an output directory, a
+    prefix or another output format is specified.
+
+    <process capsul_xml="2.0">
+        <input name="normalizer_file" type="file" doc="the '.npz' file with the column statistics"/>
+        <input name="filepaths" type="list_file" doc="the input files containing the numpy arrays"/>
+        <input name="output_directory" type="directory" doc="the output directory, the input file directories if not set" optional="true"/>
+        <input name="prefix" type="string" doc="the prefix of the output file names" optional="true"/>
+        <input name="chunk_size" type="int" doc="the number of rows processed at once, the whole arrays if not set" optional="true"/>
+        <input name="input_format" type="string" doc="the input format: 'text', 'npy' or 'raw', deduced from the extensions if not set" optional="true"/>
+        <input name="output_format" type="string" doc="the output format: 'text', 'npy' or 'raw', the input format if not set" optional="true"/>
+        <input name="raw_dtype" type="string" doc="the data type of the raw arrays" optional="true"/>
+        <input name="raw_columns" type="int" doc="the number of columns of the raw input arrays" optional="true"/>
+        <input name="dtype" type="string" doc="the computation and binary output data type, 'float32' or 'float64'" optional="true"/>
+        <return name="outfiles" type="list_file" doc="the output files with normalized arrays"/>
+    </process>
+    """
+    from .arrays import ColumnNormalizer
+    from .arrays import output_array_path
+
+    if output_directory is not None and not os.path.isdir(output_directory):
+        raise ValueError("'{0}' is not a valid directory.".format(
+            output_directory))
+    outfiles = [
+        output_array_path(fname, input_format, output_format,
+                          output_directory, prefix)
+        for fname in filepaths]
+
+    normalizer = ColumnNormalizer.load(normalizer_file)
+    normalizer.transform_files(
+        filepaths, outfiles, input_format=input_format,
+        output_format=output_format, chunk_size=chunk_size,
+        raw_dtype=raw_dtype, raw_columns=raw_columns, dtype=dtype)
+
+    return outfiles
+
+
 def element_to_list(element):
     """ Set an element to an empty list.
 
@@ -63,33 +214,65 @@ def list_to_element(listobj, force=False):
     return element
 
 
-def ungzip_list_files(fnames, prefix="u", output_directory=None):
+def ungzip_list_files(fnames, prefix="u", output_directory=None,
+                      buffer_size=BUFFER_SIZE, max_workers=1,
+                      executor="process", incremental=False, use_hash=False):
     """ Copy and ungzip the input files.
 
+    If 'max_workers' is greater than one, the files are ungzipped by a pool
+    of workers, the largest files being scheduled first. The returned files
+    are in the input order and the error raised, if any, is the one of the
+    first failing file in the input order, as in the sequential execution.
+
     
     <process capsul_xml="2.0">
       <input name="fnames" type="list_file" doc="input files to ungzip."/>
       <input name="prefix" type="string" doc="the prefix of the result file."/>
       <input name="output_directory" type="directory" doc="the output directory where ungzip file is saved."/>
+      <input name="buffer_size" type="int" doc="the size in bytes of the chunks decompressed at once." optional="true"/>
+      <input name="incremental" type="bool" doc="skip the decompression if the output file is up to date." optional="true"/>
+      <input name="use_hash" type="bool" doc="compare the input file contents in incremental mode." optional="true"/>
+      <input name="max_workers" type="int" doc="the number of files ungzipped in parallel." optional="true"/>
+      <input name="executor" type="string" doc="the kind of workers, 'process' or 'thread'." optional="true"/>
       <return name="ungzipfnames" type="list_file" doc="the returned ungzip files."/>
     </process>
     
     """
-    ungzipfnames = []
-    for fname in fnames:
-        ungzipfnames.append(ungzip_file(fname, prefix, output_directory))
+    ungzipfnames = _map_largest_first(
+        ungzip_file,
+        [(fname, prefix, output_directory, buffer_size, incremental,
+          use_hash) for fname in fnames],
+        fnames, max_workers, executor)
 
     return ungzipfnames
 
 
-def ungzip_file(fname, prefix="u", output_directory=None):
+def ungzip_file(fname, prefix="u", output_directory=None,
+                buffer_size=BUFFER_SIZE, incremental=False, use_hash=False):
     """ Copy and ungzip the input file.
 
+    The compression codec (gzip, bz2 or xz) is detected from the first
+    bytes of the file, uncompressed files being returned as they are. The
+    file is decompressed in chunks of 'buffer_size' bytes that are
+    streamed to the output file, so that the memory usage does not depend
+    on the size of the decompressed image. The integrity of the data is
+    checked while streaming (CRC32 and size for gzip files) and a truncated
+    or corrupted file raises a ValueError.
+
+    In 'incremental' mode, the decompression is skipped if the output file
+    has already been generated from the unchanged input file, as recorded
+    in an index stored in the output directory. If 'use_hash' is set, an
+    input file with a new modification time but the same content is also
+    considered unchanged.
+
     
     <process capsul_xml="2.0">
       <input name="fname" type="file" doc="an input file to ungzip."/>
       <input name="prefix" type="string" doc="the prefix of the result file."/>
       <input name="output_directory" type="directory" doc="the output directory where ungzip file is saved."/>
+      <input name="buffer_size" type="int" doc="the size in bytes of the chunks decompressed at once." optional="true"/>
+      <input name="incremental" type="bool" doc="skip the decompression if the output file is up to date." optional="true"/>
+      <input name="use_hash" type="bool" doc="compare the input file contents in incremental mode." optional="true"/>
       <return name="ungzipfname" type="file" doc="the returned ungzip file."/>
     </process>
     
@@ -106,42 +289,99 @@ def ungzip_file(fname, prefix="u", output_directory=None):
     else:
         output_directory = os.path.dirname(fname)
 
-    # Get the file descriptors
-    base, extension = os.path.splitext(fname)
-    basename = os.path.basename(base)
+    # Detect the compression codec from the file content
+    codec = detect_codec(fname)
 
-    # Ungzip only known extension
-    if extension in [".gz"]:
+    # Uncompress only known codecs
+    if codec.magic is not None:
 
         # Generate the output file name
+        basename = os.path.basename(fname)
+        if basename.endswith(codec.extension):
+            basename = basename[:-len(codec.extension)]
         basename = prefix + basename
         ungzipfname = os.path.join(output_directory, basename)
+        if os.path.abspath(ungzipfname) == os.path.abspath(fname):
+            raise ValueError("'{0}' would be overwritten, use a prefix or an "
+                             "output directory.".format(fname))
 
-        # Read the input gzip file
-        with gzip.open(fname, "rb") as gzfobj:
-            data = gzfobj.read()
+        # Skip the decompression if the output file is up to date
+        if incremental and is_up_to_date(fname, ungzipfname, use_hash):
+            return ungzipfname
 
-        # Write the output ungzip file
-        with open(ungzipfname, "wb") as openfile:
-            openfile.write(data)
+        # Stream the input compressed file to the output file
+        _uncompress(codec, fname, ungzipfname, buffer_size)
+        if incremental:
+            record(fname, ungzipfname, use_hash)
 
-    # Default, unknown compression extension: the input file is returned
+    # Default, uncompressed file: the input file is returned
     else:
         ungzipfname = fname
 
     return ungzipfname
 
 
+def gzip_list_files(fnames, prefix="g", output_directory=None,
+                    remove_original_file=False, compresslevel=None,
+                    threads=1, codec="gzip", preset=None, max_workers=1,
+                    executor="process", max_inflight_bytes=None):
+    """ Copy and gzip the input files.
+
+    If 'max_workers' is greater than one, the files are compressed by a
+    pool of workers, the largest files being scheduled first. A new file is
+    started only while the total size of the files being compressed stays
+    below 'max_inflight_bytes', which bounds the load on the file system.
+
+    
+    <process capsul_xml="2.0">
+      <input name="fnames" type="list_file" doc="input files to gzip."/>
+      <input name="prefix" type="string" doc="the prefix of the result files."/>
+      <input name="output_directory" type="directory" doc="the output directory where gzip files are saved."/>
+      <input name="remove_original_file" type="bool" doc="remove the original files"/>
+      <input name="compresslevel" type="int" doc="the compression level, overwrite the preset level." optional="true"/>
+      <input name="threads" type="int" doc="the number of cores used to compress each file." optional="true"/>
+      <input name="codec" type="string" doc="the compression codec: 'gzip', 'bz2' or 'xz'." optional="true"/>
+      <input name="preset" type="string" doc="the compression preset: 'fast', 'default' or 'best'." optional="true"/>
+      <input name="max_workers" type="int" doc="the number of files compressed in parallel." optional="true"/>
+      <input name="executor" type="string" doc="the kind of workers, 'process' or 'thread'." optional="true"/>
+      <input name="max_inflight_bytes" type="int" doc="the maximum total size of the files compressed at the same time." optional="true"/>
+      <return name="gzipfnames" type="list_file" doc="the returned gzip files."/>
+    </process>
+    
+    """
+    gzipfnames = _map_largest_first(
+        gzip_file,
+        [(fname, prefix, output_directory, remove_original_file,
+          compresslevel, threads, codec, preset) for fname in fnames],
+        fnames, max_workers, executor, max_inflight_bytes)
+
+    return gzipfnames
+
+
 def gzip_file(fname, prefix="g", output_directory=None,
-              remove_original_file=False):
+              remove_original_file=False, compresslevel=None, threads=1,
+              codec="gzip", preset=None):
     """ Copy and gzip the input file.
 
+    The file is compressed with the requested codec ('gzip', 'bz2' or
+    'xz'), the level being set by 'compresslevel' or, if not specified, by
+    the 'fast', 'default' or 'best' codec preset. Already compressed files
+    are returned as they are.
+
+    If 'threads' is greater than one and the codec is 'gzip', the input
+    file is split in blocks that are compressed independently on several
+    cores and written as a single standard gzip member.
+
     
     <process capsul_xml="2.0">
       <input name="fname" type="file" doc="an input file to gzip."/>
       <input name="prefix" type="string" doc="the prefix of the result file."/>
       <input name="output_directory" type="directory" doc="the output directory where gzip file is saved."/>
       <input name="remove_original_file" type="bool" doc="remove the original file"/>
+      <input name="compresslevel" type="int" doc="the compression level, overwrite the preset level." optional="true"/>
+      <input name="threads" type="int" doc="the number of cores used to compress the file." optional="true"/>
+      <input name="codec" type="string" doc="the compression codec: 'gzip', 'bz2' or 'xz'." optional="true"/>
+      <input name="preset" type="string" doc="the compression preset: 'fast', 'default' or 'best'." optional="true"/>
       <return name="gzipfname" type="file" doc="the returned gzip file."/>
     </process>
     
@@ -158,22 +398,34 @@ def gzip_file(fname, prefix="g", output_directory=None,
     else:
         output_directory = os.path.dirname(fname)
 
+    # Get the compression codec and level
+    codec = get_codec(codec)
+    if codec.magic is None:
+        raise ValueError("'{0}' is not a compression codec.".format(
+            codec.name))
+    if compresslevel is None:
+        compresslevel = codec.level(preset)
+
     # Get the file descriptors
     base, extension = os.path.splitext(fname)
-    # Gzip only non compressed file
-    if extension not in [".gz"]:
+    # Compress only non compressed file
+    if detect_codec(fname).magic is None:
 
         # Generate the output file name
         if prefix:
-            basename = prefix + os.path.basename(base) + extension + ".gz"
+            basename = (prefix + os.path.basename(base) + extension +
+                        codec.extension)
         else:
-            basename = os.path.basename(base) + extension + ".gz"
+            basename = os.path.basename(base) + extension + codec.extension
         gzipfname = os.path.join(output_directory, basename)
 
-        # Write the output gzip file
-        with open(fname, "rb") as openfile:
-            with gzip.open(gzipfname, "w") as gzfobj:
-                gzfobj.writelines(openfile)
+        # Write the output compressed file
+        if threads > 1 and codec.name == "gzip":
+            _parallel_gzip(fname, gzipfname, compresslevel, threads)
+        else:
+            with open(fname, "rb") as openfile:
+                with codec.open(gzipfname, "wb", compresslevel) as gzfobj:
+                    shutil.copyfileobj(openfile, gzfobj, BUFFER_SIZE)
 
         if remove_original_file:
             os.remove(fname)
@@ -185,6 +437,206 @@ def gzip_file(fname, prefix="g", output_directory=None,
     return gzipfname
 
 
+def extract_volume(fname, volume_index, prefix="v", output_directory=None):
+    """ Extract a 3D volume from a single file NIfTI image.
+
+    For gzip images, only the data following the access point that precedes
+    the volume is decompressed, using the access point index stored beside
+    the image (built on first use).
+
+    
+    <process capsul_xml="2.0">
+      <input name="fname" type="file" doc="a gzip or uncompressed NIfTI image."/>
+      <input name="volume_index" type="int" doc="the index of the volume to extract."/>
+      <input name="prefix" type="string" doc="the prefix of the result file."/>
+      <input name="output_directory" type="directory" doc="the output directory where the volume is saved."/>
+      <return name="volumefname" type="file" doc="the returned uncompressed 3D volume."/>
+    </process>
+    
+    """
+    # Check the input file exists on the file system
+    if not os.path.isfile(fname):
+        raise ValueError("'{0}' is not a valid filename.".format(fname))
+
+    # Check that the outdir is valid
+    if output_directory is not None:
+        if not os.path.isdir(output_directory):
+            raise ValueError(
+                "'{0}' is not a valid directory.".format(output_directory))
+    else:
+        output_directory = os.path.dirname(fname)
+
+    # Locate the requested volume from the image header
+    codec, read = _range_reader(fname)
+    header = read_nifti_header(read(0, HEADER_SIZE))
+    offset, length = volume_byte_range(header, volume_index)
+    data = read(offset, length)
+    if len(data) != length:
+        raise ValueError("'{0}' is a truncated image.".format(fname))
+
+    # Generate the output file name
+    basename = os.path.basename(fname)
+    if basename.endswith(codec.extension):
+        basename = basename[:-len(codec.extension)]
+    if basename.endswith(".nii"):
+        basename = basename[:-len(".nii")]
+    volumefname = os.path.join(output_directory, "{0}{1}_{2:04d}.nii".format(
+        prefix, basename, volume_index))
+
+    # Write the output volume
+    with open(volumefname, "wb") as openfile:
+        openfile.write(volume_header(read(0, header["vox_offset"]), header))
+        openfile.write(data)
+
+    return volumefname
+
+
+def normalize_timeseries(fname, prefix="n", output_directory=None,
+                         method="zscore", slab_size=None):
+    """ Normalize voxelwise the time series of a 4D NIfTI image.
+
+    The data of the uncompressed single file NIfTI image are memory mapped
+    as a (volumes, voxels) array and processed by slabs of voxels, each
+    voxel time series being normalized with the 'normalize_array' methods.
+    The float32 output is written slab by slab, so that the 4D array is
+    never loaded at once. The input intensity scaling is applied.
+
+    <process capsul_xml="2.0">
+        <input name="fname" type="file" doc="an uncompressed 4D NIfTI image."/>
+        <input name="prefix" type="string" doc="the prefix of the result file." optional="true"/>
+        <input name="output_directory" type="directory" doc="the output directory where the normalized image is saved." optional="true"/>
+        <input name="method" type="string" doc="the normalization method: 'zscore', 'robust' or 'minmax'" optional="true"/>
+        <input name="slab_size" type="int" doc="the number of voxels processed at once, about 64 MiB of data if not set" optional="true"/>
+        <return name="normalizedfname" type="file" doc="the normalized float32 image."/>
+    </process>
+    """
+    import numpy
+    from .arrays import BLOCK_BYTES
+    from .arrays import ColumnNormalizer
+    from .arrays import column_statistics
+
+    # Check the input file exists on the file system
+    if not os.path.isfile(fname):
+        raise ValueError("'{0}' is not a valid filename.".format(fname))
+    if detect_codec(fname).magic is not None:
+        raise ValueError("'{0}' is a compressed image, uncompress it "
+                         "first.".format(fname))
+
+    # Check that the outdir is valid
+    if output_directory is not None:
+        if not os.path.isdir(output_directory):
+            raise ValueError(
+                "'{0}' is not a valid directory.".format(output_directory))
+    else:
+        output_directory = os.path.dirname(fname)
+    normalizedfname = os.path.join(output_directory,
+                                   prefix + os.path.basename(fname))
+    if os.path.realpath(normalizedfname) == os.path.realpath(fname):
+        raise ValueError("The normalized image would overwrite '{0}'.".format(
+            fname))
+
+    # Memory map the input data as a (volumes, voxels) array
+    with open(fname, "rb") as openfile:
+        header_data = openfile.read(HEADER_SIZE)
+        header = read_nifti_header(header_data)
+        header_data += openfile.read(header["vox_offset"] - HEADER_SIZE)
+    shape = timeseries_shape(header)
+    data = numpy.memmap(fname, dtype=data_type(header), mode="r",
+                        offset=header["vox_offset"], shape=shape)
+    slope, inter = header["scl_slope"], header["scl_inter"]
+    if slab_size is None:
+        slab_size = max(BLOCK_BYTES // (8 * shape[0]), 1)
+
+    # Write the normalized slabs in a temporary image
+    fd, tmpfile = tempfile.mkstemp(prefix=os.path.basename(normalizedfname),
+                                   dir=output_directory)
+    try:
+        with os.fdopen(fd, "wb") as openfile:
+            openfile.write(float32_header(header_data, header))
+            openfile.truncate(header["vox_offset"] + 4 * shape[0] * shape[1])
+        out = numpy.memmap(tmpfile, dtype=header["endian"] + "f4", mode="r+",
+                           offset=header["vox_offset"], shape=shape)
+        for start in range(0, shape[1], slab_size):
+            slab = numpy.array(data[:, start:start + slab_size],
+                               dtype=numpy.float64)
+            if slope != 0 and (slope, inter) != (1, 0):
+                slab *= slope
+                slab += inter
+            statistics = column_statistics(method)
+            statistics.update(slab)
+            normalizer = ColumnNormalizer.from_statistics(statistics, method)
+            out[:, start:start + slab_size] = normalizer.transform(
+                slab, inplace=True)
+        out.flush()
+        del out
+        getattr(os, "replace", os.rename)(tmpfile, normalizedfname)
+    except:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+    return normalizedfname
+
+
+def ungzip_to_handoff(fname, prefix="u", use_shared_memory=False,
+                      buffer_size=BUFFER_SIZE):
+    """ Ungzip the input file to memory for the next pipeline node.
+
+    The file is decompressed in a new private directory of the memory file
+    system ('/dev/shm' when available) and the returned handle is the
+    output path, or, if 'use_shared_memory' is set, in a shared memory
+    segment whose handle is 'shm://<name>/<size>'. The data are kept until
+    the handle is released with 'release_handoff'.
+
+    
+    <process capsul_xml="2.0">
+      <input name="fname" type="file" doc="an input file to ungzip."/>
+      <input name="prefix" type="string" doc="the prefix of the result file."/>
+      <input name="use_shared_memory" type="bool" doc="decompress in a shared memory segment." optional="true"/>
+      <input name="buffer_size" type="int" doc="the size in bytes of the chunks decompressed at once." optional="true"/>
+      <return name="handle" type="string" doc="the handle of the ungzip data."/>
+    </process>
+    
+    """
+    # Check the input file exists on the file system
+    if not os.path.isfile(fname):
+        raise ValueError("'{0}' is not a valid filename.".format(fname))
+
+    # Decompress in a shared memory segment
+    if use_shared_memory:
+        handle = _uncompress_to_shared_memory(
+            detect_codec(fname), fname, buffer_size)
+
+    # Decompress in a new handoff directory, copy uncompressed files
+    else:
+        directory = create_handoff_directory()
+        try:
+            handle = ungzip_file(fname, prefix, directory, buffer_size)
+            if handle == fname:
+                handle = os.path.join(directory,
+                                      prefix + os.path.basename(fname))
+                shutil.copyfile(fname, handle)
+        except:
+            shutil.rmtree(directory)
+            raise
+
+    return handle
+
+
+def release_handoff(handle):
+    """ Free the data of a handoff handle.
+
+    
+    <process capsul_xml="2.0">
+      <input name="handle" type="string" doc="a handle returned by 'ungzip_to_handoff'."/>
+      <return name="released" type="bool" doc="False if the data were already released."/>
+    </process>
+    
+    """
+    released = release_handle(handle)
+    return released
+
+
 def rename_file(input_filepath, output_filepath):
     """ Rename a file (same loc)
 
@@ -200,13 +652,53 @@ def rename_file(input_filepath, output_filepath):
     if os.path.isfile(output_filepath):
         raise Exception("Output file exist !")
     # get output folder
-    shutil.move(input_filepath, output_filepath)
+    method = _move_file(input_filepath, output_filepath)
+    logging.info("'{0}' moved to '{1}' ({2}).".format(
+        input_filepath, output_filepath, method))
 
     output_file = output_filepath
 
     return output_file
 
 
+def relocate_files(input_filepaths, output_filepaths):
+    """ Move files using the fastest available method.
+
+    Each file is renamed if possible, else hard linked then unlinked, else
+    copied by the kernel ('copy_file_range' or 'sendfile') and finally
+    copied in user space. The method used for each file is returned.
+
+    
+    <process capsul_xml="2.0">
+      <input name="input_filepaths" type="list_file" doc="the input files to move."/>
+      <input name="output_filepaths" type="list_string" doc="the output filepaths."/>
+      <return>
+        <output name="output_files" type="list_file" doc="the moved files."/>
+        <output name="methods" type="list_string" doc="the method used to move each file: 'rename', 'link', 'copy_file_range', 'sendfile' or 'copy'."/>
+      </return>
+    </process>
+    
+    """
+    # Check the parameters
+    if len(input_filepaths) != len(output_filepaths):
+        raise ValueError("Expect as many input files as output filepaths.")
+    for output_filepath in output_filepaths:
+        if os.path.isfile(output_filepath):
+            raise Exception("Output file exist !")
+
+    # Move the files
+    output_files = []
+    methods = []
+    for input_filepath, output_filepath in zip(input_filepaths,
+                                               output_filepaths):
+        methods.append(_move_file(input_filepath, output_filepath))
+        logging.info("'{0}' moved to '{1}' ({2}).".format(
+            input_filepath, output_filepath, methods[-1]))
+        output_files.append(output_filepath)
+
+    return output_files, methods
+
+
 def spm_tissue_probability_maps(fsl_dir="/usr/share/fsl/4.1",
                                 spm_dir="/i2bm/local/spm8/"):
     """ SPM tissue probability maps.
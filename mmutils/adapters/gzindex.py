@@ -0,0 +1,331 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Random access in gzip files through an index of access points.
+
+An access point is a position in the compressed stream where the
+decompression can restart, associated with the corresponding uncompressed
+offset and with the last 32 KiB of uncompressed data (the deflate window).
+The python zlib binding can only restart the decompression on a byte
+boundary: the access points are placed at the start of the gzip members and
+after the sync flush markers, as written by the block-parallel 'gzip_file',
+pigz or bgzip. A file written as a single deflate stream without flush, as
+by the standard gzip tool, only has an access point at its start, and each
+range is then decompressed from the start of the file: the ordinary deflate
+blocks end on bit boundaries, where the python zlib binding can not
+restart.
+
+The index is built once with a full decompression and stored beside the
+gzip file with the '.gzidx' extension.
+"""
+
+# System import
+import os
+import sys
+import json
+import zlib
+import base64
+import struct
+import tempfile
+
+
+# The extension of the index files
+INDEX_EXTENSION = ".gzidx"
+
+# The minimum uncompressed distance between two access points
+SPAN = 1024 * 1024
+
+# The deflate window size
+WINDOW_SIZE = 32768
+
+# The size of the compressed data read at once
+CHUNK_SIZE = 16384
+
+# The deflate sync flush marker: an empty stored block
+SYNC_MARKER = b"\x00\x00\xff\xff"
+
+# Restarting inside a deflate stream requires a preset dictionary
+HAS_ZDICT = sys.version_info >= (3, 3)
+
+
+def build_gzip_index(fname, span=SPAN, save=True):
+    """ Build the access point index of a gzip file.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the gzip file.
+    span: int (optional)
+        the minimum uncompressed distance in bytes between two access points.
+    save: bool (optional, default True)
+        if True, save the index beside the gzip file when possible.
+
+    Returns
+    -------
+    index: dict
+        the gzip file 'size' and 'mtime', the uncompressed size 'usize' and
+        the access 'points' as (compressed offset, uncompressed offset,
+        window) tuples.
+    """
+    stat = os.stat(fname)
+    points = []
+    uoffset = 0
+    with open(fname, "rb") as openfile:
+        while _skip_gzip_header(openfile):
+
+            # Member start: always a valid access point
+            if not points or uoffset - points[-1][1] >= span:
+                points.append((openfile.tell(), uoffset, b""))
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            window = b""
+            trial = None
+            while not _is_eof(decompressor):
+                chunk_offset = openfile.tell()
+                chunk = openfile.read(CHUNK_SIZE)
+                if not chunk:
+                    raise ValueError("'{0}' is a truncated gzip "
+                                     "file.".format(fname))
+                for end, is_marker in _split_on_markers(chunk):
+                    piece = chunk[:end]
+                    chunk = chunk[end:]
+                    coffset = chunk_offset + end
+                    chunk_offset = coffset
+                    data = decompressor.decompress(piece)
+                    uoffset += len(data)
+                    window = (window + data[-WINDOW_SIZE:])[-WINDOW_SIZE:]
+
+                    # Check a candidate access point: the decompression
+                    # restarted there must give the same data
+                    if trial is not None:
+                        try:
+                            trial_data = trial[0].decompress(piece)
+                        except zlib.error:
+                            trial_data = None
+                        if trial_data != data:
+                            trial = None
+                        elif (uoffset - trial[1][1] >= WINDOW_SIZE or
+                                (_is_eof(decompressor) and _is_eof(trial[0]))):
+                            points.append(trial[1])
+                            trial = None
+
+                    # End of member: go to the next member header
+                    if _is_eof(decompressor):
+                        openfile.seek(
+                            coffset - len(decompressor.unused_data) + 8)
+                        break
+
+                    # Sync flush marker: new candidate access point
+                    if (is_marker and trial is None and HAS_ZDICT and
+                            uoffset - points[-1][1] >= span):
+                        trial = (
+                            zlib.decompressobj(-zlib.MAX_WBITS, zdict=window),
+                            (coffset, uoffset, window))
+
+    index = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "usize": uoffset,
+        "points": points}
+    if save:
+        try:
+            save_gzip_index(index, fname + INDEX_EXTENSION)
+        except (IOError, OSError):
+            pass
+    return index
+
+
+def save_gzip_index(index, index_file):
+    """ Save atomically a gzip index.
+
+    Parameters
+    ----------
+    index: dict (mandatory)
+        the gzip index.
+    index_file: str (mandatory)
+        the destination file.
+    """
+    content = dict(index)
+    content["points"] = [
+        (coffset, uoffset,
+         base64.b64encode(zlib.compress(window)).decode("ascii"))
+        for coffset, uoffset, window in index["points"]]
+    directory = os.path.dirname(os.path.abspath(index_file))
+    fd, tmp_file = tempfile.mkstemp(
+        prefix=os.path.basename(index_file), dir=directory)
+    try:
+        with os.fdopen(fd, "w") as openfile:
+            json.dump(content, openfile)
+        getattr(os, "replace", os.rename)(tmp_file, index_file)
+    except:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def load_gzip_index(fname, span=SPAN):
+    """ Load the index of a gzip file, building it if missing or outdated.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the gzip file.
+    span: int (optional)
+        the access point span used if the index has to be built.
+
+    Returns
+    -------
+    index: dict
+        the gzip index.
+    """
+    index_file = fname + INDEX_EXTENSION
+    stat = os.stat(fname)
+    try:
+        with open(index_file, "r") as openfile:
+            index = json.load(openfile)
+        if index["size"] != stat.st_size or index["mtime"] != stat.st_mtime:
+            raise ValueError("Outdated index.")
+        index["points"] = [
+            (coffset, uoffset, zlib.decompress(base64.b64decode(window)))
+            for coffset, uoffset, window in index["points"]]
+    except (IOError, OSError, ValueError, KeyError, TypeError, zlib.error):
+        index = build_gzip_index(fname, span=span)
+    return index
+
+
+def read_gzip_range(fname, offset, length, index=None):
+    """ Read a range of uncompressed bytes from a gzip file.
+
+    The decompression starts from the access point that precedes the
+    requested range.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the gzip file.
+    offset: int (mandatory)
+        the uncompressed offset of the range.
+    length: int (mandatory)
+        the number of bytes to read.
+    index: dict (optional, default None)
+        the gzip index, loaded or built if not specified.
+
+    Returns
+    -------
+    data: bytes
+        the requested bytes, shorter than 'length' if the range goes beyond
+        the end of the uncompressed data.
+    """
+    if index is None:
+        index = load_gzip_index(fname)
+
+    # Find the last access point before the range
+    point = index["points"][0]
+    for candidate in index["points"]:
+        if candidate[1] > offset:
+            break
+        point = candidate
+    coffset, uoffset, window = point
+
+    # Decompress from the access point until the range is read
+    blocks = []
+    remaining = length
+    skip = offset - uoffset
+    with open(fname, "rb") as openfile:
+        openfile.seek(coffset)
+        decompressor = _restart_decompressor(window)
+        while remaining > 0:
+            if _is_eof(decompressor):
+                openfile.seek(
+                    openfile.tell() - len(decompressor.unused_data) + 8)
+                if not _skip_gzip_header(openfile):
+                    break
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            chunk = openfile.read(CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("'{0}' is a truncated gzip file.".format(
+                    fname))
+            data = decompressor.decompress(chunk)
+            if skip >= len(data):
+                skip -= len(data)
+                continue
+            data = data[skip:skip + remaining]
+            skip = 0
+            remaining -= len(data)
+            blocks.append(data)
+
+    return b"".join(blocks)
+
+
+def _is_eof(decompressor):
+    """ Check if a decompressor reached the end of the deflate stream.
+
+    The 'eof' attribute is missing before python 3.3: the end of the stream
+    is then detected when data are left unused.
+    """
+    eof = getattr(decompressor, "eof", None)
+    if eof is None:
+        eof = bool(decompressor.unused_data)
+    return eof
+
+
+def _restart_decompressor(window):
+    """ Create a raw deflate decompressor with a preset window.
+    """
+    if window:
+        return zlib.decompressobj(-zlib.MAX_WBITS, zdict=window)
+    return zlib.decompressobj(-zlib.MAX_WBITS)
+
+
+def _split_on_markers(chunk):
+    """ Split a compressed chunk just after each sync flush marker.
+
+    Returns
+    -------
+    pieces: list of 2-uplet
+        the successive piece lengths and whether each piece ends with a
+        sync flush marker.
+    """
+    pieces = []
+    start = 0
+    position = chunk.find(SYNC_MARKER)
+    while position != -1:
+        end = position + len(SYNC_MARKER)
+        pieces.append((end - start, True))
+        start = end
+        position = chunk.find(SYNC_MARKER, start)
+    if start < len(chunk):
+        pieces.append((len(chunk) - start, False))
+    return pieces
+
+
+def _skip_gzip_header(openfile):
+    """ Read a gzip member header.
+
+    Returns
+    -------
+    found: bool
+        True if a member header has been read, False at the end of the file.
+    """
+    header = openfile.read(10)
+    if not header.strip(b"\x00"):
+        return False
+    magic1, magic2, method, flags = struct.unpack("<BBBB", header[:4])
+    if len(header) < 10 or (magic1, magic2, method) != (0x1f, 0x8b, 8):
+        raise ValueError("Not a gzip member header.")
+    if flags & 4:
+        extra_length = struct.unpack("<H", openfile.read(2))[0]
+        openfile.read(extra_length)
+    for flag in (8, 16):
+        if flags & flag:
+            while openfile.read(1) not in (b"\x00", b""):
+                pass
+    if flags & 2:
+        openfile.read(2)
+    return True
@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Memory backed handoff of intermediate data between pipeline nodes.
+
+An intermediate result is either written in a private directory of a
+memory file system ('/dev/shm' when available), the handle being the file
+path, or in a 'multiprocessing.shared_memory' segment (python >= 3.8), the
+handle being a 'shm://<name>/<size>' string. The handoff data are never
+removed automatically: each handle must be released explicitly once
+consumed.
+"""
+
+# System import
+import os
+import getpass
+import tempfile
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
+
+# The prefix of the shared memory handles
+SHM_SCHEME = "shm://"
+
+# The memory file system
+SHM_DIRECTORY = "/dev/shm"
+
+
+def handoff_directory():
+    """ Get the private handoff directory of the current user.
+
+    Returns
+    -------
+    directory: str
+        a directory in '/dev/shm' if available, in the temporary directory
+        otherwise.
+    """
+    root = SHM_DIRECTORY
+    if not (os.path.isdir(root) and os.access(root, os.W_OK)):
+        root = tempfile.gettempdir()
+    directory = os.path.join(root, "mmutils-{0}".format(getpass.getuser()))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    return directory
+
+
+def create_handoff_directory():
+    """ Create a unique directory in the private handoff directory.
+
+    Each handoff file is written in its own directory, so that concurrent
+    nodes producing files with the same name do not overwrite each other.
+
+    Returns
+    -------
+    directory: str
+        the new directory, removed when its handoff file is released.
+    """
+    return tempfile.mkdtemp(prefix="handoff-", dir=handoff_directory())
+
+
+def is_shared_memory_handle(handle):
+    """ Check if a handle refers to a shared memory segment.
+    """
+    return handle.startswith(SHM_SCHEME)
+
+
+def create_shared_buffer(size):
+    """ Create a shared memory segment that outlives the current process.
+
+    Parameters
+    ----------
+    size: int (mandatory)
+        the size of the data in bytes.
+
+    Returns
+    -------
+    handle: str
+        the segment handle 'shm://<name>/<size>'.
+    shm: SharedMemory
+        the segment, to be closed by the caller.
+    """
+    shm = _shared_memory(create=True, size=max(size, 1))
+    handle = "{0}{1}/{2}".format(SHM_SCHEME, shm.name, size)
+    return handle, shm
+
+
+def attach_shared_buffer(handle):
+    """ Attach a shared memory segment from its handle.
+
+    Parameters
+    ----------
+    handle: str (mandatory)
+        the segment handle.
+
+    Returns
+    -------
+    shm: SharedMemory
+        the segment, to be closed by the caller.
+    data: memoryview
+        the segment data.
+    """
+    name, size = _parse_handle(handle)
+    shm = _shared_memory(name=name)
+    return shm, shm.buf[:size]
+
+
+def release_handle(handle):
+    """ Free the data associated to a handoff handle.
+
+    Parameters
+    ----------
+    handle: str (mandatory)
+        a shared memory handle or a file in the handoff directory.
+
+    Returns
+    -------
+    released: bool
+        True if the data have been freed, False if already released.
+    """
+    # Shared memory segment
+    if is_shared_memory_handle(handle):
+        name, _ = _parse_handle(handle)
+        try:
+            shm = _shared_memory(name=name)
+        except OSError:
+            return False
+        shm.close()
+        if getattr(shm, "_track", True):
+            # Untracked segment: register it for 'unlink' to unregister it
+            resource_tracker.register(shm._name, "shared_memory")
+        shm.unlink()
+        return True
+
+    # Handoff file: never remove a file outside the handoff directory
+    directory = os.path.realpath(handoff_directory())
+    parent = os.path.dirname(os.path.realpath(handle))
+    if directory not in (parent, os.path.dirname(parent)):
+        raise ValueError("'{0}' is not a handoff file.".format(handle))
+    if not os.path.isfile(handle):
+        return False
+    os.remove(handle)
+    if parent != directory:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
+    return True
+
+
+def _parse_handle(handle):
+    """ Get the segment name and data size of a shared memory handle.
+    """
+    if not is_shared_memory_handle(handle):
+        raise ValueError("'{0}' is not a shared memory handle.".format(
+            handle))
+    name, size = handle[len(SHM_SCHEME):].rsplit("/", 1)
+    return name, int(size)
+
+
+def _shared_memory(**kwargs):
+    """ Create or attach a shared memory segment not tracked by the
+    resource tracker, which would otherwise destroy it when the current
+    process exits.
+    """
+    if shared_memory is None:
+        raise ImportError("The shared memory handoff requires python >= "
+                          "3.8.")
+    try:
+        return shared_memory.SharedMemory(track=False, **kwargs)
+    except TypeError:
+        shm = shared_memory.SharedMemory(**kwargs)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
@@ -9,8 +9,37 @@
 
 # System import
 import os
-import gzip
+import errno
+import logging
 import shutil
+import struct
+import time
+import zlib
+import multiprocessing
+import multiprocessing.pool
+import threading
+import functools
+
+# mmutils import
+from .compression import detect_codec
+from .compression import get_codec
+from .compression import DECOMPRESSION_ERRORS
+from .uptodate import is_up_to_date
+from .uptodate import record
+from .handoff import create_shared_buffer
+from .handoff import create_handoff_directory
+from .handoff import release_handle
+from .gzindex import load_gzip_index
+from .gzindex import SPAN
+from .gzindex import read_gzip_range
+from .nifti import HEADER_SIZE
+from .nifti import read_nifti_header
+from .nifti import volume_byte_range
+from .nifti import volume_header
+
+
+# Default size in bytes of the chunks processed at once when streaming data
+BUFFER_SIZE = 1024 * 1024
 
 
 def element_to_list(element):
@@ -47,35 +76,75 @@ def list_to_element(listobj, force=False):
     return element
 
 
-def ungzip_list_files(fnames, prefix="u", output_directory=None):
+def ungzip_list_files(fnames, prefix="u", output_directory=None,
+                      buffer_size=BUFFER_SIZE, max_workers=1,
+                      executor="process", incremental=False, use_hash=False):
     """ Copy and ungzip the input files.
 
+    If 'max_workers' is greater than one, the files are ungzipped by a pool
+    of workers, the largest files being scheduled first. The returned files
+    are in the input order and the error raised, if any, is the one of the
+    first failing file in the input order, as in the sequential execution.
+
     <unit>
         <input name="fnames" type="List_File" desc="input files to ungzip."/>
         <input name="prefix" type="String" desc="the prefix of the result
             file."/>
         <input name="output_directory" type="Directory" desc="the output
             directory where ungzip file is saved."/>
+        <input name="buffer_size" type="Int" optional="True" desc="the size
+            in bytes of the chunks decompressed at once."/>
+        <input name="incremental" type="Bool" optional="True" desc="skip
+            the decompression if the output file is up to date."/>
+        <input name="use_hash" type="Bool" optional="True" desc="compare
+            the input file contents in incremental mode."/>
+        <input name="max_workers" type="Int" optional="True" desc="the
+            number of files ungzipped in parallel."/>
+        <input name="executor" type="String" optional="True" desc="the
+            kind of workers, 'process' or 'thread'."/>
         <output name="ungzipfnames" type="List_File" desc="the returned
             ungzip files."/>
     </unit>
     """
-    ungzipfnames = []
-    for fname in fnames:
-        ungzipfnames.append(ungzip_file(fname, prefix, output_directory))
+    ungzipfnames = _map_largest_first(
+        ungzip_file,
+        [(fname, prefix, output_directory, buffer_size, incremental,
+          use_hash) for fname in fnames],
+        fnames, max_workers, executor)
 
     return ungzipfnames
 
 
-def ungzip_file(fname, prefix="u", output_directory=None):
+def ungzip_file(fname, prefix="u", output_directory=None,
+                buffer_size=BUFFER_SIZE, incremental=False, use_hash=False):
     """ Copy and ungzip the input file.
 
+    The compression codec (gzip, bz2 or xz) is detected from the first
+    bytes of the file, uncompressed files being returned as they are. The
+    file is decompressed in chunks of 'buffer_size' bytes that are
+    streamed to the output file, so that the memory usage does not depend
+    on the size of the decompressed image. The integrity of the data is
+    checked while streaming (CRC32 and size for gzip files) and a truncated
+    or corrupted file raises a ValueError.
+
+    In 'incremental' mode, the decompression is skipped if the output file
+    has already been generated from the unchanged input file, as recorded
+    in an index stored in the output directory. If 'use_hash' is set, an
+    input file with a new modification time but the same content is also
+    considered unchanged.
+
     <unit>
         <input name="fname" type="File" desc="an input file to ungzip."/>
         <input name="prefix" type="String" desc="the prefix of the result
             file."/>
         <input name="output_directory" type="Directory" desc="the output
             directory where ungzip file is saved."/>
+        <input name="buffer_size" type="Int" optional="True" desc="the size
+            in bytes of the chunks decompressed at once."/>
+        <input name="incremental" type="Bool" optional="True" desc="skip
+            the decompression if the output file is up to date."/>
+        <input name="use_hash" type="Bool" optional="True" desc="compare
+            the input file contents in incremental mode."/>
         <output name="ungzipfname" type="File" desc="the returned
             ungzip file."/>
     </unit>
@@ -92,36 +161,98 @@ def ungzip_file(fname, prefix="u", output_directory=None):
     else:
         output_directory = os.path.dirname(fname)
 
-    # Get the file descriptors
-    base, extension = os.path.splitext(fname)
-    basename = os.path.basename(base)
+    # Detect the compression codec from the file content
+    codec = detect_codec(fname)
 
-    # Ungzip only known extension
-    if extension in [".gz"]:
+    # Uncompress only known codecs
+    if codec.magic is not None:
 
         # Generate the output file name
+        basename = os.path.basename(fname)
+        if basename.endswith(codec.extension):
+            basename = basename[:-len(codec.extension)]
         basename = prefix + basename
         ungzipfname = os.path.join(output_directory, basename)
+        if os.path.abspath(ungzipfname) == os.path.abspath(fname):
+            raise ValueError("'{0}' would be overwritten, use a prefix or an "
+                             "output directory.".format(fname))
 
-        # Read the input gzip file
-        with gzip.open(fname, "rb") as gzfobj:
-            data = gzfobj.read()
+        # Skip the decompression if the output file is up to date
+        if incremental and is_up_to_date(fname, ungzipfname, use_hash):
+            return ungzipfname
 
-        # Write the output ungzip file
-        with open(ungzipfname, "wb") as openfile:
-            openfile.write(data)
+        # Stream the input compressed file to the output file
+        _uncompress(codec, fname, ungzipfname, buffer_size)
+        if incremental:
+            record(fname, ungzipfname, use_hash)
 
-    # Default, unknown compression extension: the input file is returned
+    # Default, uncompressed file: the input file is returned
     else:
         ungzipfname = fname
 
     return ungzipfname
 
 
+def gzip_list_files(fnames, prefix="g", output_directory=None,
+                    remove_original_file=False, compresslevel=None,
+                    threads=1, codec="gzip", preset=None, max_workers=1,
+                    executor="process", max_inflight_bytes=None):
+    """ Copy and gzip the input files.
+
+    If 'max_workers' is greater than one, the files are compressed by a
+    pool of workers, the largest files being scheduled first. A new file is
+    started only while the total size of the files being compressed stays
+    below 'max_inflight_bytes', which bounds the load on the file system.
+
+    <unit>
+        <input name="fnames" type="List_File" desc="input files to gzip."/>
+        <input name="prefix" type="String" desc="the prefix of the result
+            files."/>
+        <input name="output_directory" type="Directory" desc="the output
+            directory where gzip files are saved."/>
+        <input name="remove_original_file" type="Bool" desc="remove the
+            original files" />
+        <input name="compresslevel" type="Int" optional="True" desc="the
+            compression level, overwrite the preset level."/>
+        <input name="threads" type="Int" optional="True" desc="the number
+            of cores used to compress each file."/>
+        <input name="codec" type="String" optional="True" desc="the
+            compression codec: 'gzip', 'bz2' or 'xz'."/>
+        <input name="preset" type="String" optional="True" desc="the
+            compression preset: 'fast', 'default' or 'best'."/>
+        <input name="max_workers" type="Int" optional="True" desc="the
+            number of files compressed in parallel."/>
+        <input name="executor" type="String" optional="True" desc="the
+            kind of workers, 'process' or 'thread'."/>
+        <input name="max_inflight_bytes" type="Int" optional="True" desc="the
+            maximum total size of the files compressed at the same time."/>
+        <output name="gzipfnames" type="List_File" desc="the returned
+            gzip files."/>
+    </unit>
+    """
+    gzipfnames = _map_largest_first(
+        gzip_file,
+        [(fname, prefix, output_directory, remove_original_file,
+          compresslevel, threads, codec, preset) for fname in fnames],
+        fnames, max_workers, executor, max_inflight_bytes)
+
+    return gzipfnames
+
+
 def gzip_file(fname, prefix="g", output_directory=None,
-              remove_original_file=False):
+              remove_original_file=False, compresslevel=None, threads=1,
+              codec="gzip", preset=None):
     """ Copy and gzip the input file.
 
+    The file is compressed with the requested codec ('gzip', 'bz2' or
+    'xz'), the level being set by 'compresslevel' or, if not specified, by
+    the 'fast', 'default' or 'best' codec preset. Already compressed files
+    are returned as they are.
+
+    If 'threads' is greater than one and the codec is 'gzip', the input
+    file is split in blocks that are compressed independently on several
+    cores and written as a single standard gzip member.
+
     <unit>
         <input name="fname" type="File" desc="an input file to gzip."/>
         <input name="prefix" type="String" desc="the prefix of the result
@@ -130,6 +261,14 @@ def gzip_file(fname, prefix="g", output_directory=None,
             directory where gzip file is saved."/>
         <input name="remove_original_file" type="Bool" desc="remove the original
             file" />
+        <input name="compresslevel" type="Int" optional="True" desc="the
+            compression level, overwrite the preset level."/>
+        <input name="threads" type="Int" optional="True" desc="the number
+            of cores used to compress the file."/>
+        <input name="codec" type="String" optional="True" desc="the
+            compression codec: 'gzip', 'bz2' or 'xz'."/>
+        <input name="preset" type="String" optional="True" desc="the
+            compression preset: 'fast', 'default' or 'best'."/>
         <output name="gzipfname" type="File" desc="the returned
             gzip file."/>
     </unit>
@@ -146,22 +285,34 @@ def gzip_file(fname, prefix="g", output_directory=None,
     else:
         output_directory = os.path.dirname(fname)
 
+    # Get the compression codec and level
+    codec = get_codec(codec)
+    if codec.magic is None:
+        raise ValueError("'{0}' is not a compression codec.".format(
+            codec.name))
+    if compresslevel is None:
+        compresslevel = codec.level(preset)
+
     # Get the file descriptors
     base, extension = os.path.splitext(fname)
-    # Gzip only non compressed file
-    if extension not in [".gz"]:
+    # Compress only non compressed file
+    if detect_codec(fname).magic is None:
 
         # Generate the output file name
         if prefix:
-            basename = prefix + os.path.basename(base) + extension + ".gz"
+            basename = (prefix + os.path.basename(base) + extension +
+                        codec.extension)
         else:
-            basename = os.path.basename(base) + extension + ".gz"
+            basename = os.path.basename(base) + extension + codec.extension
         gzipfname = os.path.join(output_directory, basename)
 
-        # Write the output gzip file
-        with open(fname, "rb") as openfile:
-            with gzip.open(gzipfname, "w") as gzfobj:
-                gzfobj.writelines(openfile)
+        # Write the output compressed file
+        if threads > 1 and codec.name == "gzip":
+            _parallel_gzip(fname, gzipfname, compresslevel, threads)
+        else:
+            with open(fname, "rb") as openfile:
+                with codec.open(gzipfname, "wb", compresslevel) as gzfobj:
+                    shutil.copyfileobj(openfile, gzfobj, BUFFER_SIZE)
 
         if remove_original_file:
             os.remove(fname)
@@ -173,6 +324,129 @@ def gzip_file(fname, prefix="g", output_directory=None,
     return gzipfname
 
 
+def extract_volume(fname, volume_index, prefix="v", output_directory=None):
+    """ Extract a 3D volume from a single file NIfTI image.
+
+    For gzip images, only the data following the access point that precedes
+    the volume is decompressed, using the access point index stored beside
+    the image (built on first use). The access points are only found at the
+    gzip member starts and at the sync flush markers: an image compressed
+    as a single deflate stream, as by the standard gzip tool, is always
+    decompressed from its start, and a warning is logged. Such an image
+    should be recompressed with 'gzip_file' and several threads, pigz or
+    bgzip for a fast random access.
+
+    <unit>
+        <input name="fname" type="File" desc="a gzip or uncompressed NIfTI
+            image."/>
+        <input name="volume_index" type="Int" desc="the index of the volume
+            to extract."/>
+        <input name="prefix" type="String" desc="the prefix of the result
+            file."/>
+        <input name="output_directory" type="Directory" desc="the output
+            directory where the volume is saved."/>
+        <output name="volumefname" type="File" desc="the returned
+            uncompressed 3D volume."/>
+    </unit>
+    """
+    # Check the input file exists on the file system
+    if not os.path.isfile(fname):
+        raise ValueError("'{0}' is not a valid filename.".format(fname))
+
+    # Check that the outdir is valid
+    if output_directory is not None:
+        if not os.path.isdir(output_directory):
+            raise ValueError(
+                "'{0}' is not a valid directory.".format(output_directory))
+    else:
+        output_directory = os.path.dirname(fname)
+
+    # Locate the requested volume from the image header
+    codec, read = _range_reader(fname)
+    header = read_nifti_header(read(0, HEADER_SIZE))
+    offset, length = volume_byte_range(header, volume_index)
+    data = read(offset, length)
+    if len(data) != length:
+        raise ValueError("'{0}' is a truncated image.".format(fname))
+
+    # Generate the output file name
+    basename = os.path.basename(fname)
+    if basename.endswith(codec.extension):
+        basename = basename[:-len(codec.extension)]
+    if basename.endswith(".nii"):
+        basename = basename[:-len(".nii")]
+    volumefname = os.path.join(output_directory, "{0}{1}_{2:04d}.nii".format(
+        prefix, basename, volume_index))
+
+    # Write the output volume
+    with open(volumefname, "wb") as openfile:
+        openfile.write(volume_header(read(0, header["vox_offset"]), header))
+        openfile.write(data)
+
+    return volumefname
+
+
+def ungzip_to_handoff(fname, prefix="u", use_shared_memory=False,
+                      buffer_size=BUFFER_SIZE):
+    """ Ungzip the input file to memory for the next pipeline node.
+
+    The file is decompressed in a new private directory of the memory file
+    system ('/dev/shm' when available) and the returned handle is the
+    output path, or, if 'use_shared_memory' is set, in a shared memory
+    segment whose handle is 'shm://<name>/<size>'. The data are kept until
+    the handle is released with 'release_handoff'.
+
+    <unit>
+        <input name="fname" type="File" desc="an input file to ungzip."/>
+        <input name="prefix" type="String" desc="the prefix of the result
+            file."/>
+        <input name="use_shared_memory" type="Bool" optional="True"
+            desc="decompress in a shared memory segment."/>
+        <input name="buffer_size" type="Int" optional="True" desc="the size
+            in bytes of the chunks decompressed at once."/>
+        <output name="handle" type="String" desc="the handle of the
+            ungzip data."/>
+    </unit>
+    """
+    # Check the input file exists on the file system
+    if not os.path.isfile(fname):
+        raise ValueError("'{0}' is not a valid filename.".format(fname))
+
+    # Decompress in a shared memory segment
+    if use_shared_memory:
+        handle = _uncompress_to_shared_memory(
+            detect_codec(fname), fname, buffer_size)
+
+    # Decompress in a new handoff directory, copy uncompressed files
+    else:
+        directory = create_handoff_directory()
+        try:
+            handle = ungzip_file(fname, prefix, directory, buffer_size)
+            if handle == fname:
+                handle = os.path.join(directory,
+                                      prefix + os.path.basename(fname))
+                shutil.copyfile(fname, handle)
+        except:
+            shutil.rmtree(directory)
+            raise
+
+    return handle
+
+
+def release_handoff(handle):
+    """ Free the data of a handoff handle.
+
+    <unit>
+        <input name="handle" type="String" desc="a handle returned by
+            'ungzip_to_handoff'."/>
+        <output name="released" type="Bool" desc="False if the data were
+            already released."/>
+    </unit>
+    """
+    released = release_handle(handle)
+    return released
+
+
 def rename_file(input_filepath, output_filepath):
     """ Rename a file (same loc)
 
@@ -188,13 +462,54 @@ def rename_file(input_filepath, output_filepath):
     if os.path.isfile(output_filepath):
         raise Exception("Output file exist !")
     # get output folder
-    shutil.move(input_filepath, output_filepath)
+    method = _move_file(input_filepath, output_filepath)
+    logging.info("'{0}' moved to '{1}' ({2}).".format(
+        input_filepath, output_filepath, method))
 
     output_file = output_filepath
 
     return output_file
 
 
+def relocate_files(input_filepaths, output_filepaths):
+    """ Move files using the fastest available method.
+
+    Each file is renamed if possible, else hard linked then unlinked, else
+    copied by the kernel ('copy_file_range' or 'sendfile') and finally
+    copied in user space. The method used for each file is returned.
+
+    <unit>
+        <input name="input_filepaths" type="List_File" desc="the input files
+            to move."/>
+        <input name="output_filepaths" type="List_String" desc="the output
+            filepaths."/>
+        <output name="output_files" type="List_File" desc="the moved
+            files."/>
+        <output name="methods" type="List_String" desc="the method used to
+            move each file: 'rename', 'link', 'copy_file_range', 'sendfile'
+            or 'copy'."/>
+    </unit>
+    """
+    # Check the parameters
+    if len(input_filepaths) != len(output_filepaths):
+        raise ValueError("Expect as many input files as output filepaths.")
+    for output_filepath in output_filepaths:
+        if os.path.isfile(output_filepath):
+            raise Exception("Output file exist !")
+
+    # Move the files
+    output_files = []
+    methods = []
+    for input_filepath, output_filepath in zip(input_filepaths,
+                                               output_filepaths):
+        methods.append(_move_file(input_filepath, output_filepath))
+        logging.info("'{0}' moved to '{1}' ({2}).".format(
+            input_filepath, output_filepath, methods[-1]))
+        output_files.append(output_filepath)
+
+    return output_files, methods
+
+
 def spm_tissue_probability_maps():
     """ SPM tissue probability maps.
 
@@ -236,3 +551,507 @@ def noprocess_switch(input_value):
     output_value = input_value
 
     return output_value
+
+
+def _map_largest_first(func, args_list, fnames, max_workers=1,
+                       executor="process", max_inflight_bytes=None):
+    """ Apply a function on a list of arguments using a pool of workers.
+
+    Parameters
+    ----------
+    func: callable (mandatory)
+        the function to apply, must be picklable for a 'process' executor.
+    args_list: list of tuple (mandatory)
+        the positional arguments of each call.
+    fnames: list of str (mandatory)
+        the file processed by each call: the calls on the largest files are
+        scheduled first.
+    max_workers: int (optional, default 1)
+        the number of workers, the calls are executed sequentially if 1.
+    executor: str (optional, default 'process')
+        the kind of workers, 'process' or 'thread'.
+    max_inflight_bytes: int (optional, default None)
+        if set, a call is started only when the total size of the files
+        being processed stays below this budget. A file larger than the
+        budget is processed alone.
+
+    Returns
+    -------
+    results: list
+        the result of each call in the input order. If some calls failed,
+        the error of the first failing call in the input order is raised.
+    """
+    # Sequential execution
+    if max_workers <= 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+
+    # Create the pool of workers
+    if executor == "process":
+        pool = multiprocessing.Pool(max_workers)
+    elif executor == "thread":
+        pool = multiprocessing.pool.ThreadPool(max_workers)
+    else:
+        raise ValueError("'{0}' is not a valid executor, expect 'process' "
+                         "or 'thread'.".format(executor))
+
+    # Schedule the largest files first, missing files are left to the
+    # workers that will report the error
+    sizes = []
+    for fname in fnames:
+        try:
+            sizes.append(os.path.getsize(fname))
+        except (OSError, TypeError):
+            sizes.append(0)
+    order = sorted(range(len(args_list)), key=lambda index: -sizes[index])
+
+    # Release the budget of the finished calls
+    condition = threading.Condition()
+    inflight_bytes = [0]
+
+    def release(size, result):
+        with condition:
+            inflight_bytes[0] -= size
+            condition.notify()
+
+    # Execute the calls within the budget and collect the results in the
+    # input order
+    try:
+        async_results = [None] * len(args_list)
+        for index in order:
+            size = sizes[index]
+            with condition:
+                while (max_inflight_bytes is not None and
+                        inflight_bytes[0] > 0 and
+                        inflight_bytes[0] + size > max_inflight_bytes):
+                    condition.wait()
+                inflight_bytes[0] += size
+            async_results[index] = pool.apply_async(
+                _safe_call, (func, args_list[index]),
+                callback=functools.partial(release, size))
+        results = []
+        for async_result in async_results:
+            succeeded, result = async_result.get()
+            if not succeeded:
+                raise result
+            results.append(result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def _safe_call(func, args):
+    """ Call a function and catch its error.
+
+    Returns
+    -------
+    succeeded: bool
+        False if the call raised an error.
+    result: object
+        the function result or the raised error.
+    """
+    try:
+        return True, func(*args)
+    except Exception as error:
+        return False, error
+
+
+def _deflate_block(args):
+    """ Compress a block of data as a raw deflate stream.
+
+    Parameters
+    ----------
+    args: 2-uplet (mandatory)
+        the data block and the compression level.
+
+    Returns
+    -------
+    deflated: bytes
+        the compressed block, terminated by a sync flush so that compressed
+        blocks can be concatenated.
+    """
+    block, compresslevel = args
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    deflated = compressor.compress(block)
+    deflated += compressor.flush(zlib.Z_SYNC_FLUSH)
+    return deflated
+
+
+def _parallel_gzip(fname, gzipfname, compresslevel=9, threads=2,
+                   block_size=BUFFER_SIZE):
+    """ Gzip a file by compressing independent blocks on several cores.
+
+    The blocks are compressed by a pool of threads (zlib releases the GIL)
+    and written in order in a single gzip member, so that the output can be
+    read by any gzip reader. The memory usage is bounded to a few blocks
+    per thread.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the file to compress.
+    gzipfname: str (mandatory)
+        the destination gzip file.
+    compresslevel: int (optional, default 9)
+        the compression level from 1 (fast) to 9 (best).
+    threads: int (optional, default 2)
+        the number of compression threads.
+    block_size: int (optional)
+        the size in bytes of the independently compressed blocks.
+    """
+    if compresslevel == 9:
+        extra_flags = 2
+    elif compresslevel == 1:
+        extra_flags = 4
+    else:
+        extra_flags = 0
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        with open(fname, "rb") as openfile:
+            with open(gzipfname, "wb") as gzfobj:
+
+                # Header: magic, deflate method, no flag, mtime, unix os
+                gzfobj.write(struct.pack(
+                    "<BBBBIBB", 0x1f, 0x8b, 8, 0, int(time.time()),
+                    extra_flags, 3))
+
+                # Compress the blocks window by window to bound the memory
+                crc = 0
+                size = 0
+                while True:
+                    blocks = []
+                    for _ in range(2 * threads):
+                        block = openfile.read(block_size)
+                        if not block:
+                            break
+                        blocks.append(block)
+                    if not blocks:
+                        break
+                    deflated_blocks = pool.map(
+                        _deflate_block,
+                        [(block, compresslevel) for block in blocks])
+                    for block, deflated in zip(blocks, deflated_blocks):
+                        crc = zlib.crc32(block, crc)
+                        size += len(block)
+                        gzfobj.write(deflated)
+
+                # Last empty deflate block and trailer: crc32 and size
+                compressor = zlib.compressobj(
+                    compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+                gzfobj.write(compressor.flush(zlib.Z_FINISH))
+                gzfobj.write(struct.pack(
+                    "<II", crc & 0xffffffff, size & 0xffffffff))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _range_reader(fname):
+    """ Create a function reading byte ranges of a gzip or raw file.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the gzip or uncompressed file.
+
+    Returns
+    -------
+    codec: Codec
+        the file codec.
+    read: callable
+        a function 'read(offset, length)' returning the requested
+        uncompressed bytes.
+    """
+    codec = detect_codec(fname)
+    if codec.name == "gzip":
+        index = load_gzip_index(fname)
+        if len(index["points"]) == 1 and index["usize"] > SPAN:
+            logging.warning(
+                "'{0}' has no access point after its start: the ranges are "
+                "decompressed from the start of the file. Recompress it with "
+                "'gzip_file' and several threads, pigz or bgzip for a fast "
+                "random access.".format(fname))
+
+        def read(offset, length):
+            return read_gzip_range(fname, offset, length, index)
+    elif codec.magic is None:
+
+        def read(offset, length):
+            with open(fname, "rb") as openfile:
+                openfile.seek(offset)
+                return openfile.read(length)
+    else:
+        raise ValueError("'{0}' is a '{1}' file, random access is only "
+                         "supported for gzip or uncompressed files.".format(
+                             fname, codec.name))
+    return codec, read
+
+
+def _move_file(source, destination):
+    """ Move a file using the fastest available method.
+
+    The methods are tried in order: a rename, a hard link followed by an
+    unlink, a kernel side copy with 'copy_file_range' or 'sendfile' and,
+    as a last resort, a user space copy. Directories are moved with
+    'shutil.move'.
+
+    Parameters
+    ----------
+    source: str (mandatory)
+        the file to move.
+    destination: str (mandatory)
+        the destination file path.
+
+    Returns
+    -------
+    method: str
+        the method used: 'rename', 'link', 'copy_file_range', 'sendfile'
+        or 'copy'.
+    """
+    # Same file system: rename or hard link
+    try:
+        os.rename(source, destination)
+        return "rename"
+    except OSError:
+        pass
+    if os.path.isdir(source):
+        shutil.move(source, destination)
+        return "copy"
+    try:
+        os.link(source, destination)
+        os.remove(source)
+        return "link"
+    except (OSError, AttributeError):
+        pass
+
+    # Different file systems: copy the data then remove the source
+    method = _kernel_copy(source, destination)
+    if method is None:
+        shutil.copyfile(source, destination)
+        method = "copy"
+    if os.path.getsize(destination) != os.path.getsize(source):
+        os.remove(destination)
+        raise IOError("'{0}' has not been entirely copied to '{1}'.".format(
+            source, destination))
+    shutil.copystat(source, destination)
+    os.remove(source)
+    return method
+
+
+def _kernel_copy(source, destination):
+    """ Copy a file without going through user space buffers.
+
+    Parameters
+    ----------
+    source: str (mandatory)
+        the file to copy.
+    destination: str (mandatory)
+        the destination file path.
+
+    Returns
+    -------
+    method: str
+        the system call used, 'copy_file_range' or 'sendfile', or None if
+        none is available or supported by the file systems or if the copy
+        is short, in which case the destination must be copied again.
+    """
+    with open(source, "rb") as fsource:
+        with open(destination, "wb") as fdestination:
+            infd = fsource.fileno()
+            outfd = fdestination.fileno()
+            size = os.fstat(infd).st_size
+            for method in ("copy_file_range", "sendfile"):
+                if not hasattr(os, method):
+                    continue
+                offset = 0
+                try:
+                    while offset < size:
+                        if method == "copy_file_range":
+                            sent = os.copy_file_range(
+                                infd, outfd, size - offset, offset, offset)
+                        else:
+                            sent = os.sendfile(
+                                outfd, infd, offset, size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                    # Short copy: let the caller copy the whole file
+                    if offset != size:
+                        return None
+                    return method
+                except OSError as error:
+                    # Not supported: try the next method if no data has
+                    # been copied yet
+                    if offset > 0 or error.errno not in (
+                            errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                            errno.EOPNOTSUPP, errno.EBADF):
+                        raise
+    return None
+
+
+def _uncompress(codec, fname, ufname, buffer_size=BUFFER_SIZE):
+    """ Uncompress a file chunk by chunk.
+
+    For gzip files, the output is preallocated using the size stored in the
+    gzip trailer (ISIZE), which is never larger than the uncompressed size,
+    and the output is truncated once written. The integrity checks of the
+    codec (CRC32 and ISIZE for gzip) are performed while streaming: on error
+    the partial output is removed.
+
+    Parameters
+    ----------
+    codec: Codec (mandatory)
+        the codec of the input file.
+    fname: str (mandatory)
+        the compressed file.
+    ufname: str (mandatory)
+        the destination uncompressed file.
+    buffer_size: int (optional)
+        the size in bytes of the chunks decompressed at once.
+    """
+    size_hint = None
+    if codec.name == "gzip":
+        size_hint = _gzip_size_hint(fname)
+    try:
+        with codec.open(fname, "rb") as fobj:
+            with open(ufname, "wb") as openfile:
+                if size_hint and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(openfile.fileno(), 0, size_hint)
+                    except OSError:
+                        pass
+                while True:
+                    try:
+                        block = fobj.read(buffer_size)
+                    except DECOMPRESSION_ERRORS as error:
+                        raise ValueError(
+                            "'{0}' is a truncated or corrupted {1} file: "
+                            "{2}.".format(fname, codec.name, error))
+                    if not block:
+                        break
+                    openfile.write(block)
+                openfile.truncate()
+    except:
+        if os.path.isfile(ufname):
+            os.remove(ufname)
+        raise
+
+
+def _gzip_size_hint(fname, exact=False):
+    """ Get the uncompressed size of a gzip file from its trailer.
+
+    The trailer stores the size of the last gzip member modulo 4 GiB, a
+    lower bound of the uncompressed size.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the gzip file.
+    exact: bool (optional, default False)
+        if set, return None when the size may have wrapped around 4 GiB.
+
+    Returns
+    -------
+    size: int
+        the uncompressed size of the last gzip member modulo 4 GiB.
+    """
+    # Header (10 bytes), empty deflate stream (2 bytes), trailer (8 bytes)
+    compressed_size = os.path.getsize(fname)
+    if compressed_size < 20:
+        raise ValueError("'{0}' is a truncated gzip file.".format(fname))
+    with open(fname, "rb") as openfile:
+        openfile.seek(-4, os.SEEK_END)
+        size = struct.unpack("<I", openfile.read(4))[0]
+
+    # Deflate can not compress more than 1032:1: a larger size is not a
+    # gzip trailer and the file has been truncated
+    if size > 1032 * compressed_size:
+        raise ValueError("'{0}' is a truncated or corrupted gzip file: "
+                         "invalid trailer.".format(fname))
+
+    if not exact:
+        return size
+
+    # The content may reach 4 GiB: the size modulo 4 GiB is ambiguous
+    if 1032 * compressed_size >= 2 ** 32:
+        return None
+
+    # A gzip file can not be much larger than its content: a smaller size
+    # has wrapped around 4 GiB
+    if size + size // 100 + 1024 < compressed_size:
+        return None
+    return size
+
+
+def _uncompress_to_shared_memory(codec, fname, buffer_size=BUFFER_SIZE):
+    """ Uncompress a file chunk by chunk in a shared memory segment.
+
+    The segment size is the size stored in the gzip trailer when
+    available, otherwise the uncompressed size is first computed with a
+    decompression pass.
+
+    Parameters
+    ----------
+    codec: Codec (mandatory)
+        the codec of the input file.
+    fname: str (mandatory)
+        the compressed file.
+    buffer_size: int (optional)
+        the size in bytes of the chunks decompressed at once.
+
+    Returns
+    -------
+    handle: str
+        the shared memory handle.
+    """
+    size = None
+    if codec.name == "gzip":
+        size = _gzip_size_hint(fname, exact=True)
+    for attempt in range(2):
+
+        # Compute the uncompressed size with a first pass
+        if size is None:
+            size = 0
+            with codec.open(fname, "rb") as fobj:
+                for block in iter(lambda: fobj.read(buffer_size), b""):
+                    size += len(block)
+
+        # Decompress in a segment of this size
+        handle, shm = create_shared_buffer(size)
+        offset = 0
+        try:
+            with codec.open(fname, "rb") as fobj:
+                while True:
+                    try:
+                        block = fobj.read(buffer_size)
+                    except DECOMPRESSION_ERRORS as error:
+                        raise ValueError(
+                            "'{0}' is a truncated or corrupted {1} file: "
+                            "{2}.".format(fname, codec.name, error))
+                    end = offset + len(block)
+                    if not block or end > size:
+                        offset = end
+                        break
+                    shm.buf[offset:end] = block
+                    offset = end
+        except:
+            shm.close()
+            release_handle(handle)
+            raise
+        shm.close()
+
+        # The trailer size is only the size of the last gzip member: retry
+        # with the exact size if it does not match the data
+        if offset == size:
+            return handle
+        release_handle(handle)
+        size = None
+    raise IOError("'{0}' size changed during decompression.".format(fname))
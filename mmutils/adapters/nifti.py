@@ -0,0 +1,196 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Minimal access to the single file NIfTI-1 header, used to locate the
+image data without loading it.
+"""
+
+# System import
+import struct
+
+
+# The size of the NIfTI-1 header
+HEADER_SIZE = 348
+
+# The numpy data types of the NIfTI-1 data type codes, without byte order
+DATATYPES = {
+    2: "u1",
+    4: "i2",
+    8: "i4",
+    16: "f4",
+    64: "f8",
+    256: "i1",
+    512: "u2",
+    768: "u4",
+    1024: "i8",
+    1280: "u8"}
+
+# The NIfTI-1 float32 data type code
+FLOAT32 = 16
+
+
+def read_nifti_header(data):
+    """ Decode the fields of a NIfTI-1 header needed to locate the data.
+
+    Parameters
+    ----------
+    data: bytes (mandatory)
+        at least the first 348 bytes of a single file NIfTI-1 image.
+
+    Returns
+    -------
+    header: dict
+        the byte order 'endian' ('<' or '>'), the 'dim' array, the
+        'datatype', 'bitpix', 'vox_offset', 'scl_slope' and 'scl_inter'
+        fields.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Truncated NIfTI header.")
+    for endian in ("<", ">"):
+        if struct.unpack(endian + "i", data[:4])[0] == HEADER_SIZE:
+            break
+    else:
+        raise ValueError("Not a NIfTI-1 header.")
+    if data[344:348] != b"n+1\x00":
+        raise ValueError("Only single file NIfTI-1 images are supported.")
+    dim = list(struct.unpack(endian + "8h", data[40:56]))
+    datatype, bitpix = struct.unpack(endian + "hh", data[70:74])
+    vox_offset, scl_slope, scl_inter = struct.unpack(
+        endian + "fff", data[108:120])
+    header = {
+        "endian": endian,
+        "dim": dim,
+        "datatype": datatype,
+        "bitpix": bitpix,
+        "vox_offset": int(vox_offset),
+        "scl_slope": scl_slope,
+        "scl_inter": scl_inter}
+    return header
+
+
+def volume_byte_range(header, volume_index):
+    """ Get the byte range of a 3D volume in a NIfTI image.
+
+    The dimensions after the third one are flattened in Fortran order.
+
+    Parameters
+    ----------
+    header: dict (mandatory)
+        the decoded NIfTI header.
+    volume_index: int (mandatory)
+        the index of the volume.
+
+    Returns
+    -------
+    offset: int
+        the offset of the volume in the file.
+    length: int
+        the volume size in bytes.
+    """
+    dim = header["dim"]
+    nb_volumes = 1
+    for size in dim[4:dim[0] + 1]:
+        nb_volumes *= max(size, 1)
+    if volume_index < 0 or volume_index >= nb_volumes:
+        raise ValueError("'{0}' is not a valid volume index, the image has "
+                         "{1} volume(s).".format(volume_index, nb_volumes))
+    length = dim[1] * dim[2] * dim[3] * header["bitpix"] // 8
+    offset = header["vox_offset"] + volume_index * length
+    return offset, length
+
+
+def volume_header(data, header):
+    """ Adapt a NIfTI header to a single 3D volume.
+
+    Parameters
+    ----------
+    data: bytes (mandatory)
+        the header and extension bytes up to 'vox_offset'.
+    header: dict (mandatory)
+        the decoded NIfTI header.
+
+    Returns
+    -------
+    data: bytes
+        the header and extension bytes with dimensions 4 to 7 set to 1.
+    """
+    dim = header["dim"][:4] + [1, 1, 1, 1]
+    dim[0] = min(header["dim"][0], 3)
+    return (data[:40] + struct.pack(header["endian"] + "8h", *dim) +
+            data[56:header["vox_offset"]])
+
+
+def timeseries_shape(header):
+    """ Get the shape of a NIfTI image as a time series of volumes.
+
+    The dimensions after the third one are flattened in Fortran order.
+
+    Parameters
+    ----------
+    header: dict (mandatory)
+        the decoded NIfTI header.
+
+    Returns
+    -------
+    nb_volumes: int
+        the number of volumes.
+    nb_voxels: int
+        the number of voxels of each volume.
+    """
+    dim = header["dim"]
+    nb_voxels = 1
+    for size in dim[1:min(dim[0], 3) + 1]:
+        nb_voxels *= max(size, 1)
+    nb_volumes = 1
+    for size in dim[4:dim[0] + 1]:
+        nb_volumes *= max(size, 1)
+    return nb_volumes, nb_voxels
+
+
+def data_type(header):
+    """ Get the data type of a NIfTI image.
+
+    Parameters
+    ----------
+    header: dict (mandatory)
+        the decoded NIfTI header.
+
+    Returns
+    -------
+    dtype: str
+        the numpy data type with its byte order.
+    """
+    if header["datatype"] not in DATATYPES:
+        raise ValueError("The NIfTI data type '{0}' is not supported.".format(
+            header["datatype"]))
+    return header["endian"] + DATATYPES[header["datatype"]]
+
+
+def float32_header(data, header):
+    """ Adapt a NIfTI header to unscaled float32 data.
+
+    Parameters
+    ----------
+    data: bytes (mandatory)
+        the header and extension bytes up to 'vox_offset'.
+    header: dict (mandatory)
+        the decoded NIfTI header.
+
+    Returns
+    -------
+    data: bytes
+        the header and extension bytes with a float32 data type, no
+        intensity scaling and no display range.
+    """
+    endian = header["endian"]
+    return (data[:70] + struct.pack(endian + "hh", FLOAT32, 32) +
+            data[74:112] + struct.pack(endian + "ff", 1., 0.) +
+            data[120:124] + struct.pack(endian + "ff", 0., 0.) +
+            data[132:header["vox_offset"]])
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+Mergeable streaming quantile sketch of the columns of 2D arrays.
+
+The sketch follows the KLL compactor hierarchy: the rows are buffered in
+levels, a full level being sorted and half of its items, one over two from
+a random offset, being promoted to the next level with a doubled weight.
+All the columns share the same levels, so that each compaction is a single
+vectorized sort along the rows. The memory is bounded by about 3 * k rows
+whatever the number of rows seen, and the rank error is about 1.7 / k.
+"""
+
+# System import
+import random
+
+# Third party import
+import numpy
+
+
+# The decay of the level capacities from the top level
+CAPACITY_DECAY = 2. / 3.
+
+
+class QuantileSketch(object):
+    """ Approximate column quantiles accumulated over blocks of rows.
+
+    The exact column minimums and maximums are also tracked. Sketches
+    computed on separate blocks or files can be merged.
+    """
+    def __init__(self, k=200, seed=0):
+        """ Initialize the QuantileSketch class.
+
+        Parameters
+        ----------
+        k: int (optional, default 200)
+            the capacity of the top level, that controls the accuracy.
+        seed: int (optional, default 0)
+            the seed of the random compaction offsets, so that the same rows
+            give the same quantiles.
+        """
+        self.k = k
+        self.random = random.Random(seed)
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.levels = []
+
+    def __repr__(self):
+        return "<QuantileSketch k={0}, {1} rows, {2} levels>".format(
+            self.k, self.count, len(self.levels))
+
+    def update(self, block):
+        """ Add a block of rows.
+
+        Parameters
+        ----------
+        block: array (mandatory)
+            a 2D array of shape (rows, columns).
+        """
+        if block.shape[0] == 0:
+            return
+        other = QuantileSketch(self.k)
+        other.count = block.shape[0]
+        other.min = block.min(axis=0).astype(numpy.float64)
+        other.max = block.max(axis=0).astype(numpy.float64)
+        other.levels = [numpy.array(block, dtype=numpy.float64)]
+        self.merge(other)
+
+    def merge(self, other):
+        """ Merge the sketch of another set of rows.
+
+        Parameters
+        ----------
+        other: QuantileSketch (mandatory)
+            the sketch to merge.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.min = other.min.copy()
+            self.max = other.max.copy()
+            self.levels = [level.copy() for level in other.levels]
+            self._compress()
+            return
+        if len(other.min) != len(self.min):
+            raise ValueError("Can not merge statistics of {0} and {1} "
+                             "columns.".format(len(self.min), len(other.min)))
+        self.count += other.count
+        numpy.minimum(self.min, other.min, out=self.min)
+        numpy.maximum(self.max, other.max, out=self.max)
+        for index, level in enumerate(other.levels):
+            if index < len(self.levels):
+                self.levels[index] = numpy.concatenate(
+                    (self.levels[index], level))
+            else:
+                self.levels.append(level.copy())
+        self._compress()
+
+    def quantiles(self, probabilities):
+        """ Estimate column quantiles.
+
+        Parameters
+        ----------
+        probabilities: list of float (mandatory)
+            the requested probabilities in [0, 1].
+
+        Returns
+        -------
+        quantiles: array
+            the quantiles of shape (len(probabilities), columns).
+        """
+        if self.count == 0:
+            raise ValueError("The sketch is empty.")
+        values = numpy.concatenate(self.levels)
+        weights = numpy.concatenate([
+            numpy.full(len(level), 2 ** index, dtype=numpy.float64)
+            for index, level in enumerate(self.levels)])
+        order = numpy.argsort(values, axis=0, kind="mergesort")
+        values = numpy.take_along_axis(values, order, axis=0)
+        ranks = numpy.cumsum(weights[order], axis=0)
+        total = ranks[-1]
+        quantiles = []
+        for probability in probabilities:
+            if probability <= 0:
+                quantiles.append(self.min)
+            elif probability >= 1:
+                quantiles.append(self.max)
+            else:
+                index = (ranks < probability * total).sum(axis=0)
+                quantiles.append(values[index, numpy.arange(
+                    values.shape[1])])
+        return numpy.array(quantiles)
+
+    def _capacity(self, level):
+        """ Get the capacity of a level, decreasing from the top level.
+        """
+        depth = len(self.levels) - level - 1
+        return max(int(numpy.ceil(self.k * CAPACITY_DECAY ** depth)), 2)
+
+    def _compress(self):
+        """ Compact the full levels until each level fits its capacity.
+        """
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(items[:0])
+
+            # Keep one row if odd and promote one sorted row over two
+            keep = len(items) % 2
+            compacted = numpy.sort(items[keep:], axis=0)
+            promoted = compacted[self.random.randint(0, 1)::2]
+            self.levels[level] = items[:keep]
+            self.levels[level + 1] = numpy.concatenate(
+                (self.levels[level + 1], promoted))
+            level = 0
@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+##########################################################################
+# NSAp - Copyright (C) CEA, 2015
+# Distributed under the terms of the CeCILL-B license, as published by
+# the CEA-CNRS-INRIA. Refer to the LICENSE file or to
+# http://www.cecill.info/licences/Licence_CeCILL-B_V1-en.html
+# for details.
+##########################################################################
+
+"""
+On-disk index used by the io adapters to skip the generation of outputs
+that are already up to date.
+
+The index is a small json file stored in the output directory. Each entry
+is keyed on an output file name and records the signature of the source
+file (path, size, mtime and optionally an md5 content hash) and of the
+output file at the time it was generated.
+"""
+
+# System import
+import os
+import json
+import hashlib
+import tempfile
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The name of the index file stored in each output directory
+INDEX_NAME = ".mmutils_index.json"
+
+# The lock file serializing the index updates of concurrent workers
+LOCK_NAME = INDEX_NAME + ".lock"
+
+
+def file_signature(fname, use_hash=False):
+    """ Compute the signature of a file.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the path to a file.
+    use_hash: bool (optional, default False)
+        if True, add the md5 sum of the file content to the signature.
+
+    Returns
+    -------
+    signature: dict
+        the file real path, size, mtime and content hash (None if not
+        requested).
+    """
+    stat = os.stat(fname)
+    signature = {
+        "path": os.path.realpath(fname),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "hash": None}
+    if use_hash:
+        md5 = hashlib.md5()
+        with open(fname, "rb") as openfile:
+            for block in iter(lambda: openfile.read(1024 * 1024), b""):
+                md5.update(block)
+        signature["hash"] = md5.hexdigest()
+    return signature
+
+
+def load_index(directory):
+    """ Load the index of a directory.
+
+    Parameters
+    ----------
+    directory: str (mandatory)
+        the directory containing the index.
+
+    Returns
+    -------
+    index: dict
+        the index entries, empty if the index is missing or corrupted.
+    """
+    index_file = os.path.join(directory, INDEX_NAME)
+    try:
+        with open(index_file, "r") as openfile:
+            index = json.load(openfile)
+    except (IOError, OSError, ValueError):
+        index = {}
+    if not isinstance(index, dict):
+        index = {}
+    return index
+
+
+def save_index(index, directory):
+    """ Save atomically the index of a directory.
+
+    Parameters
+    ----------
+    index: dict (mandatory)
+        the index entries.
+    directory: str (mandatory)
+        the directory containing the index.
+    """
+    index_file = os.path.join(directory, INDEX_NAME)
+    fd, tmp_file = tempfile.mkstemp(prefix=INDEX_NAME, dir=directory)
+    try:
+        with os.fdopen(fd, "w") as openfile:
+            json.dump(index, openfile, indent=1, sort_keys=True)
+        getattr(os, "replace", os.rename)(tmp_file, index_file)
+    except:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def is_up_to_date(source, target, use_hash=False):
+    """ Check if a target file generated from a source file is up to date.
+
+    The target is up to date if it has not been modified since it was
+    recorded and if the source has the recorded path, size and mtime. If
+    'use_hash' is set, a source with a new mtime but the recorded size and
+    content is also considered unchanged.
+
+    Parameters
+    ----------
+    source: str (mandatory)
+        the source file.
+    target: str (mandatory)
+        the file generated from the source.
+    use_hash: bool (optional, default False)
+        if True, compare the source content hashes when the mtimes differ.
+
+    Returns
+    -------
+    uptodate: bool
+        True if the target does not need to be generated again.
+    """
+    # Check the target has been recorded and is unchanged
+    directory, basename = os.path.split(os.path.abspath(target))
+    entry = load_index(directory).get(basename)
+    if entry is None or not os.path.isfile(target):
+        return False
+    target_signature = file_signature(target)
+    if (target_signature["size"] != entry["target_size"] or
+            target_signature["mtime"] != entry["target_mtime"]):
+        return False
+
+    # Check the source is unchanged
+    source_signature = file_signature(source)
+    if (source_signature["path"] != entry["path"] or
+            source_signature["size"] != entry["size"]):
+        return False
+    if source_signature["mtime"] == entry["mtime"]:
+        return True
+    if use_hash and entry["hash"] is not None:
+        source_signature = file_signature(source, use_hash=True)
+        if source_signature["hash"] == entry["hash"]:
+            entry["mtime"] = source_signature["mtime"]
+            _save_entry(directory, basename, entry)
+            return True
+    return False
+
+
+def record(source, target, use_hash=False):
+    """ Record that a target file has been generated from a source file.
+
+    Parameters
+    ----------
+    source: str (mandatory)
+        the source file.
+    target: str (mandatory)
+        the file generated from the source.
+    use_hash: bool (optional, default False)
+        if True, record the source content hash.
+    """
+    directory, basename = os.path.split(os.path.abspath(target))
+    entry = file_signature(source, use_hash=use_hash)
+    target_signature = file_signature(target)
+    entry["target_size"] = target_signature["size"]
+    entry["target_mtime"] = target_signature["mtime"]
+    _save_entry(directory, basename, entry)
+
+
+@contextlib.contextmanager
+def _index_lock(directory):
+    """ Hold an exclusive lock on the index of a directory.
+
+    The lock is a no-op on the platforms without 'fcntl'.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_NAME), "a") as lockfile:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+
+def _save_entry(directory, basename, entry):
+    """ Save an entry in the index of a directory.
+
+    The index is reloaded and saved while holding the index lock, so that
+    the entries recorded by concurrent workers are kept.
+    """
+    with _index_lock(directory):
+        index = load_index(directory)
+        index[basename] = entry
+        save_index(index, directory)
@@ -60,5 +60,11 @@ REQUIRES = [
 EXTRA_REQUIRES = {
     "doc": [
         "sphinx>=1.0",
+    ],
+    "arrays": [
+        "numpy>=1.15",
+    ],
+    "blake2": [
+        "pyblake2; python_version < '3.6'",
     ]
 }
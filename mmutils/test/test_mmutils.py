@@ -9,14 +9,60 @@
 
 # System import
 import unittest
+import sys
+import errno
+import socket
 import os
 import tempfile
+import gzip
+import struct
+import hashlib
+import tarfile
+import io
+import zipfile
+import json
+import random
+import logging
+import threading
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
 
 # mmutils import
 from mmutils.adapters.io import (element_to_list,
                                  list_to_element,
                                  ungzip_file,
-                                 gzip_file)
+                                 ungzip_list_files,
+                                 extract_volume,
+                                 relocate_files,
+                                 _kernel_copy,
+                                 _gzip_size_hint,
+                                 _uncompress_to_shared_memory,
+                                 ungzip_to_handoff,
+                                 release_handoff,
+                                 gzip_file,
+                                 gzip_list_files)
+from mmutils.adapters.compression import CODECS, Codec, detect_codec
+from mmutils.adapters.handoff import attach_shared_buffer, shared_memory
+try:
+    import numpy
+    from mmutils.adapters.sketch import QuantileSketch
+    from mmutils.adapters.converted_io import (normalize_array,
+                                               fit_normalizer,
+                                               apply_normalizer,
+                                               normalize_timeseries)
+    from mmutils.adapters.arrays import load_text, text_byte_ranges
+    from mmutils.adapters.arraycache import (load_cached_array,
+                                             evict_cached_arrays)
+except ImportError:
+    numpy = None
+try:
+    from mmutils import toy_datasets
+except (ImportError, SyntaxError):
+    toy_datasets = None
 
 
 class TestUtils(unittest.TestCase):
@@ -83,11 +129,1062 @@ class TestUtils(unittest.TestCase):
                 output_directory="non_existent",
                 prefix="g")
 
+    def test_ungzip_streaming(self):
+        """ Test the ungzip chunk by chunk decompression.
+        """
+        data = os.urandom(100000)
+        fname = os.path.join(self.outdir, "random.bin.gz")
+        with gzip.open(fname, "wb") as gzfobj:
+            gzfobj.write(data)
+        out_file = ungzip_file(fname, output_directory=self.outdir,
+                               prefix="u", buffer_size=1024)
+        self.assertEqual(os.path.basename(out_file), "urandom.bin")
+        with open(out_file, "rb") as openfile:
+            self.assertEqual(openfile.read(), data)
+
+    def test_ungzip_list_files_parallel(self):
+        """ Test the parallel ungzip of a list of files.
+        """
+        fnames = []
+        for index, size in enumerate([10, 100000, 1000]):
+            fname = os.path.join(self.outdir, "file{0}.txt.gz".format(index))
+            with gzip.open(fname, "wb") as gzfobj:
+                gzfobj.write(b"a" * size)
+            fnames.append(fname)
+        for executor in ("thread", "process"):
+            out_files = ungzip_list_files(
+                fnames, output_directory=self.outdir, max_workers=3,
+                executor=executor)
+            self.assertEqual(
+                [os.path.basename(fname) for fname in out_files],
+                ["ufile0.txt", "ufile1.txt", "ufile2.txt"])
+        with self.assertRaises(ValueError):
+            ungzip_list_files(fnames + ["no_file"], max_workers=2,
+                              executor="thread")
+
+    def test_gzip_file_threads(self):
+        """ Test the block parallel gzip compression.
+        """
+        data = os.urandom(50000) * 60
+        fname = os.path.join(self.outdir, "blocks.bin")
+        with open(fname, "wb") as openfile:
+            openfile.write(data)
+        out_file = gzip_file(fname, output_directory=self.outdir,
+                             prefix="g", compresslevel=1, threads=3)
+        self.assertEqual(os.path.basename(out_file), "gblocks.bin.gz")
+        with gzip.open(out_file, "rb") as gzfobj:
+            self.assertEqual(gzfobj.read(), data)
+
+    def test_codecs(self):
+        """ Test the compression codecs detected from the magic bytes.
+        """
+        data = b"a compressed content" * 100
+        fname = os.path.join(self.outdir, "codec.txt")
+        with open(fname, "wb") as openfile:
+            openfile.write(data)
+        for codec in sorted(CODECS):
+            if codec == "raw":
+                continue
+            out_file = gzip_file(fname, output_directory=self.outdir,
+                                 prefix="c", codec=codec, preset="fast")
+            self.assertEqual(detect_codec(out_file).name, codec)
+            self.assertEqual(gzip_file(out_file), out_file)
+            noext_file = os.path.join(self.outdir, "noext_" + codec)
+            os.rename(out_file, noext_file)
+            out_file = ungzip_file(noext_file, prefix="u")
+            self.assertEqual(os.path.basename(out_file), "unoext_" + codec)
+            with open(out_file, "rb") as openfile:
+                self.assertEqual(openfile.read(), data)
+        self.assertEqual(ungzip_file(fname), fname)
+        with self.assertRaises(ValueError):
+            gzip_file(fname, codec="unknown")
+
+    def test_ungzip_incremental(self):
+        """ Test the ungzip skipped when the output is up to date.
+        """
+        fname = os.path.join(self.outdir, "incremental.txt.gz")
+        with gzip.open(fname, "wb") as gzfobj:
+            gzfobj.write(b"first content")
+        out_file = ungzip_file(fname, incremental=True, use_hash=True)
+        with open(out_file, "wb") as openfile:
+            openfile.write(b"modified output")
+        ungzip_file(fname, incremental=True, use_hash=True)
+        with open(out_file, "rb") as openfile:
+            self.assertEqual(openfile.read(), b"first content")
+        mtime = os.path.getmtime(out_file)
+        os.utime(fname, (0, 0))
+        self.assertEqual(ungzip_file(fname, incremental=True, use_hash=True),
+                         out_file)
+        self.assertEqual(os.path.getmtime(out_file), mtime)
+
+    def test_extract_volume(self):
+        """ Test the extraction of a volume from a gzip 4D image.
+        """
+        header = bytearray(352)
+        struct.pack_into("<i", header, 0, 348)
+        struct.pack_into("<8h", header, 40, 4, 32, 32, 16, 12, 1, 1, 1)
+        struct.pack_into("<hh", header, 70, 16, 32)
+        struct.pack_into("<fff", header, 108, 352., 1., 0.)
+        header[344:348] = b"n+1\x00"
+        volume_size = 32 * 32 * 16 * 4
+        data = os.urandom(volume_size * 12)
+        fname = os.path.join(self.outdir, "func.nii")
+        with open(fname, "wb") as openfile:
+            openfile.write(bytes(header) + data)
+        gzfname = gzip_file(fname, prefix="", threads=2)
+        volfname = extract_volume(gzfname, 7, output_directory=self.outdir)
+        self.assertEqual(os.path.basename(volfname), "vfunc_0007.nii")
+        self.assertTrue(os.path.isfile(gzfname + ".gzidx"))
+        with open(volfname, "rb") as openfile:
+            volume = openfile.read()
+        self.assertEqual(volume[352:], data[7 * volume_size:8 * volume_size])
+        self.assertEqual(struct.unpack("<8h", volume[40:56]),
+                         (3, 32, 32, 16, 1, 1, 1, 1))
+        with self.assertRaises(ValueError):
+            extract_volume(gzfname, 12)
+
+        # Warn that a single deflate stream has no random access
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logging.getLogger().addHandler(handler)
+        struct.pack_into("<8h", header, 40, 4, 32, 32, 16, 24, 1, 1, 1)
+        try:
+            with gzip.open(gzfname, "wb") as gzfobj:
+                gzfobj.write(bytes(header) + data + data)
+            os.remove(gzfname + ".gzidx")
+            volfname = extract_volume(gzfname, 19)
+        finally:
+            logging.getLogger().removeHandler(handler)
+        with open(volfname, "rb") as openfile:
+            self.assertEqual(openfile.read()[352:],
+                             data[7 * volume_size:8 * volume_size])
+        self.assertEqual(len(records), 1)
+        self.assertIn("no access point", records[0].getMessage())
+
+    def test_relocate_files(self):
+        """ Test the files relocation and the kernel side copy.
+        """
+        fnames = []
+        for index in range(2):
+            fname = os.path.join(self.outdir, "move{0}.txt".format(index))
+            with open(fname, "wb") as openfile:
+                openfile.write(b"content" * 1000)
+            fnames.append(fname)
+        out_files = [fname + ".moved" for fname in fnames]
+        moved_files, methods = relocate_files(fnames, out_files)
+        self.assertEqual(moved_files, out_files)
+        self.assertEqual(methods, ["rename", "rename"])
+        self.assertFalse(os.path.isfile(fnames[0]))
+        with self.assertRaises(Exception):
+            relocate_files(fnames[:1], out_files[:1])
+        copy_file = os.path.join(self.outdir, "copy.txt")
+        method = _kernel_copy(out_files[0], copy_file)
+        self.assertIn(method, ["copy_file_range", "sendfile", None])
+        if method is not None:
+            with open(copy_file, "rb") as openfile:
+                self.assertEqual(openfile.read(), b"content" * 1000)
+
+        # A short kernel copy is not reported as done
+        calls = dict((name, getattr(os, name)) for name in (
+            "copy_file_range", "sendfile") if hasattr(os, name))
+        try:
+            for name in calls:
+                setattr(os, name, lambda *args: 0)
+            self.assertIsNone(_kernel_copy(out_files[0], copy_file))
+        finally:
+            for name, call in calls.items():
+                setattr(os, name, call)
+
+    def test_gzip_list_files(self):
+        """ Test the parallel gzip of a list of files within a budget.
+        """
+        fnames = []
+        for index, size in enumerate([1000, 50000, 10]):
+            fname = os.path.join(self.outdir, "list{0}.txt".format(index))
+            with open(fname, "wb") as openfile:
+                openfile.write(b"b" * size)
+            fnames.append(fname)
+        out_files = gzip_list_files(
+            fnames, output_directory=self.outdir, remove_original_file=True,
+            max_workers=2, executor="thread", max_inflight_bytes=20000)
+        self.assertEqual(
+            [os.path.basename(fname) for fname in out_files],
+            ["glist0.txt.gz", "glist1.txt.gz", "glist2.txt.gz"])
+        self.assertFalse(any(os.path.isfile(fname) for fname in fnames))
+        with gzip.open(out_files[1], "rb") as gzfobj:
+            self.assertEqual(gzfobj.read(), b"b" * 50000)
+        with self.assertRaises(ValueError):
+            gzip_list_files(fnames, max_workers=2, executor="process")
+
+    def test_ungzip_corrupted(self):
+        """ Test the ungzip of truncated or corrupted files.
+        """
+        data = os.urandom(100000)
+        fname = os.path.join(self.outdir, "corrupted.bin.gz")
+        with gzip.open(fname, "wb") as gzfobj:
+            gzfobj.write(data)
+        with open(fname, "rb") as openfile:
+            content = bytearray(openfile.read())
+        out_file = os.path.join(self.outdir, "ucorrupted.bin")
+        for corrupted in (content[:len(content) // 2],
+                          content[:-8] + bytearray(8)):
+            with open(fname, "wb") as openfile:
+                openfile.write(bytes(corrupted))
+            with self.assertRaises(ValueError):
+                ungzip_file(fname)
+            self.assertFalse(os.path.isfile(out_file))
+
+    def test_gzip_size_hint(self):
+        """ Test the uncompressed sizes read from the gzip trailers.
+        """
+        fname = os.path.join(self.outdir, "data.bin.gz")
+        for size, hint in ((100000, 100000), (4200000, None)):
+            with gzip.open(fname, "wb") as gzfobj:
+                gzfobj.write(os.urandom(size))
+            self.assertEqual(_gzip_size_hint(fname), size)
+            self.assertEqual(_gzip_size_hint(fname, exact=True), hint)
+
+    def test_ungzip_to_handoff(self):
+        """ Test the ungzip to memory backed handoff data.
+        """
+        data = os.urandom(10000)
+        fname = os.path.join(self.outdir, "handoff.bin.gz")
+        with gzip.open(fname, "wb") as gzfobj:
+            gzfobj.write(data)
+        handle = ungzip_to_handoff(fname)
+        other_handle = ungzip_to_handoff(fname)
+        self.assertNotEqual(handle, other_handle)
+        self.assertEqual(os.path.basename(handle), "uhandoff.bin")
+        with open(handle, "rb") as openfile:
+            self.assertEqual(openfile.read(), data)
+        self.assertTrue(release_handoff(handle))
+        self.assertFalse(os.path.exists(os.path.dirname(handle)))
+        self.assertTrue(release_handoff(other_handle))
+        with self.assertRaises(ValueError):
+            release_handoff(fname)
+        if shared_memory is not None:
+            with gzip.open(fname, "ab") as gzfobj:
+                gzfobj.write(data)
+            handle = ungzip_to_handoff(fname, use_shared_memory=True)
+            shm, buf = attach_shared_buffer(handle)
+            self.assertEqual(bytes(buf), data + data)
+            del buf
+            shm.close()
+            self.assertTrue(release_handoff(handle))
+            self.assertFalse(release_handoff(handle))
+
+            # The content grows at each decompression pass
+            sizes = []
+
+            def opener(fname, mode, level):
+                sizes.append(len(sizes) + 1)
+                return io.BytesIO(data * sizes[-1])
+            codec = Codec("growing", ".grow", None, opener, {"default": 0})
+            with self.assertRaises(IOError):
+                _uncompress_to_shared_memory(codec, fname)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestNormalization(unittest.TestCase):
+    """ Test the array normalization.
+    """
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.array = numpy.random.RandomState(0).rand(100, 5) * 10 + 3
+        self.expected = ((self.array - self.array.mean(axis=0)) /
+                         self.array.std(axis=0))
+
+    def test_normalize_array_chunks(self):
+        """ Test the out-of-core normalization of a text array.
+        """
+        fname = os.path.join(self.outdir, "array.txt")
+        numpy.savetxt(fname, self.array)
+        outfile = normalize_array(fname, chunk_size=7)
+        self.assertEqual(outfile, fname)
+        numpy.testing.assert_allclose(numpy.loadtxt(outfile), self.expected,
+                                      atol=1e-7)
+
+    def test_normalize_array_binary(self):
+        """ Test the normalization of memory mapped binary arrays.
+        """
+        # In place normalization of a npy array
+        fname = os.path.join(self.outdir, "array.npy")
+        numpy.save(fname, self.array)
+        outfile = normalize_array(fname, chunk_size=7)
+        self.assertEqual(outfile, fname)
+        numpy.testing.assert_allclose(numpy.load(outfile), self.expected)
+
+        # Raw array
+        fname = os.path.join(self.outdir, "array.raw")
+        self.array.astype("float32").tofile(fname)
+        outfile = normalize_array(fname, raw_dtype="float32", raw_columns=5)
+        self.assertEqual(outfile, fname)
+        numpy.testing.assert_allclose(
+            numpy.fromfile(outfile, dtype="float32").reshape(-1, 5),
+            self.expected, atol=1e-5)
+
+        # Text to npy conversion
+        fname = os.path.join(self.outdir, "conversion.txt")
+        numpy.savetxt(fname, self.array)
+        outfile = normalize_array(fname, output_format="npy")
+        self.assertEqual(outfile, os.path.join(self.outdir, "conversion.npy"))
+        numpy.testing.assert_allclose(numpy.load(outfile), self.expected)
+        numpy.testing.assert_allclose(numpy.loadtxt(fname), self.array)
+
+        # A '.dat' array is a text array unless the format is specified
+        fname = os.path.join(self.outdir, "array.dat")
+        numpy.savetxt(fname, self.array)
+        outfile = normalize_array(fname)
+        numpy.testing.assert_allclose(numpy.loadtxt(outfile), self.expected,
+                                      atol=1e-7)
+
+    def test_normalize_array_parallel(self):
+        """ Test the parallel parsing and formatting of text arrays.
+        """
+        # Parse ranges of lines, with a comment handled by the fallback
+        fname = os.path.join(self.outdir, "array.txt")
+        numpy.savetxt(fname, self.array, header="values")
+        ranges = text_byte_ranges(fname, 8)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(fname))
+        numpy.testing.assert_allclose(load_text(fname, max_workers=3),
+                                      self.array)
+
+        # Normalize the array
+        outfile = normalize_array(fname, max_workers=3)
+        self.assertEqual(outfile, fname)
+        numpy.testing.assert_allclose(numpy.loadtxt(outfile), self.expected,
+                                      atol=1e-7)
+
+    def test_normalize_array_parallel_small(self):
+        """ Test the parallel parsing of a file smaller than the ranges.
+        """
+        fname = os.path.join(self.outdir, "small.txt")
+        with open(fname, "w") as openfile:
+            openfile.write("1 2\n3 4\n")
+        self.assertEqual(text_byte_ranges(fname, 16), [(0, 4), (4, 8)])
+        numpy.testing.assert_allclose(load_text(fname, max_workers=4),
+                                      [[1, 2], [3, 4]])
+        outfile = normalize_array(fname, max_workers=4)
+        numpy.testing.assert_allclose(numpy.loadtxt(outfile),
+                                      [[-1, -1], [1, 1]])
+
+    def test_normalize_array_float32(self):
+        """ Test the float32 normalization and the zero variance columns.
+        """
+        array = self.array.copy()
+        array[:, 2] = 4.
+        expected = self.expected.copy()
+        expected[:, 2] = 0.
+        fname = os.path.join(self.outdir, "float32.txt")
+        numpy.savetxt(fname, array)
+        outfile = normalize_array(fname, output_format="npy",
+                                  dtype="float32")
+        normalized = numpy.load(outfile)
+        self.assertEqual(normalized.dtype, numpy.float32)
+        numpy.testing.assert_allclose(normalized, expected, atol=1e-5)
+
+    def test_normalize_array_robust(self):
+        """ Test the robust and min-max normalizations.
+        """
+        fname = os.path.join(self.outdir, "robust.npy")
+        numpy.save(fname, self.array)
+        outfile = normalize_array(fname, method="minmax", chunk_size=7)
+        normalized = numpy.load(outfile)
+        numpy.testing.assert_allclose(normalized.min(axis=0), 0, atol=1e-12)
+        numpy.testing.assert_allclose(normalized.max(axis=0), 1)
+
+        # The sketch is exact for less rows than its capacity
+        numpy.save(fname, self.array)
+        outfile = normalize_array(fname, method="robust", chunk_size=7)
+        lower, median, upper = numpy.sort(self.array, axis=0)[[24, 49, 74]]
+        numpy.testing.assert_allclose(
+            numpy.load(outfile), (self.array - median) / (upper - lower))
+        with self.assertRaises(ValueError):
+            normalize_array(fname, method="unknown")
+
+        # The compactions are reproducible and keep the global random state
+        rows = numpy.random.RandomState(2).rand(3000, 2)
+        state = random.getstate()
+        quantiles = []
+        for _ in range(2):
+            sketch = QuantileSketch(k=50)
+            for start in range(0, len(rows), 100):
+                sketch.update(rows[start:start + 100])
+            quantiles.append(sketch.quantiles([0.25, 0.5, 0.75]))
+        numpy.testing.assert_array_equal(quantiles[0], quantiles[1])
+        self.assertEqual(random.getstate(), state)
+
+    def test_normalize_array_cache(self):
+        """ Test the cache of the parsed text arrays.
+        """
+        cache_dir = os.path.join(self.outdir, "cache")
+        fname = os.path.join(self.outdir, "cached.txt")
+        numpy.savetxt(fname, self.array)
+        outfile = normalize_array(fname, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        # The normalized output is read from the cache on the next call
+        cached = load_cached_array(outfile, cache_dir)
+        numpy.testing.assert_allclose(cached, numpy.loadtxt(outfile),
+                                      atol=1e-12)
+        normalize_array(outfile, cache_dir=cache_dir, chunk_size=7)
+        numpy.testing.assert_allclose(numpy.loadtxt(outfile), self.expected,
+                                      atol=1e-7)
+
+        # Least recently used eviction
+        self.assertEqual(len(evict_cached_arrays(cache_dir, max_size=0)), 2)
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_normalize_timeseries(self):
+        """ Test the voxelwise normalization of a 4D image by slabs.
+        """
+        header = bytearray(352)
+        struct.pack_into("<i", header, 0, 348)
+        struct.pack_into("<8h", header, 40, 4, 4, 3, 2, 10, 1, 1, 1)
+        struct.pack_into("<hh", header, 70, 4, 16)
+        struct.pack_into("<fff", header, 108, 352., 2., 5.)
+        header[344:348] = b"n+1\x00"
+        data = numpy.random.RandomState(0).randint(
+            0, 1000, size=(10, 24)).astype("<i2")
+        data[:, 3] = 7
+        fname = os.path.join(self.outdir, "func.nii")
+        with open(fname, "wb") as openfile:
+            openfile.write(bytes(header) + data.tobytes())
+        outfile = normalize_timeseries(fname, slab_size=5)
+        self.assertEqual(os.path.basename(outfile), "nfunc.nii")
+        with open(outfile, "rb") as openfile:
+            out_header = openfile.read(352)
+            normalized = numpy.frombuffer(openfile.read(), dtype="<f4")
+        self.assertEqual(struct.unpack("<hh", out_header[70:74]), (16, 32))
+        self.assertEqual(struct.unpack("<ff", out_header[112:120]), (1., 0.))
+        std = data.std(axis=0)
+        std[3] = 1
+        expected = (data - data.mean(axis=0)) / std
+        numpy.testing.assert_allclose(normalized.reshape(10, 24), expected,
+                                      rtol=1e-5, atol=1e-6)
+        with self.assertRaises(ValueError):
+            normalize_timeseries(fname, prefix="")
+
+    def test_fit_apply_normalizer(self):
+        """ Test the column statistics fitted once and applied to many
+        arrays.
+        """
+        # Fit on a training set split in text and npy files
+        train_files = [os.path.join(self.outdir, "train0.txt"),
+                       os.path.join(self.outdir, "train1.npy")]
+        numpy.savetxt(train_files[0], self.array[:60])
+        numpy.save(train_files[1], self.array[60:])
+        normalizer_file = fit_normalizer(
+            train_files, os.path.join(self.outdir, "normalizer.npz"),
+            max_workers=2)
+        self.assertTrue(os.path.isfile(normalizer_file))
+
+        # Apply to a test set
+        test_array = numpy.random.RandomState(1).rand(20, 5)
+        test_files = []
+        for index in range(3):
+            fname = os.path.join(self.outdir, "test{0}.txt".format(index))
+            numpy.savetxt(fname, test_array)
+            test_files.append(fname)
+        outfiles = apply_normalizer(normalizer_file, test_files,
+                                    prefix="n", output_format="npy")
+        self.assertEqual(
+            [os.path.basename(fname) for fname in outfiles],
+            ["ntest0.npy", "ntest1.npy", "ntest2.npy"])
+        expected = ((test_array - self.array.mean(axis=0)) /
+                    self.array.std(axis=0))
+        for fname in outfiles:
+            numpy.testing.assert_allclose(numpy.load(fname), expected,
+                                          atol=1e-7)
+        with self.assertRaises(ValueError):
+            apply_normalizer(normalizer_file, test_files,
+                             output_directory="non_existent")
+
+
+class DataRequestHandler(BaseHTTPRequestHandler):
+    """ Serve the in-memory files of a DataServer with keep-alive.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers))
+        if self.path in self.server.redirects:
+            self.send_response(302)
+            self.send_header("Location", self.server.redirects[self.path])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start, end = 0, len(data)
+        requested = self.headers.get("Range")
+        if requested and self.server.accept_ranges:
+            first, last = requested.split("=")[1].split("-")
+            start = int(first)
+            if last:
+                end = int(last) + 1
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(
+                start, end - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        self.wfile.write(data[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+class DataServer(ThreadingMixIn, HTTPServer):
+    """ A local HTTP server standing for the dataset servers.
+    """
+    daemon_threads = True
+
+    def __init__(self, files, redirects=None, accept_ranges=True):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), DataRequestHandler)
+        self.files = files
+        self.redirects = redirects or {}
+        self.accept_ranges = accept_ranges
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self.url = "http://127.0.0.1:{0}".format(self.server_address[1])
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle_error(self, request, client_address):
+        """ Ignore the connections reset by the clients.
+        """
+        error = sys.exc_info()[1]
+        if not (isinstance(error, socket.error) and getattr(
+                error, "errno", None) in (errno.ECONNRESET, errno.EPIPE)):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@unittest.skipIf(toy_datasets is None, "toy_datasets can not be imported")
+class TestToyDatasets(unittest.TestCase):
+    """ Test the sample datasets.
+    """
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+        self.fsl_dir = os.environ.pop("FSLDIR", None)
+        self.data_dir = toy_datasets.DATA_DIR
+        toy_datasets.DATA_DIR = os.path.join(self.outdir, "cache")
+        self.proxies = dict(
+            (name, os.environ.pop(name)) for name in list(os.environ)
+            if name.lower().endswith("_proxy"))
+
+    def tearDown(self):
+        toy_datasets.SAMPLE_DATE_FILES.pop("test_local", None)
+        toy_datasets.DATA_DIR = self.data_dir
+        toy_datasets.CHECKSUM_CACHES.clear()
+        for name in list(os.environ):
+            if name.lower().endswith("_proxy"):
+                del os.environ[name]
+        os.environ.update(self.proxies)
+        if self.fsl_dir is not None:
+            os.environ["FSLDIR"] = self.fsl_dir
+
+    def test_download_file_pooled(self):
+        """ Test the downloads reusing a persistent connection.
+        """
+        files = dict([("/file{0}.bin".format(index), os.urandom(50000))
+                      for index in range(5)])
+        server = DataServer(files, redirects={"/moved.bin": "/file0.bin"})
+        pool = toy_datasets.ConnectionPool(pool_size=2)
+        try:
+            for path in sorted(files) + ["/moved.bin"]:
+                fname = toy_datasets.download_file(
+                    server.url + path, data_dir=self.outdir, progress=False,
+                    md5sum=hashlib.md5(files.get(
+                        path, files["/file0.bin"])).hexdigest(),
+                    pool=pool)
+                self.assertEqual(os.path.basename(fname), path[1:])
+            with self.assertRaises(Exception):
+                toy_datasets.download_file(
+                    server.url + "/missing.bin", data_dir=self.outdir,
+                    progress=False, pool=pool)
+        finally:
+            pool.clear()
+            server.stop()
+        self.assertEqual(server.connections, 1)
+
+    def test_download_file_proxy(self):
+        """ Test the downloads through the configured proxy.
+        """
+        data = os.urandom(50000)
+        url = "http://data.example.org/data.bin"
+        proxy = DataServer({url: data})
+        server = DataServer({"/direct.bin": data})
+        pool = toy_datasets.ConnectionPool()
+        os.environ["http_proxy"] = "http://user:secret@{0}".format(
+            proxy.url.split("://")[1])
+        os.environ["no_proxy"] = "127.0.0.1"
+        try:
+            # Forward the absolute url to the proxy
+            self.assertEqual(
+                toy_datasets.get_proxy("http", "data.example.org"),
+                (proxy.url.split("://")[1],
+                 {"Proxy-Authorization": "Basic dXNlcjpzZWNyZXQ="}))
+            fname = toy_datasets.download_file(
+                url, data_dir=self.outdir, progress=False,
+                md5sum=hashlib.md5(data).hexdigest(), pool=pool)
+            with open(fname, "rb") as openfile:
+                self.assertEqual(openfile.read(), data)
+            self.assertTrue(proxy.requests)
+            for path, headers in proxy.requests:
+                self.assertEqual(path, url)
+                self.assertEqual(headers.get("Proxy-Authorization"),
+                                 "Basic dXNlcjpzZWNyZXQ=")
+
+            # Reach the hosts matching 'no_proxy' directly
+            toy_datasets.download_file(
+                server.url + "/direct.bin", data_dir=self.outdir,
+                progress=False, md5sum=hashlib.md5(data).hexdigest(),
+                pool=pool)
+            self.assertEqual([path for path, _ in server.requests][-1:],
+                             ["/direct.bin"])
+            self.assertTrue(all(path == url for path, _ in proxy.requests))
+
+            # Tunnel the https connections through the proxy
+            os.environ["https_proxy"] = os.environ["http_proxy"]
+            connection, _ = pool.get("https", "data.example.org")
+            self.assertEqual(connection.port, proxy.server_address[1])
+            self.assertEqual(connection._tunnel_host, "data.example.org")
+        finally:
+            pool.clear()
+            proxy.stop()
+            server.stop()
+
+    def test_download_file_segments(self):
+        """ Test the downloads of concurrent byte ranges.
+        """
+        data = os.urandom(100000)
+        md5sum = hashlib.md5(data).hexdigest()
+        server = DataServer({"/data.bin": data})
+        pool = toy_datasets.ConnectionPool()
+        url = server.url + "/data.bin"
+        fname = os.path.join(self.outdir, "data.bin")
+        temp_fname = fname + ".part"
+        state_fname = temp_fname + toy_datasets.SEGMENTS_EXTENSION
+        try:
+            # Full download
+            self.assertEqual(toy_datasets.download_file(
+                url, data_dir=self.outdir, md5sum=md5sum, segments=4,
+                pool=pool), fname)
+            self.assertFalse(os.path.exists(state_fname))
+            os.remove(fname)
+
+            # Resume an interrupted segmented download
+            with open(temp_fname, "wb") as openfile:
+                openfile.write(data[:30000] + b"\0" * 20000 +
+                               data[50000:60000] + b"\0" * 40000)
+            with open(state_fname, "w") as openfile:
+                json.dump({"url": url, "size": len(data), "segments": [
+                    [0, 50000, 30000], [50000, 100000, 60000]]}, openfile)
+            toy_datasets.download_file(url, data_dir=self.outdir,
+                                       md5sum=md5sum, progress=False,
+                                       pool=pool)
+            self.assertFalse(os.path.exists(state_fname))
+            os.remove(fname)
+
+            # Keep the bytes of a single stream download
+            with open(temp_fname, "wb") as openfile:
+                openfile.write(data[:12345])
+            toy_datasets.download_file(url, data_dir=self.outdir,
+                                       md5sum=md5sum, segments=3, pool=pool)
+            os.remove(fname)
+        finally:
+            pool.clear()
+            server.stop()
+
+        # Fall back on a single stream if the ranges are ignored
+        server = DataServer({"/data.bin": data}, accept_ranges=False)
+        try:
+            toy_datasets.download_file(
+                server.url + "/data.bin", data_dir=self.outdir,
+                md5sum=md5sum, progress=False, segments=4, pool=pool)
+        finally:
+            pool.clear()
+            server.stop()
+        self.assertFalse(os.path.exists(state_fname))
+
+    def test_checksum_cache(self):
+        """ Test the persistent cache of the file checksums.
+        """
+        fname = os.path.join(self.outdir, "data.bin")
+        with open(fname, "wb") as openfile:
+            openfile.write(b"a" * 1000)
+        os.utime(fname, (1000000000, 1000000000))
+        md5sum = hashlib.md5(b"a" * 1000).hexdigest()
+        cache = toy_datasets.checksum_cache()
+        self.assertEqual(toy_datasets.md5_sum_file(fname, cache=cache),
+                         md5sum)
+        self.assertTrue(os.path.isfile(cache.cache_file))
+
+        # An unchanged file is not read again, even by another process
+        with open(fname, "r+b") as openfile:
+            openfile.write(b"b")
+        os.utime(fname, (1000000000, 1000000000))
+        cache = toy_datasets.ChecksumCache(cache.cache_file)
+        self.assertEqual(toy_datasets.md5_sum_file(fname, cache=cache),
+                         md5sum)
+
+        # A modified file is hashed again
+        os.utime(fname, (1000000010, 1000000010))
+        self.assertEqual(
+            toy_datasets.md5_sum_file(fname, cache=cache),
+            hashlib.md5(b"b" + b"a" * 999).hexdigest())
+
+    def test_download_file_hashing(self):
+        """ Test the checksum computed while downloading.
+        """
+        data = os.urandom(100000)
+        md5sum = hashlib.md5(data).hexdigest()
+        server = DataServer({"/data.bin": data})
+        pool = toy_datasets.ConnectionPool()
+        fname = os.path.join(self.outdir, "data.bin")
+        try:
+            # Resume a download, hashing the bytes already downloaded
+            with open(fname + ".part", "wb") as openfile:
+                openfile.write(data[:12345])
+            toy_datasets.download_file(
+                server.url + "/data.bin", data_dir=self.outdir,
+                md5sum="MD5:" + md5sum.upper(), progress=False, pool=pool)
+            cache = toy_datasets.checksum_cache(self.outdir)
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.outdir, toy_datasets.CHECKSUM_CACHE_NAME)))
+            self.assertEqual(cache.get(fname), md5sum)
+
+            # Reject an invalid checksum of another algorithm
+            os.remove(fname)
+            with self.assertRaises(ValueError):
+                toy_datasets.download_file(
+                    server.url + "/data.bin", data_dir=self.outdir,
+                    md5sum="sha256:" + md5sum, progress=False, pool=pool)
+            self.assertEqual(
+                cache.get(fname, "sha256"),
+                hashlib.sha256(data).hexdigest())
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_md5_sum_file(self):
+        """ Test the checksums of the memory mapped files.
+        """
+        data = os.urandom(100000)
+        fname = os.path.join(self.outdir, "data.bin")
+        with open(fname, "wb") as openfile:
+            openfile.write(data)
+        mmap_size = toy_datasets.HASH_MMAP_SIZE
+        try:
+            for toy_datasets.HASH_MMAP_SIZE in (mmap_size, 1000):
+                self.assertEqual(toy_datasets.md5_sum_file(fname),
+                                 hashlib.md5(data).hexdigest())
+                self.assertEqual(
+                    toy_datasets.md5_sum_file(fname, algorithm="sha1"),
+                    hashlib.sha1(data).hexdigest())
+        finally:
+            toy_datasets.HASH_MMAP_SIZE = mmap_size
+        with self.assertRaises(ValueError):
+            toy_datasets.md5_sum_file(fname, algorithm="unknown")
+
+    @unittest.skipIf(toy_datasets is None or toy_datasets.blake2b is None,
+                     "no blake2b")
+    def test_tree_hash(self):
+        """ Test the parallel BLAKE2b tree hashes.
+        """
+        # Reference digests of the data with leaves of 30000 bytes
+        expected = {
+            100000: ("db3f8a32dbfd8430c74ddf2c25b8e9ea0227a69011f0045ba4df9b"
+                     "0d83445cc25b8b8b61a445d2ab312e8161bb6bbf4aed9bbb2044d9"
+                     "e1902e3e7f60938be422"),
+            60000: ("7f40910e6bf644a2e95ce8620333b0194a26ceb03f3dd0d8fed3c26"
+                    "4c9159a065085956f40cd404602b78433e829c7865534c3b1a770d3"
+                    "fc5255c64333baf9ea")}
+        fname = os.path.join(self.outdir, "data.bin")
+        mmap_size = toy_datasets.HASH_MMAP_SIZE
+        leaf_size = toy_datasets.TREE_LEAF_SIZE
+        try:
+            toy_datasets.TREE_LEAF_SIZE = 30000
+            for size, digest in sorted(expected.items()):
+                data = bytes(bytearray(index % 251 for index in range(size)))
+                with open(fname, "wb") as openfile:
+                    openfile.write(data)
+                tree = toy_datasets.TreeHash()
+                for start in range(0, len(data), 7000):
+                    tree.update(data[start: start + 7000])
+                self.assertEqual(tree.hexdigest(), digest)
+                for hash_mmap_size in (mmap_size, 1000):
+                    toy_datasets.HASH_MMAP_SIZE = hash_mmap_size
+                    self.assertEqual(toy_datasets.md5_sum_file(
+                        fname, algorithm="blake2b-tree"), digest)
+        finally:
+            toy_datasets.HASH_MMAP_SIZE = mmap_size
+            toy_datasets.TREE_LEAF_SIZE = leaf_size
+        self.assertEqual(
+            toy_datasets.md5_sum_file(fname, algorithm="blake2b"),
+            "a0b4e1c912a57364ed019d57296b9f14fd4ac7a36dc5b324706ba2b1497cf7b5"
+            "8b813ef6d86efab3a9461768ea9a552ab97554f8c4b010ed26d04ae6158bcedf")
+
+    def test_extract_download(self):
+        """ Test the extraction of the archives while they are downloaded.
+        """
+        archive = os.path.join(self.outdir, "archive.tar.gz")
+        members = {"func/bold.nii": os.urandom(30000),
+                   "func/events.txt": b"onset duration\n"}
+        for name, content in members.items():
+            path = os.path.join(self.outdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as openfile:
+                openfile.write(content)
+        tar = tarfile.open(archive, "w:gz")
+        tar.add(os.path.join(self.outdir, "func"), arcname="func")
+        tar.close()
+        with open(archive, "rb") as openfile:
+            data = openfile.read()
+        md5sum = hashlib.md5(data).hexdigest()
+        data_dir = os.path.join(self.outdir, "data")
+        server = DataServer({"/func.tar.gz": data})
+        pool = toy_datasets.ConnectionPool()
+        url = server.url + "/func.tar.gz"
+        try:
+            # Roll back the extraction of an invalid archive
+            with self.assertRaises(ValueError):
+                toy_datasets.extract_download(
+                    url, data_dir=data_dir, md5sum="0" * 32, pool=pool)
+            self.assertEqual(os.listdir(data_dir), [])
+
+            # Extract a valid archive
+            self.assertEqual(
+                toy_datasets.extract_download(
+                    url, data_dir=data_dir, md5sum=md5sum, pool=pool),
+                os.path.join(data_dir, "func"))
+            for name, content in members.items():
+                with open(os.path.join(data_dir, name), "rb") as openfile:
+                    self.assertEqual(openfile.read(), content)
+            self.assertEqual(sorted(os.listdir(data_dir)),
+                             [".checksums.json", "func", "func.tar.gz"])
+            self.assertEqual(toy_datasets.checksum_cache(data_dir).get(
+                os.path.join(data_dir, "func.tar.gz")), md5sum)
+
+            # Extract the selected members of another archive
+            server.files["/other.tar.gz"] = data
+            other_dir = os.path.join(self.outdir, "other")
+            toy_datasets.extract_download(
+                server.url + "/other.tar.gz", data_dir=other_dir,
+                md5sum=md5sum, pool=pool, members=["*.txt"])
+            self.assertEqual(os.listdir(os.path.join(other_dir, "func")),
+                             ["events.txt"])
+            self.assertEqual(toy_datasets.extracted_members(
+                os.path.join(other_dir, "other.tar.gz")), ["*.txt"])
+
+            # Reject a selection matching no member
+            server.files["/nomatch.tar.gz"] = data
+            nomatch_dir = os.path.join(self.outdir, "nomatch")
+            with self.assertRaises(Exception):
+                toy_datasets.extract_download(
+                    server.url + "/nomatch.tar.gz", data_dir=nomatch_dir,
+                    md5sum=md5sum, pool=pool, members=["*.dcm"])
+            self.assertEqual(os.listdir(nomatch_dir), [])
+
+            # Merge an archive sharing the directory of another archive
+            stream = io.BytesIO()
+            archive = tarfile.open(fileobj=stream, mode="w:gz")
+            info = tarfile.TarInfo("func/extra.txt")
+            info.size = 5
+            archive.addfile(info, io.BytesIO(b"extra"))
+            archive.close()
+            server.files["/extra.tar.gz"] = stream.getvalue()
+            toy_datasets.extract_download(
+                server.url + "/extra.tar.gz", data_dir=other_dir, pool=pool)
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(other_dir, "func"))),
+                ["events.txt", "extra.txt"])
+
+            # Use the downloaded archive
+            self.assertIsNone(toy_datasets.extract_download(
+                url, data_dir=data_dir, md5sum=md5sum, pool=pool))
+
+            # Extract the links inside the data directory
+            stream = io.BytesIO()
+            archive = tarfile.open(fileobj=stream, mode="w:gz")
+            for name, kind, linkname in (
+                    ("links/data.txt", tarfile.REGTYPE, ""),
+                    ("links/symlink.txt", tarfile.SYMTYPE, "data.txt"),
+                    ("links/hardlink.txt", tarfile.LNKTYPE,
+                     "links/data.txt")):
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = linkname
+                info.size = 4 if kind == tarfile.REGTYPE else 0
+                archive.addfile(info, io.BytesIO(b"data"))
+            archive.close()
+            server.files["/links.tar.gz"] = stream.getvalue()
+            links_dir = os.path.join(self.outdir, "links")
+            toy_datasets.extract_download(
+                server.url + "/links.tar.gz", data_dir=links_dir, pool=pool)
+            for name in ("data.txt", "symlink.txt", "hardlink.txt"):
+                with open(os.path.join(links_dir, "links", name),
+                          "rb") as openfile:
+                    self.assertEqual(openfile.read(), b"data")
+            self.assertEqual(os.readlink(
+                os.path.join(links_dir, "links", "symlink.txt")), "data.txt")
+
+            # Reject the members and the links outside the data directory
+            unsafe_dir = os.path.join(self.outdir, "unsafe", "data")
+            for index, (name, kind, linkname) in enumerate((
+                    ("../escaped.txt", tarfile.REGTYPE, ""),
+                    ("/tmp/absolute.txt", tarfile.REGTYPE, ""),
+                    ("link", tarfile.SYMTYPE, "/etc/passwd"),
+                    ("link", tarfile.SYMTYPE, "../../escaped.txt"),
+                    ("link", tarfile.LNKTYPE, "../escaped.txt"),
+                    ("fifo", tarfile.FIFOTYPE, ""))):
+                stream = io.BytesIO()
+                archive = tarfile.open(fileobj=stream, mode="w:gz")
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = linkname
+                archive.addfile(info, io.BytesIO(b""))
+                archive.close()
+                path = "/unsafe{0}.tar.gz".format(index)
+                server.files[path] = stream.getvalue()
+                with self.assertRaises(Exception):
+                    toy_datasets.extract_download(
+                        server.url + path, data_dir=unsafe_dir, pool=pool)
+                self.assertEqual(os.listdir(unsafe_dir), [])
+            self.assertFalse(os.path.exists(
+                os.path.join(self.outdir, "unsafe", "escaped.txt")))
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_uncompress_members(self):
+        """ Test the extraction of the selected archive members.
+        """
+        members = {"S18/raw_bold.nii.gz": b"bold", "S18/anat.nii": b"anat",
+                   "S18/dicom/001.dcm": b"dcm1",
+                   "S18/dicom/002.dcm": b"dcm2"}
+        zip_fname = os.path.join(self.outdir, "zip", "data.zip")
+        tar_fname = os.path.join(self.outdir, "tar", "data.tar.gz")
+        os.makedirs(os.path.dirname(zip_fname))
+        os.makedirs(os.path.dirname(tar_fname))
+        archive = zipfile.ZipFile(zip_fname, "w")
+        for name, content in members.items():
+            archive.writestr(name, content)
+        archive.close()
+        archive = tarfile.open(tar_fname, "w:gz")
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+        archive.close()
+        for fname in (zip_fname, tar_fname):
+            data_dir = os.path.dirname(fname)
+            toy_datasets.uncompress_file(
+                fname, members=["raw_bold.nii.gz", "S18/dicom"])
+            extracted = []
+            for root, _, files in os.walk(os.path.join(data_dir, "S18")):
+                extracted.extend(
+                    os.path.relpath(os.path.join(root, name), data_dir)
+                    for name in files)
+            self.assertEqual(sorted(extracted), [
+                "S18/dicom/001.dcm", "S18/dicom/002.dcm",
+                "S18/raw_bold.nii.gz"])
+            self.assertEqual(sorted(os.listdir(data_dir)), [
+                "S18", os.path.basename(fname),
+                os.path.basename(fname) + ".members.json"])
+            self.assertEqual(toy_datasets.extracted_members(fname),
+                             ["S18/dicom", "raw_bold.nii.gz"])
+            with self.assertRaises(Exception):
+                toy_datasets.uncompress_file(fname, members=["*.txt"])
+
+            # Extract again a truncated member
+            bold_fname = os.path.join(data_dir, "S18", "raw_bold.nii.gz")
+            with open(bold_fname, "wb") as openfile:
+                openfile.write(b"bo")
+            toy_datasets.uncompress_file(fname, members=["raw_bold.nii.gz"])
+            with open(bold_fname, "rb") as openfile:
+                self.assertEqual(openfile.read(), b"bold")
+
+            # Extract the remaining members after a selective extraction
+            toy_datasets.uncompress_file(fname)
+            with open(os.path.join(data_dir, "S18", "anat.nii"),
+                      "rb") as openfile:
+                self.assertEqual(openfile.read(), b"anat")
+            self.assertIsNone(toy_datasets.extracted_members(fname))
+
+    def test_get_sample_data_members(self):
+        """ Test the extraction of the selected members of a dataset item.
+        """
+        items = {}
+        for name, members in (("func", ("bold.nii", "events.txt")),
+                              ("anat", ("t1.nii", ))):
+            archive = tarfile.open(
+                os.path.join(self.outdir, name + ".tar.gz"), "w:gz")
+            for member in members:
+                info = tarfile.TarInfo("{0}/{1}".format(name, member))
+                info.size = 4
+                archive.addfile(info, io.BytesIO(b"data"))
+            archive.close()
+            items[name] = ("fsl_dir", name + ".tar.gz", None)
+        toy_datasets.SAMPLE_DATE_FILES["test_local"] = toy_datasets.Enum(
+            **items)
+        dataset = toy_datasets.get_sample_data(
+            "test_local", fsl_dir=self.outdir, members={"func": ["*.txt"]})
+        self.assertEqual(os.listdir(dataset.func), ["events.txt"])
+        self.assertEqual(os.listdir(dataset.anat), ["t1.nii"])
+
+    def test_get_sample_data_concurrent(self):
+        """ Test the concurrent resolution of the dataset items.
+        """
+        items = {}
+        for name in ("first", "second", "third"):
+            content = name * 100
+            with open(os.path.join(self.outdir, name), "wb") as openfile:
+                openfile.write(content)
+            items[name] = ("fsl_dir", name, hashlib.md5(content).hexdigest())
+        toy_datasets.SAMPLE_DATE_FILES["test_local"] = toy_datasets.Enum(
+            TR=2., **items)
+        dataset = toy_datasets.get_sample_data(
+            "test_local", fsl_dir=self.outdir, max_workers=3)
+        self.assertEqual(dataset.TR, 2.)
+        for name in items:
+            self.assertEqual(getattr(dataset, name),
+                             os.path.join(self.outdir, name))
+        self.assertEqual(
+            dict(dataset.items),
+            dict([(name, os.path.join(self.outdir, name))
+                  for name in items] + [("TR", 2.)]))
+
 
 def test():
     """ Function to execute unitest
     """
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestUtils)
+    suite = unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(TestUtils),
+        unittest.TestLoader().loadTestsFromTestCase(TestNormalization),
+        unittest.TestLoader().loadTestsFromTestCase(TestToyDatasets)])
     runtime = unittest.TextTestRunner(verbosity=2).run(suite)
     return runtime.wasSuccessful()
 
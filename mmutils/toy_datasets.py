@@ -10,10 +10,18 @@
 # System import
 import urllib
 import urllib2
+import urlparse
+import httplib
+import base64
+import socket
+import threading
+import json
 import time
 import logging
 import os
 import shutil
+import tempfile
+import mmap
 import numpy
 import sys
 import hashlib
@@ -21,6 +29,16 @@ import curses
 import tarfile
 import zipfile
 import gzip
+import fnmatch
+from multiprocessing.pool import ThreadPool
+try:
+    from hashlib import blake2b
+except ImportError:
+    # Python < 3.6: use the BLAKE2 backport if installed
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
 
 
 def Enum(**enums):
@@ -170,8 +188,49 @@ SAMPLE_DATE_FILES = {
             "brainomics_data/S18")),
 }
 
+# The extension of the files recording a selective extraction
+MEMBERS_EXTENSION = ".members.json"
+
+# The archive members used by the datasets, extracted by default
+SAMPLE_DATA_MEMBERS = {
+    "localizer_extra": {"fmri": ["raw_fMRI_raw_bold.nii.gz"]},
+}
+
+
+def select_members(names, members):
+    """ Select the archive members matching names or glob patterns.
+
+    Parameters
+    ----------
+    names: list of str (mandatory)
+        the archive member names.
+    members: list of str (mandatory)
+        the member names or glob patterns, matched against the member
+        paths or, for the patterns without '/', against the member base
+        names. A matching directory selects all its members.
 
-def uncompress_file(fname, delete_archive=False):
+    Returns
+    -------
+    selected: list of str
+        the selected member names in the archive order.
+    """
+    patterns = [pattern.rstrip("/") for pattern in members]
+    selected = []
+    for name in names:
+        # The member path and the paths of its parent directories
+        parts = name.rstrip("/").split("/")
+        paths = ["/".join(parts[:index + 1]) for index in range(len(parts))]
+        for pattern in patterns:
+            if any(fnmatch.fnmatch(path, pattern) or (
+                    "/" not in pattern and
+                    fnmatch.fnmatch(path.rsplit("/", 1)[-1], pattern))
+                    for path in paths):
+                selected.append(name)
+                break
+    return selected
+
+
+def uncompress_file(fname, delete_archive=False, members=None):
     """Uncompress files contained in a data_set.
 
     Parameters
@@ -182,6 +241,14 @@ def uncompress_file(fname, delete_archive=False):
     delete_archive: bool (optional)
         option to delete the archive once it is uncompressed.
 
+    members: list of str (optional)
+        the names or glob patterns of the zip or tar members to be
+        extracted, see 'select_members', all the members by default. The
+        selected members already extracted are not extracted again, and a
+        selective extraction is recorded beside the archive, see
+        'extracted_members', so that the next extraction of all the
+        members is not skipped.
+
     Returns
     -------
     out: str
@@ -192,14 +259,30 @@ def uncompress_file(fname, delete_archive=False):
     The function handles zip, tar, gzip and bzip files only.
     """
     logging.info("Extracting data from {0}...".format(fname))
-    # First check if the file has already been uncompressed
+    # First check if the file has already been entirely uncompressed
+    archive = fname
     out, ext = os.path.splitext(fname)
     if ext == ".gz":
         out, _ = os.path.splitext(out)
-    if os.path.isdir(out) or os.path.isfile(out):
+    extracted = os.path.isdir(out) or os.path.isfile(out)
+    partial = extracted_members(archive) is not None
+    if members is None and extracted and not partial:
         return out
     # Uncompress in the same directory
     data_dir = os.path.dirname(fname)
+    # Extract the selected members directly from the archive index
+    if members is not None and (
+            zipfile.is_zipfile(fname) or tarfile.is_tarfile(fname)):
+        try:
+            _extract_members(fname, data_dir, members)
+            if partial or not extracted:
+                _record_members(archive, members)
+        except Exception as e:
+            raise Exception("Error uncompressing file: {0}".format(e))
+        if delete_archive:
+            os.remove(fname)
+        logging.info("...done.")
+        return out
     # Try to uncompress
     try:
         # Raise an exception if this parameter is false at the end
@@ -241,6 +324,7 @@ def uncompress_file(fname, delete_archive=False):
         # Delete archive if required
         if delete_archive or (is_gz == 2):
             os.remove(fname)
+        _record_members(archive, None)
 
         logging.info("...done.")
     except Exception as e:
@@ -249,14 +333,97 @@ def uncompress_file(fname, delete_archive=False):
     return filename
 
 
+def extracted_members(fname):
+    """ Get the members extracted from an archive by a selective extraction.
+
+    Parameters
+    ----------
+    fname: str (mandatory)
+        the archive.
+
+    Returns
+    -------
+    members: list of str
+        the member names or glob patterns extracted so far, None if the
+        archive has not been partially extracted.
+    """
+    try:
+        with open(fname + MEMBERS_EXTENSION, "r") as openfile:
+            return json.load(openfile)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _record_members(fname, members):
+    """ Record the members extracted from an archive, all the members if
+    None.
+    """
+    record = fname + MEMBERS_EXTENSION
+    if members is None:
+        if os.path.exists(record):
+            os.remove(record)
+        return
+    members = sorted(set(extracted_members(fname) or []) | set(members))
+    with open(record, "w") as openfile:
+        json.dump(members, openfile)
+
+
+def _extract_members(fname, data_dir, members):
+    """ Extract the selected members of a zip or tar archive.
+
+    The member names are read from the zip central directory or from the
+    tar headers, so that the other members are not written, and, for the
+    zip and uncompressed tar archives, not decompressed or read. The
+    files already extracted are skipped if they have the member size.
+    """
+    if zipfile.is_zipfile(fname):
+        archive = zipfile.ZipFile(fname)
+        names = archive.namelist()
+        sizes = dict((info.filename, info.file_size)
+                     for info in archive.infolist()
+                     if not info.filename.endswith("/"))
+    else:
+        archive = tarfile.open(fname, "r")
+        index = archive.getmembers()
+        names = [member.name for member in index]
+        index = dict(zip(names, index))
+        sizes = dict((member.name, member.size)
+                     for member in index.values() if member.isfile())
+
+    def is_extracted(name):
+        path = os.path.join(data_dir, name)
+        if name in sizes:
+            # A truncated file is extracted again
+            return (os.path.isfile(path) and
+                    os.path.getsize(path) == sizes[name])
+        return os.path.lexists(path)
+
+    try:
+        selected = select_members(names, members)
+        if not selected:
+            raise IOError("Uncompress: no member matches "
+                          "{0}".format(members))
+        selected = [name for name in selected if not is_extracted(name)]
+        if isinstance(archive, zipfile.ZipFile):
+            archive.extractall(data_dir, members=selected)
+        else:
+            archive.extractall(
+                path=data_dir, members=[index[name] for name in selected])
+    finally:
+        archive.close()
+
+
 def get_sample_data(dataset_name, fsl_dir="/usr/share/fsl/4.1",
-                    spm_dir="/i2bm/local/spm8/"):
+                    spm_dir="/i2bm/local/spm8/", max_workers=4,
+                    stream_archives=True, members=None):
     """ Get a sample dataset.
 
     This function loads the requested dataset, downloading
     it if needed in the '$HOME/.local/share/nsap' directory.
     If a .zip or .tar.gz file is requested, the function automatically
     uncompress the file and return the path to the uncompressed file.
+    The dataset items are downloaded, verified and uncompressed
+    concurrently by a pool of threads, without progress bar.
 
     Parameters
     ----------
@@ -284,6 +451,20 @@ def get_sample_data(dataset_name, fsl_dir="/usr/share/fsl/4.1",
         with this parameter.
         Note that the default parameter is only valid for NeuroSpin users.
 
+    max_workers: int (optional)
+        the maximum number of items fetched at the same time, the items are
+        fetched one after another with a progress bar if lower than 2.
+
+    stream_archives: bool (optional)
+        if true, the tar archives not downloaded yet are extracted while
+        they are downloaded.
+
+    members: dict (optional)
+        the names or glob patterns of the archive members to be extracted,
+        see 'select_members', for each dataset item, all the members of the
+        other items being extracted. By default, the members listed in
+        'SAMPLE_DATA_MEMBERS' for the dataset, or all the members.
+
     Returns
     -------
     dataset: Enum
@@ -303,92 +484,506 @@ def get_sample_data(dataset_name, fsl_dir="/usr/share/fsl/4.1",
             "No dataset found for option {0} - allowed keys are {1}".format(
                 dataset_name, SAMPLE_DATE_FILES.keys()))
 
+    # Set the archive members to be extracted
+    if members is None:
+        members = SAMPLE_DATA_MEMBERS.get(dataset_name, {})
+
     # Set the default path where the dataset can be found
-    nsap_url = "http://nsap.intra.cea.fr/datasets/"
-    localizer_url = "http://brainomics.cea.fr/localizer/"
-    spm_dir = os.environ.get("SPMDIR", spm_dir)
-    fsl_dir = os.environ.get("FSLDIR", fsl_dir)
-    barre_url = "http://barre.nom.fr/"
+    locations = {
+        "nsap_url": "http://nsap.intra.cea.fr/datasets/",
+        "localizer_url": "http://brainomics.cea.fr/localizer/",
+        "spm_dir": os.environ.get("SPMDIR", spm_dir),
+        "fsl_dir": os.environ.get("FSLDIR", fsl_dir),
+        "barre_url": "http://barre.nom.fr/"}
+
+    # Fetch the file descriptions (tuples) concurrently
+    files = [(cnt, key, value)
+             for cnt, (key, value) in enumerate(dataset_description.items)
+             if isinstance(value, tuple)]
+    if max_workers > 1 and len(files) > 1:
+        pool = ThreadPool(min(max_workers, len(files)))
+        try:
+            local_fnames = pool.map(
+                lambda item: _fetch_item(item[2], locations, progress=False,
+                                         stream=stream_archives,
+                                         members=members.get(item[1])),
+                files)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        local_fnames = [_fetch_item(value, locations, stream=stream_archives,
+                                    members=members.get(key))
+                        for _, key, value in files]
 
     # Transform the dataset description
     # Replace file path description with file real location on the disk.
-    for cnt, values in enumerate(dataset_description.items):
-        key, value = values
-        # If tuple -> file decription
-        if isinstance(value, tuple):
-            # Get the resource on the web
-            if value[0] in ["nsap_url", "barre_url", "localizer_url"]:
-                url = os.path.join(eval(value[0]), value[1])
-                print ""
-                local_fname = download_file(url, resume=True, overwrite=False,
-                                            md5sum=value[2])
-                # download from localizer does not keep the correct extention
-                if value[0] == "localizer_url":
-                    shutil.move(local_fname, "{0}.zip".format(local_fname))
-                    local_fname = "{0}.zip".format(local_fname)
-            # Resource already on the disk
-            else:
-                local_fname = os.path.join(eval(value[0]), value[1])
-                if not os.path.isfile(local_fname):
-                    raise Exception("Uknown local file '{0}'. The '{1}' "
-                                    "directory resource may not be "
-                                    "valid.".format(local_fname, value[0]))
-
-            # Check if a valid file has been found
-            md5sum = value[2]
-            md5sum_upload = md5_sum_file(local_fname)
-            logging.info("md5 is '{0}'".format(md5sum_upload))
-            if md5sum is not None:
-                if (md5sum_upload != md5sum):
-                    raise ValueError("File {0} checksum verification has "
-                                     "failed. Dataset importation "
-                                     "aborted.".format(local_fname))
-                else:
-                    logging.info("The imported file is valid "
-                                 "(md5 sum check).")
-
-            # Uncompress archive
-            filename, ext = os.path.splitext(local_fname)
-            if local_fname.endswith((".zip", "tar.gz", ".tgz", ".bz2")):
-                local_fname = uncompress_file(local_fname)
-                if value[0] == "localizer_url":
-                    local_fname = os.path.join(
-                        os.path.dirname(local_fname),
-                        value[3],
-                        "raw_fMRI_raw_bold.nii.gz")
-            # Update the enum structure
-            dataset_description.items[cnt] = (key, local_fname)
-            expression = "dataset_description.{0} = '{1}'".format(key,
-                                                                  local_fname)
-            namespace = {"dataset_description": dataset_description}
-            exec expression in namespace
+    for (cnt, key, value), local_fname in zip(files, local_fnames):
+        # Update the enum structure
+        dataset_description.items[cnt] = (key, local_fname)
+        expression = "dataset_description.{0} = '{1}'".format(key,
+                                                              local_fname)
+        namespace = {"dataset_description": dataset_description}
+        exec expression in namespace
 
     return dataset_description
 
 
-def md5_sum_file(fname):
+def _fetch_item(value, locations, progress=True, stream=False, members=None):
+    """ Get, verify and uncompress a dataset file.
+
+    Parameters
+    ----------
+    value: tuple (mandatory)
+        the file description: the location name, the relative path, the
+        checksum and, for 'localizer_url' files, the archive subdirectory.
+    locations: dict (mandatory)
+        the url or directory of each location name.
+    progress: bool (optional)
+        if true, display a download progress bar.
+    stream: bool (optional)
+        if true, extract a tar archive while it is downloaded.
+    members: list of str (optional)
+        the names or glob patterns of the archive members of the item to be
+        extracted.
+
+    Returns
+    -------
+    local_fname: str
+        the path to the local file.
+    """
+    # Get the resource on the web
+    if value[0] in ["nsap_url", "barre_url", "localizer_url"]:
+        url = os.path.join(locations[value[0]], value[1])
+        if stream and url.endswith(TAR_EXTENSIONS):
+            local_fname = extract_download(url, md5sum=value[2],
+                                           members=members)
+            if local_fname is not None:
+                return local_fname
+        if progress:
+            print ""
+        local_fname = download_file(url, resume=True, overwrite=False,
+                                    md5sum=value[2], progress=progress)
+        # download from localizer does not keep the correct extention
+        if value[0] == "localizer_url":
+            algorithm = parse_checksum(value[2] or "")[0]
+            digest = checksum_cache().get(local_fname, algorithm)
+            shutil.move(local_fname, "{0}.zip".format(local_fname))
+            local_fname = "{0}.zip".format(local_fname)
+            if digest is not None:
+                checksum_cache().set(local_fname, digest, algorithm)
+    # Resource already on the disk
+    else:
+        local_fname = os.path.join(locations[value[0]], value[1])
+        if not os.path.isfile(local_fname):
+            raise Exception("Uknown local file '{0}'. The '{1}' "
+                            "directory resource may not be "
+                            "valid.".format(local_fname, value[0]))
+
+    # Check if a valid file has been found
+    algorithm, md5sum = parse_checksum(value[2] or "")
+    md5sum_upload = md5_sum_file(local_fname, cache=checksum_cache(),
+                                 algorithm=algorithm)
+    logging.info("{0} is '{1}'".format(algorithm, md5sum_upload))
+    if md5sum is not None:
+        if (md5sum_upload != md5sum):
+            raise ValueError("File {0} checksum verification has "
+                             "failed. Dataset importation "
+                             "aborted.".format(local_fname))
+        else:
+            logging.info("The imported file is valid "
+                         "(md5 sum check).")
+
+    # Uncompress archive
+    if local_fname.endswith((".zip", "tar.gz", ".tgz", ".bz2")):
+        local_fname = uncompress_file(local_fname, members=members)
+        if value[0] == "localizer_url":
+            local_fname = os.path.join(
+                os.path.dirname(local_fname),
+                value[3],
+                "raw_fMRI_raw_bold.nii.gz")
+
+    return local_fname
+
+
+class ChecksumCache(object):
+    """ Persistent cache of the file checksums.
+
+    A checksum is kept in a json file with the real path, inode, size and
+    modification time of the hashed file, so that a file already verified
+    is not read again while it is unchanged.
+    """
+    def __init__(self, cache_file):
+        """ Initialize the ChecksumCache class.
+
+        Parameters
+        ----------
+        cache_file: str (mandatory)
+            the json file where the checksums are stored, created on the
+            first stored checksum.
+        """
+        self.cache_file = cache_file
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def get(self, fname, algorithm="md5"):
+        """ Get the cached checksum of an unchanged file.
+
+        Returns
+        -------
+        digest: str
+            the checksum, None if not cached or if the file has changed.
+        """
+        path, signature = self._signature(fname)
+        with self.lock:
+            entry = self._load().get(path)
+        if entry is None or entry.get("signature") != signature:
+            return None
+        return entry.get(algorithm)
+
+    def set(self, fname, digest, algorithm="md5"):
+        """ Store the checksum of a file.
+
+        The cache is not updated if its directory can not be written.
+        """
+        path, signature = self._signature(fname)
+        with self.lock:
+            entries = self._load()
+            entry = entries.get(path)
+            if entry is None or entry.get("signature") != signature:
+                entry = {"signature": signature}
+            entry[algorithm] = digest
+            entries[path] = entry
+            try:
+                self._save(path, entry)
+            except (IOError, OSError):
+                logging.info("The checksum cache '{0}' can not be "
+                             "written.".format(self.cache_file))
+
+    def _signature(self, fname):
+        """ Get the real path of a file and its inode, size and
+        modification time in nanoseconds.
+        """
+        path = os.path.realpath(fname)
+        stat = os.stat(path)
+        mtime = getattr(stat, "st_mtime_ns", int(stat.st_mtime * 1e9))
+        return path, [stat.st_ino, stat.st_size, mtime]
+
+    def _load(self):
+        """ Read the cache file once.
+        """
+        if self.entries is None:
+            self.entries = self._read()
+        return self.entries
+
+    def _read(self):
+        """ Read the cache file, an unreadable file being an empty cache.
+        """
+        try:
+            with open(self.cache_file, "r") as openfile:
+                entries = json.load(openfile)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _save(self, path, entry):
+        """ Atomically write the cache file, keeping the entries stored by
+        other processes.
+        """
+        cache_dir = os.path.dirname(self.cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        entries = self._read()
+        entries[path] = entry
+        fd, tmp_fname = tempfile.mkstemp(prefix=".", dir=cache_dir)
+        try:
+            with os.fdopen(fd, "w") as openfile:
+                json.dump(entries, openfile)
+            os.rename(tmp_fname, self.cache_file)
+        except:
+            if os.path.isfile(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+        self.entries = entries
+
+
+# The default data directory
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".local", "share", "nsap")
+
+# The name of the checksum cache file of the data directories
+CHECKSUM_CACHE_NAME = ".checksums.json"
+
+# The checksum caches of the data directories
+CHECKSUM_CACHES = {}
+CHECKSUM_CACHES_LOCK = threading.Lock()
+
+
+def checksum_cache(data_dir=None):
+    """ Get the checksum cache stored in a data directory.
+
+    Parameters
+    ----------
+    data_dir: str (optional)
+        the data directory, '$HOME/.local/share/nsap' by default.
+
+    Returns
+    -------
+    cache: ChecksumCache
+        the cache shared by the callers using this data directory.
+    """
+    data_dir = os.path.abspath(data_dir or DATA_DIR)
+    with CHECKSUM_CACHES_LOCK:
+        cache = CHECKSUM_CACHES.get(data_dir)
+        if cache is None:
+            cache = ChecksumCache(os.path.join(data_dir, CHECKSUM_CACHE_NAME))
+            CHECKSUM_CACHES[data_dir] = cache
+    return cache
+
+
+# The size of the reads of the hashed files
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# The size from which the hashed files are memory mapped
+HASH_MMAP_SIZE = 64 * 1024 * 1024
+
+# The size of the leaves of the 'blake2b-tree' hashes
+TREE_LEAF_SIZE = 16 * 1024 * 1024
+
+
+def parse_checksum(checksum):
+    """ Split a checksum of the datasets description.
+
+    Parameters
+    ----------
+    checksum: str (mandatory)
+        an hexadecimal digest prefixed by its algorithm, as
+        'blake2b:<digest>', a digest without prefix being an md5 sum.
+
+    Returns
+    -------
+    algorithm: str
+        the hash algorithm.
+    digest: str
+        the hexadecimal digest, None if empty.
+    """
+    algorithm = "md5"
+    if ":" in checksum:
+        algorithm, checksum = checksum.split(":", 1)
+    return algorithm.lower(), checksum.lower() or None
+
+
+class TreeHash(object):
+    """ BLAKE2b hash tree of depth 2 with unlimited fanout.
+
+    The data is split in leaves of 'leaf_size' bytes, each leaf being
+    hashed with its offset, the last leaf being flagged as the last node,
+    and the root node hashes the leaf digests. The leaves of a file can be
+    hashed in parallel.
+
+    The last leaf is only known at the end of a stream: the current leaf is
+    hashed both as an inner and as a last node.
+    """
+    def __init__(self, leaf_size=None):
+        """ Initialize the TreeHash class.
+
+        Parameters
+        ----------
+        leaf_size: int (optional)
+            the size of the leaves in bytes, 'TREE_LEAF_SIZE' by default.
+        """
+        if blake2b is None:
+            raise ValueError("The 'blake2b' hash algorithm is not "
+                             "available: install 'pyblake2'.")
+        self.leaf_size = leaf_size or TREE_LEAF_SIZE
+        self.digests = []
+        self.leaf = self.leaf_hash(0)
+        self.last_leaf = self.leaf_hash(0, last_node=True)
+        self.leaf_bytes = 0
+
+    def leaf_hash(self, offset, last_node=False):
+        """ Create the hash of a leaf.
+        """
+        return blake2b(
+            fanout=0, depth=2, leaf_size=self.leaf_size, node_offset=offset,
+            node_depth=0, inner_size=blake2b().digest_size,
+            last_node=last_node)
+
+    def update(self, data):
+        """ Hash the next bytes.
+        """
+        data = memoryview(data)
+        while len(data) > 0:
+            # A full leaf followed by data is not the last one
+            if self.leaf_bytes == self.leaf_size:
+                self.digests.append(self.leaf.digest())
+                self.leaf = self.leaf_hash(len(self.digests))
+                self.last_leaf = self.leaf_hash(len(self.digests),
+                                                last_node=True)
+                self.leaf_bytes = 0
+            size = min(len(data), self.leaf_size - self.leaf_bytes)
+            self.leaf.update(data[:size])
+            self.last_leaf.update(data[:size])
+            self.leaf_bytes += size
+            data = data[size:]
+
+    def hexdigest(self):
+        """ Get the root digest.
+        """
+        return self.root_hexdigest(self.digests + [self.last_leaf.digest()])
+
+    def root_hexdigest(self, digests):
+        """ Get the root digest of the leaf digests.
+        """
+        root = blake2b(
+            fanout=0, depth=2, leaf_size=self.leaf_size, node_offset=0,
+            node_depth=1, inner_size=blake2b().digest_size,
+            last_node=True)
+        root.update(b"".join(digests))
+        return root.hexdigest()
+
+
+def new_hash(algorithm="md5"):
+    """ Create a hash object.
+
+    Parameters
+    ----------
+    algorithm: str (optional)
+        the hash algorithm: 'blake2b', 'blake2b-tree' or one of the hashlib
+        algorithms. The BLAKE2b hashes require python >= 3.6 or the
+        'pyblake2' package.
+
+    Returns
+    -------
+    hash: object
+        the hash object with 'update' and 'hexdigest' methods.
+    """
+    if algorithm == "blake2b-tree":
+        return TreeHash()
+    if algorithm == "blake2b" and blake2b is not None:
+        return blake2b()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError("Unsupported hash algorithm '{0}'.".format(
+            algorithm))
+
+
+class HashingReader(object):
+    """ Read a stream while hashing the read bytes and copying them to a
+    file.
+    """
+    def __init__(self, fileobj, hash, copy=None):
+        """ Initialize the HashingReader class.
+
+        Parameters
+        ----------
+        fileobj: object (mandatory)
+            the read stream.
+        hash: object (mandatory)
+            the hash updated with the read bytes.
+        copy: file (optional)
+            the file where the read bytes are written.
+        """
+        self.fileobj = fileobj
+        self.hash = hash
+        self.copy = copy
+
+    def read(self, size=None):
+        """ Read bytes from the stream.
+        """
+        if size is None or size < 0:
+            data = self.fileobj.read()
+        else:
+            data = self.fileobj.read(size)
+        self.hash.update(data)
+        if self.copy is not None:
+            self.copy.write(data)
+        return data
+
+
+def md5_sum_file(fname, cache=None, algorithm="md5", max_workers=4):
     """ Calculates the MD5 sum of a file.
 
+    Large files are memory mapped, and the leaves of the 'blake2b-tree'
+    hashes are computed in parallel.
+
     Parameters
     ----------
     fname: str (mandatory)
         the path to a file
+    cache: ChecksumCache (optional)
+        if specified, the cache where the sum of an unchanged file is
+        found or stored.
+    algorithm: str (optional)
+        the hash algorithm, see 'new_hash'.
+    max_workers: int (optional)
+        the maximum number of leaves hashed at the same time.
 
     Returns
     -------
-    md5: int
-        the md5 sum of the input file
+    md5: str
+        the hexadecimal sum of the input file
     """
-    f = open(fname, 'rb')
-    m = hashlib.md5()
-    while True:
-        data = f.read(8192)
-        if not data:
-            break
+    if cache is not None:
+        md5sum = cache.get(fname, algorithm)
+        if md5sum is not None:
+            return md5sum
+        md5sum = md5_sum_file(fname, algorithm=algorithm,
+                              max_workers=max_workers)
+        cache.set(fname, md5sum, algorithm)
+        return md5sum
+    m = new_hash(algorithm)
+    with open(fname, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HASH_MMAP_SIZE:
+            while True:
+                data = f.read(HASH_BUFFER_SIZE)
+                if not data:
+                    break
+                m.update(data)
+            return m.hexdigest()
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if isinstance(m, TreeHash):
+            return m.root_hexdigest(
+                _hash_leaves(m, data, size, max_workers))
         m.update(data)
+    finally:
+        data.close()
     return m.hexdigest()
 
 
+def _hash_leaves(tree, data, size, max_workers):
+    """ Hash in parallel the leaves of a memory mapped file.
+
+    Returns
+    -------
+    digests: list of bytes
+        the leaf digests.
+    """
+    nb_leaves = max((size + tree.leaf_size - 1) // tree.leaf_size, 1)
+
+    def leaf_digest(offset):
+        leaf = tree.leaf_hash(offset, last_node=(offset == nb_leaves - 1))
+        start = offset * tree.leaf_size
+        try:
+            view = memoryview(data)
+        except TypeError:
+            # Python 2 memory maps do not support memory views
+            view = data
+        leaf.update(view[start: start + tree.leaf_size])
+        return leaf.digest()
+
+    workers = ThreadPool(min(max_workers, nb_leaves))
+    try:
+        return workers.map(leaf_digest, range(nb_leaves))
+    finally:
+        workers.close()
+        workers.join()
+
+
 def progress_bar(window, ratio, fname=None, bar_length=20):
     """ Generate a progress bar
 
@@ -426,8 +1021,243 @@ class ResumeURLOpener(object, urllib.FancyURLopener):
         pass
 
 
+def get_proxy(scheme, netloc):
+    """ Get the proxy of a host, configured as for 'urllib2.urlopen'.
+
+    The proxies are read from the '<scheme>_proxy' environment variables
+    or the system settings, the hosts matching 'no_proxy' being reached
+    directly.
+
+    Parameters
+    ----------
+    scheme: str (mandatory)
+        the url scheme, 'http' or 'https'.
+    netloc: str (mandatory)
+        the requested 'host[:port]'.
+
+    Returns
+    -------
+    proxy: str
+        the proxy 'host[:port]', None for a direct connection.
+    headers: dict
+        the proxy authentication headers.
+    """
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(netloc):
+        return None, {}
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    parse = urlparse.urlsplit(proxy)
+    headers = {}
+    if parse.username is not None:
+        credentials = "{0}:{1}".format(urllib.unquote(parse.username),
+                                       urllib.unquote(parse.password or ""))
+        headers["Proxy-Authorization"] = "Basic {0}".format(
+            base64.b64encode(credentials))
+    return parse.netloc.rsplit("@", 1)[-1], headers
+
+
+class ConnectionPool(object):
+    """ Pool of persistent HTTP connections grouped per host.
+
+    The idle connections of a host are reused by the next requests to this
+    host, so that the TCP/TLS setup is done once and the keep-alive
+    connections are not dropped between the downloaded files. The
+    connections go through the configured proxies, see 'get_proxy', the
+    https connections being tunneled.
+    """
+    def __init__(self, pool_size=4, timeout=60):
+        """ Initialize the ConnectionPool class.
+
+        Parameters
+        ----------
+        pool_size: int (optional)
+            the maximum number of idle connections kept per host.
+        timeout: float (optional)
+            the socket timeout in seconds.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """ Get an idle connection to a host or open a new one.
+
+        Returns
+        -------
+        connection: HTTPConnection
+            the connection.
+        reused: bool
+            true if the connection was idle in the pool.
+        """
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        proxy, headers = get_proxy(scheme, netloc)
+        if scheme == "https":
+            connection = httplib.HTTPSConnection(proxy or netloc,
+                                                 timeout=self.timeout)
+            if proxy is not None:
+                connection.set_tunnel(netloc, headers=headers)
+        elif scheme == "http":
+            connection = httplib.HTTPConnection(proxy or netloc,
+                                                timeout=self.timeout)
+        else:
+            raise urllib2.URLError("unsupported url scheme '{0}'".format(
+                scheme))
+        return connection, False
+
+    def put(self, scheme, netloc, connection):
+        """ Give back an idle connection to the pool.
+        """
+        with self.lock:
+            connections = self.idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.pool_size:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """ Close all the idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+# The connection pool shared by the downloads
+CONNECTION_POOL = ConnectionPool()
+
+
+class PooledResponse(object):
+    """ An HTTP response giving back its connection to the pool once read.
+    """
+    def __init__(self, url, response, pool, scheme, netloc, connection):
+        self.url = url
+        self.response = response
+        self.code = response.status
+        self.pool = pool
+        self.key = (scheme, netloc)
+        self.connection = connection
+
+    def info(self):
+        """ Get the response headers.
+        """
+        return self.response.msg
+
+    def getcode(self):
+        """ Get the response status.
+        """
+        return self.code
+
+    def read(self, amt=None):
+        """ Read the response body.
+        """
+        return self.response.read(amt)
+
+    def close(self):
+        """ Release the connection, reused only if the body has been read
+        entirely and the server keeps the connection alive.
+        """
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key[0], self.key[1], connection)
+        else:
+            self.response.close()
+            connection.close()
+
+
+def open_url(url, headers=None, pool=None, max_redirects=5):
+    """ Send a GET request on a pooled connection.
+
+    Parameters
+    ----------
+    url: str (mandatory)
+        the requested url.
+    headers: dict (optional)
+        the request headers.
+    pool: ConnectionPool (optional)
+        the connection pool, the shared pool by default.
+    max_redirects: int (optional)
+        the maximum number of redirections followed.
+
+    Returns
+    -------
+    response: PooledResponse
+        the response, to be closed once read.
+    """
+    pool = pool or CONNECTION_POOL
+    headers = dict(headers or {})
+    for _ in range(max_redirects + 1):
+        parse = urlparse.urlsplit(url)
+        path = parse.path or "/"
+        if parse.query:
+            path += "?" + parse.query
+        request_headers = headers
+        proxy, proxy_headers = get_proxy(parse.scheme, parse.netloc)
+        if proxy is not None and parse.scheme == "http":
+            # Send the absolute url to the proxy
+            path = urlparse.urlunsplit(parse[:4] + ("", ))
+            request_headers = dict(headers, **proxy_headers)
+        connection, reused = pool.get(parse.scheme, parse.netloc)
+        try:
+            connection.request("GET", path, headers=request_headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error), e:
+            connection.close()
+            if not reused:
+                raise urllib2.URLError(e)
+            # The server closed the idle connection: retry on a new one
+            connection = pool.get(parse.scheme, parse.netloc)[0]
+            try:
+                connection.request("GET", path, headers=request_headers)
+                response = connection.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                connection.close()
+                raise urllib2.URLError(e)
+        result = PooledResponse(url, response, pool, parse.scheme,
+                                parse.netloc, connection)
+
+        # Follow the redirections
+        location = response.getheader("Location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()
+            result.close()
+            url = urlparse.urljoin(url, location)
+            continue
+
+        # Raise the errors as urllib2
+        if response.status >= 400:
+            response.read()
+            result.close()
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        return result
+    raise urllib2.HTTPError(url, response.status, "Too many redirections",
+                            response.msg, None)
+
+
+# The chunk size of the downloads
+CHUNK_SIZE = 8192
+
+# The extensions of the archives extracted while they are downloaded
+TAR_EXTENSIONS = (".tar.gz", ".tgz", ".tar.bz2")
+
+# The extension of the segmented downloads state files
+SEGMENTS_EXTENSION = ".json"
+
+# The number of bytes downloaded in a segment between two state saves
+SEGMENTS_SAVE_INTERVAL = 1024 * 1024
+
+
 def download_file(url, data_dir=None, resume=True, overwrite=False,
-                  md5sum=None):
+                  md5sum=None, progress=True, pool=None, segments=1):
     """ Load requested file, downloading it if needed or requested.
 
     Parameters
@@ -446,7 +1276,22 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
         if true and file already exists, delete it.
 
     md5sum: str (optional)
-        check if the downloaded file has this MD5 sum.
+        check if the downloaded file has this MD5 sum, or this checksum if
+        prefixed by its algorithm as in 'blake2b:<digest>'. The sum is
+        computed while the data is downloaded.
+
+    progress: bool (optional)
+        if true, display a progress bar in the terminal, must be false when
+        several files are downloaded at the same time.
+
+    pool: ConnectionPool (optional)
+        the persistent connections reused across downloads, the shared
+        'CONNECTION_POOL' by default.
+
+    segments: int (optional)
+        if greater than one and the server accepts range requests, the
+        number of byte ranges downloaded concurrently, without progress
+        bar.
 
     Returns
     -------
@@ -460,8 +1305,7 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
     """
     # Create the default data directory
     if data_dir is None:
-        home = os.path.expanduser("~")
-        data_dir = os.path.join(home, ".local", "share", "nsap")
+        data_dir = DATA_DIR
 
     # Create the download directory if necessary
     if not os.path.exists(data_dir):
@@ -487,38 +1331,69 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
 
     # If the temporary file is already created remove it if the overwrite
     # option is set
+    state_fname = temp_fname + SEGMENTS_EXTENSION
     if os.path.exists(temp_fname):
         if overwrite:
             os.remove(temp_fname)
+    if os.path.exists(state_fname):
+        if overwrite or not resume:
+            os.remove(state_fname)
 
     # Start a timer to evaluate the download time
     t0 = time.time()
 
+    # Download concurrent byte ranges, or resume a segmented download, if
+    # the server accepts range requests
+    if segments > 1 or os.path.exists(state_fname):
+        logging.info("Downloading data from {0} in {1} segments...".format(
+            url, segments))
+        if _download_segments(url, temp_fname, segments, resume=resume,
+                              pool=pool):
+            shutil.move(temp_fname, download_fname)
+            logging.info("... '{0}' download done in {1: .2f} seconds".format(
+                url, time.time() - t0))
+            _check_md5sum(download_fname, md5sum, checksum_cache(data_dir))
+            return download_fname
+        logging.info("The server does not accept range requests.")
+
     # Start downloading dataset
     local_file = None
+    data = None
     bytes_so_far = 0
+    algorithm = parse_checksum(md5sum or "")[0]
+    m = new_hash(algorithm)
     try:
         # Prepare the download
         logging.info("Downloading data from {0}...".format(url))
         # Case 1: continue the downloading from an existing temporary file
         if resume and os.path.exists(temp_fname):
-            url_opener = ResumeURLOpener()
             # Download has been interrupted, we try to resume it.
             local_file_size = os.path.getsize(temp_fname)
             # If the file exists, then only download the remainder
-            url_opener.addheader("Range", "bytes={0}-".format(local_file_size))
             try:
-                data = url_opener.open(url)
+                data = open_url(
+                    url, {"Range": "bytes={0}-".format(local_file_size)},
+                    pool=pool)
             except urllib2.HTTPError:
                 # There is a problem that may be due to resuming
                 # Restart the downloading from scratch
                 return download_file(url, data_dir, resume=False,
-                                     overwrite=False)
-            local_file = open(temp_fname, "ab")
+                                     overwrite=False, md5sum=md5sum,
+                                     progress=progress, pool=pool)
+            # The server ignored the range and sends the whole file
+            if data.getcode() != 206:
+                local_file_size = 0
+            # Hash the bytes already downloaded
+            if local_file_size:
+                with open(temp_fname, "rb") as openfile:
+                    for chunk in iter(
+                            lambda: openfile.read(HASH_BUFFER_SIZE), b""):
+                        m.update(chunk)
+            local_file = open(temp_fname, "ab" if local_file_size else "wb")
             bytes_so_far = local_file_size
         # Case 2: just download the file
         else:
-            data = urllib2.urlopen(url)
+            data = open_url(url, pool=pool)
             local_file = open(temp_fname, "wb")
         # Get the total file size
         try:
@@ -529,8 +1404,10 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
             total_size = "?"
 
         # Download data
-        chunk_size = 8192
-        window = curses.initscr()
+        chunk_size = CHUNK_SIZE
+        window = None
+        if progress:
+            window = curses.initscr()
         while True:
             # Read chunk
             chunk = data.read(chunk_size)
@@ -540,6 +1417,7 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
             # Write to local file
             bytes_so_far += len(chunk)
             local_file.write(chunk)
+            m.update(chunk)
             # Write report status and print a progress bar
             if isinstance(total_size, int):
                 ratio = float(bytes_so_far) / float(total_size)
@@ -548,8 +1426,11 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
             status = r"{0}  [{1: .2f}%]".format(bytes_so_far, ratio * 100.)
             status = status + chr(8) * (len(status) + 1)
             logging.info(status)
-            progress_bar(window, ratio, url)
-        curses.endwin()
+            if window is not None:
+                progress_bar(window, ratio, url)
+        if window is not None:
+            curses.endwin()
+        data.close()
 
         # Temporary file must be closed prior to the move
         if not local_file.closed:
@@ -574,16 +1455,357 @@ def download_file(url, data_dir=None, resume=True, overwrite=False,
         if local_file is not None:
             if not local_file.closed:
                 local_file.close()
+        # Connection must be released
+        if data is not None:
+            data.close()
 
-    # md5 check sum
+    # md5 check sum, the moved file keeping its inode and mtime
+    cache = checksum_cache(data_dir)
+    cache.set(download_fname, m.hexdigest(), algorithm)
+    _check_md5sum(download_fname, md5sum, cache)
+
+    return download_fname
+
+
+def _check_md5sum(fname, md5sum, cache=None):
+    """ Check the checksum of a downloaded file if specified.
+    """
+    algorithm, md5sum = parse_checksum(md5sum or "")
     if md5sum is not None:
-        if (md5_sum_file(download_fname) != md5sum):
+        if (md5_sum_file(fname, cache=cache,
+                         algorithm=algorithm) != md5sum):
             raise ValueError("File {0} checksum verification has failed. "
-                             "Dataset download aborted.".format(local_file))
+                             "Dataset download aborted.".format(fname))
         else:
-            logging.info("The downloaded file is valid (md5 sum check).")
+            logging.info("The downloaded file is valid ({0} sum "
+                         "check).".format(algorithm))
 
-    return download_fname
+
+def _ranged_size(url, pool=None):
+    """ Get the size of a remote file if the server accepts range requests.
+
+    Returns
+    -------
+    size: int
+        the file size, None if the range requests are not supported.
+    """
+    try:
+        data = open_url(url, {"Range": "bytes=0-0"}, pool=pool)
+    except urllib2.HTTPError:
+        return None
+    try:
+        # Do not read the whole file if the range is ignored
+        content_range = data.info().getheader("Content-Range") or ""
+        if data.getcode() != 206 or "/" not in content_range:
+            return None
+        data.read()
+        try:
+            return int(content_range.rsplit("/", 1)[1])
+        except ValueError:
+            return None
+    finally:
+        data.close()
+
+
+def _save_segments(state_fname, state):
+    """ Atomically save the state of a segmented download.
+    """
+    tmp_fname = state_fname + ".tmp"
+    with open(tmp_fname, "w") as openfile:
+        json.dump(state, openfile)
+    os.rename(tmp_fname, state_fname)
+
+
+def _download_segments(url, temp_fname, segments, resume=True, pool=None,
+                       chunk_size=CHUNK_SIZE):
+    """ Download concurrently the byte ranges of a file.
+
+    The ranges are written in a preallocated temporary file, the progress
+    of each range being saved in a json file beside it, so that an
+    interrupted download resumes each range where it stopped. A temporary
+    file left by a single stream download is kept as a first range.
+
+    Parameters
+    ----------
+    url: str (mandatory)
+        the url of the file to be downloaded.
+    temp_fname: str (mandatory)
+        the temporary file.
+    segments: int (mandatory)
+        the number of ranges downloaded at the same time.
+    resume: bool (optional)
+        if true, keep the bytes of a single stream temporary file.
+    pool: ConnectionPool (optional)
+        the persistent connections.
+    chunk_size: int (optional)
+        the size of the chunks read from the connections.
+
+    Returns
+    -------
+    downloaded: bool
+        false if the server does not accept range requests.
+    """
+    # Load the state of an interrupted download
+    state_fname = temp_fname + SEGMENTS_EXTENSION
+    state = None
+    if os.path.exists(state_fname):
+        try:
+            with open(state_fname, "r") as openfile:
+                state = json.load(openfile)
+        except ValueError:
+            state = None
+        if state is not None and (
+                state.get("url") != url or
+                not os.path.exists(temp_fname) or
+                os.path.getsize(temp_fname) != state.get("size")):
+            state = None
+
+        # The preallocated temporary file of an unusable state has holes
+        if state is None:
+            os.remove(state_fname)
+            if os.path.exists(temp_fname):
+                os.remove(temp_fname)
+
+    # Split the remaining bytes and preallocate the temporary file
+    if state is None:
+        total_size = _ranged_size(url, pool=pool)
+        if total_size is None:
+            return False
+        prefix = 0
+        if resume and os.path.exists(temp_fname):
+            prefix = min(os.path.getsize(temp_fname), total_size)
+        segments = max(min(segments, total_size - prefix), 1)
+        bounds = [prefix + (total_size - prefix) * index // segments
+                  for index in range(segments + 1)]
+        state = {
+            "url": url,
+            "size": total_size,
+            "segments": [[start, end, start]
+                         for start, end in zip(bounds[:-1], bounds[1:])]}
+        with open(temp_fname, "ab" if prefix else "wb") as openfile:
+            openfile.truncate(total_size)
+        _save_segments(state_fname, state)
+
+    # Download the ranges: a segment is [start, end, position]
+    lock = threading.Lock()
+
+    def fetch(segment):
+        if segment[2] >= segment[1]:
+            return
+        data = open_url(url, {"Range": "bytes={0}-{1}".format(
+            segment[2], segment[1] - 1)}, pool=pool)
+        try:
+            if data.getcode() != 206:
+                raise IOError("The server ignored the range request.")
+            with open(temp_fname, "r+b") as openfile:
+                position = segment[2]
+                openfile.seek(position)
+                while position < segment[1]:
+                    chunk = data.read(min(chunk_size, segment[1] - position))
+                    if not chunk:
+                        raise IOError("Truncated range response.")
+                    openfile.write(chunk)
+                    position += len(chunk)
+                    if (position - segment[2] >= SEGMENTS_SAVE_INTERVAL or
+                            position == segment[1]):
+                        openfile.flush()
+                        with lock:
+                            segment[2] = position
+                            _save_segments(state_fname, state)
+        finally:
+            data.close()
+
+    workers = ThreadPool(len(state["segments"]))
+    try:
+        workers.map(fetch, state["segments"])
+    except (urllib2.URLError, IOError, socket.error), e:
+        raise Exception("{0}\nError while downloading file '{1}'. "
+                        "Dataset download aborted.".format(e, url))
+    finally:
+        workers.close()
+        workers.join()
+        with lock:
+            _save_segments(state_fname, state)
+
+    # Download done
+    os.remove(state_fname)
+    return True
+
+
+def check_tar_member(member, path):
+    """ Check a tar member can be safely extracted in a directory.
+
+    The archive is not trusted: the special files are rejected, and so are
+    the members and the link targets outside the directory, the links
+    already extracted being resolved.
+
+    Parameters
+    ----------
+    member: TarInfo (mandatory)
+        the tar member.
+    path: str (mandatory)
+        the extraction directory.
+    """
+    if not (member.isfile() or member.isdir() or member.issym() or
+            member.islnk()):
+        raise tarfile.TarError("Unsafe tar member '{0}': special files are "
+                               "not extracted.".format(member.name))
+    root = os.path.realpath(path)
+    target = os.path.join(root, member.name)
+    if (os.path.isabs(member.name) or
+            not _is_inside(os.path.realpath(target), root)):
+        raise tarfile.TarError("Unsafe tar member '{0}': the member is "
+                               "outside the extraction directory.".format(
+                                   member.name))
+    if member.issym():
+        link = os.path.join(os.path.dirname(target), member.linkname)
+    elif member.islnk():
+        link = os.path.join(root, member.linkname)
+    else:
+        return
+    if (os.path.isabs(member.linkname) or
+            not _is_inside(os.path.realpath(link), root)):
+        raise tarfile.TarError("Unsafe tar member '{0}': the link target is "
+                               "outside the extraction directory.".format(
+                                   member.name))
+
+
+def _is_inside(path, root):
+    """ Check a path is in a directory.
+    """
+    return path == root or path.startswith(root + os.sep)
+
+
+def _merge_tree(source, destination):
+    """ Move the content of a directory into another one file by file.
+
+    As 'extractall', the existing directories are merged and the existing
+    files are replaced, so that the archives sharing directories keep each
+    other's files.
+    """
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        target = os.path.join(destination, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            if os.path.lexists(target) and (
+                    os.path.islink(target) or not os.path.isdir(target)):
+                os.remove(target)
+            if not os.path.isdir(target):
+                try:
+                    os.rename(path, target)
+                    continue
+                except OSError:
+                    # Created in the meantime by a concurrent extraction
+                    if not os.path.isdir(target):
+                        raise
+            _merge_tree(path, target)
+        else:
+            os.rename(path, target)
+
+
+def extract_download(url, data_dir=None, md5sum=None, pool=None,
+                     members=None):
+    """ Extract a tar archive while it is downloaded.
+
+    The downloaded stream is hashed, written to the archive file and
+    extracted in a staging directory at once, the unsafe members being
+    rejected before they are extracted, see 'check_tar_member'. The
+    extracted members are merged in the data directory only if the
+    checksum is valid, otherwise they are removed.
+
+    Parameters
+    ----------
+    url: str (mandatory)
+        the url of the tar archive, which may be compressed.
+    data_dir: str (optional)
+        the directory where the archive is downloaded and extracted,
+        '$HOME/.local/share/nsap' by default.
+    md5sum: str (optional)
+        check if the downloaded archive has this checksum, see
+        'download_file'.
+    pool: ConnectionPool (optional)
+        the persistent connections, the shared 'CONNECTION_POOL' by
+        default.
+    members: list of str (optional)
+        the names or glob patterns of the members to be extracted, see
+        'select_members', all the members by default. A selective
+        extraction is recorded, see 'extracted_members'.
+
+    Returns
+    -------
+    out: str
+        the path to the uncompressed object, as returned by
+        'uncompress_file', or None if the archive or a partial download of
+        the archive already exists and should be used instead.
+    """
+    # Generate the download file names
+    data_dir = data_dir or DATA_DIR
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    fname = os.path.basename(urllib2.urlparse.urlparse(url).path)
+    download_fname = os.path.join(data_dir, fname)
+    temp_fname = download_fname + ".part"
+    if os.path.exists(download_fname) or os.path.exists(temp_fname):
+        return None
+    out = fname
+    for ext in TAR_EXTENSIONS:
+        if fname.endswith(ext):
+            out = fname[:-len(ext)]
+    out = os.path.join(data_dir, out)
+
+    # Download, hash and extract the stream
+    logging.info("Downloading and extracting data from {0}...".format(url))
+    algorithm, md5sum = parse_checksum(md5sum or "")
+    m = new_hash(algorithm)
+    staging_dir = tempfile.mkdtemp(prefix=".", dir=data_dir)
+    matched = False
+    done = False
+    try:
+        data = open_url(url, pool=pool)
+        try:
+            with open(temp_fname, "wb") as local_file:
+                reader = HashingReader(data, m, copy=local_file)
+                tar = tarfile.open(fileobj=reader, mode="r|*")
+                for member in tar:
+                    if (members is None or
+                            select_members([member.name], members)):
+                        check_tar_member(member, staging_dir)
+                        tar.extract(member, path=staging_dir)
+                        matched = True
+                tar.close()
+                # Read the end of the stream, after the last member
+                while reader.read(CHUNK_SIZE):
+                    pass
+        finally:
+            data.close()
+
+        # Roll back the extraction if the checksum is invalid
+        digest = m.hexdigest()
+        if md5sum is not None and digest != md5sum:
+            raise ValueError("File {0} checksum verification has failed. "
+                             "Dataset download aborted.".format(fname))
+        logging.info("The downloaded file is valid ({0} sum "
+                     "check).".format(algorithm))
+        if members is not None and not matched:
+            raise IOError("Uncompress: no member matches {0} in {1}.".format(
+                members, fname))
+
+        # Move the archive and the extracted members
+        shutil.move(temp_fname, download_fname)
+        checksum_cache(data_dir).set(download_fname, digest, algorithm)
+        _merge_tree(staging_dir, data_dir)
+        _record_members(download_fname, members)
+        done = True
+    except (urllib2.URLError, tarfile.TarError, IOError), e:
+        raise Exception("{0}\nError while downloading file '{1}'. "
+                        "Dataset download aborted.".format(e, url))
+    finally:
+        shutil.rmtree(staging_dir)
+        if not done and os.path.exists(temp_fname):
+            os.remove(temp_fname)
+    logging.info("...done.")
+
+    return out
 
 
 if __name__ == "__main__":